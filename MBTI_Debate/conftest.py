@@ -0,0 +1,67 @@
+# 测试公用的假模型：不访问任何外部服务，回复由提示词决定（同一提示词总是得到同样的回复），记录调用次数
+# 用法（在 MBTI_Debate 目录下）：pytest
+import hashlib
+import os
+from types import SimpleNamespace
+
+# 在导入 llm_client / resilience 之前设置：不需要真实的接入信息，测试中不限流
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://localhost")
+os.environ.setdefault("DEEPSEEK_API_KEY", "test")
+os.environ.setdefault("DEBATE_LLM_RPS", "0")
+
+import pytest  # noqa: E402
+
+from llm_client import PROMPTS, DebateLLM  # noqa: E402
+
+
+def _chunk(content: str, finish_reason: str = None, usage: dict = None):
+    return SimpleNamespace(content=content, usage_metadata=usage,
+                           response_metadata={"finish_reason": finish_reason} if finish_reason else {})
+
+
+class FakeChatModel:
+    """模仿 ChatOpenAI 的 astream / ainvoke：回复分两段流式返回，最后一个片段带结束原因和 token 用量"""
+
+    model_name = "fake-model"
+    temperature = 0.0
+    max_tokens = 100
+
+    def __init__(self):
+        self.calls = 0
+
+    @staticmethod
+    def reply(prompt: str) -> str:
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"观点{digest}。论据{digest}。【分析{digest}】"
+
+    async def astream(self, prompt: str):
+        self.calls += 1
+        text = self.reply(prompt)
+        yield _chunk(text[:6])
+        yield _chunk(text[6:])
+        yield _chunk("", "stop", {"input_tokens": len(prompt), "output_tokens": len(text)})
+
+    async def ainvoke(self, prompt: str):
+        self.calls += 1
+        text = self.reply(prompt)
+        return SimpleNamespace(content=text, usage_metadata={"input_tokens": len(prompt), "output_tokens": len(text)},
+                               response_metadata={"finish_reason": "stop"})
+
+
+class FakeDebateLLM(DebateLLM):
+    """各环节链条的模型换成 FakeChatModel 的 DebateLLM（链条只用到 prompt 和 llm 两个属性）"""
+
+    def __init__(self, model: FakeChatModel = None, **kwargs):
+        self.model = model or FakeChatModel()
+        super().__init__(**kwargs)
+
+    def _init_llm(self):
+        return self.model
+
+    def _shared_chain(self, name: str):
+        return SimpleNamespace(prompt=PROMPTS[name], llm=self.model)
+
+
+@pytest.fixture
+def fake_llm():
+    return FakeDebateLLM(mode="live", max_retries=0)
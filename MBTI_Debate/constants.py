@@ -23,4 +23,14 @@ STAGES = {
     "CROSS_EXAMINATION": "攻辩",
     "FREE_DEBATE": "自由辩论",
     "SUMMARY": "总结陈词"
-}
\ No newline at end of file
+}
+
+# 各环节传给模型的历史发言模式：
+#   ("full", None)      全部历史发言
+#   ("bounded", K)      最近 K 条发言原文 + 更早发言的双方滚动摘要，自由辩论轮数很多时避免提示词随轮次线性增长
+CONTEXT_MODES = {
+    "立论": ("full", None),
+    "攻辩": ("full", None),
+    "自由辩论": ("bounded", 6),
+    "总结陈词": ("full", None)
+}
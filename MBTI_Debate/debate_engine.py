@@ -1,38 +1,77 @@
+import asyncio
 from typing import List, Dict, Callable, Optional
 from debate_manager import DebateManager
 
+
+def _iterate(events):
+    """在私有事件循环中逐个取出异步生成器的事件，调用方停止迭代时关闭生成器并取消遗留的后台任务"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(events.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(events.aclose())
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
 class DebateEngine:
     def __init__(self, manager):
         self.manager = manager
         self.callback = None
 
-    def run_full_debate(self, free_debate_rounds: int = 10):
-        """运行完整辩论流程，并以生成器的方式流式输出每条发言内容"""
-        def stage_callback(speech):
-            yield speech
-
+    async def astream_debate(self, free_debate_rounds: int = 10, stream_tokens: bool = False,
+                             speculative: bool = False):
+        """
+        按环节顺序运行完整辩论（异步生成器），多场辩论可在同一个事件循环中同时运行：
+        默认每条发言完成后立即产出该发言；stream_tokens=True 时产出全部事件，
+        包括逐段的 {"type": "delta", agent_id, stage, round, text} 和发言完成时的 {"type": "speech", ...}
+        speculative=True 时自由辩论提前生成下一条发言，见 DebateManager.run_free_debate_stage
+        """
         stages = [
             self.manager.run_argument_stage,
             self.manager.run_cross_examination_stage,
-            lambda: self.manager.run_free_debate_stage(max_rounds=free_debate_rounds),
+            lambda: self.manager.run_free_debate_stage(max_rounds=free_debate_rounds, speculative=speculative),
             self.manager.run_summary_stage
         ]
 
         for stage in stages:
-            prev_count = len(self.manager.state.speaker_history)
-            stage()
-            new_speeches = self.manager.state.speaker_history[prev_count:]
-            for speech in new_speeches:
-                yield speech
+            async for event in stage():
+                if stream_tokens:
+                    yield event
+                elif event["type"] == "speech":
+                    yield event["speech"]
+
+    def run_full_debate(self, free_debate_rounds: int = 10, stream_tokens: bool = False, speculative: bool = False):
+        """
+        运行完整辩论流程，并以生成器的方式流式输出（参数与产出同 astream_debate）
+        在私有事件循环中驱动 astream_debate，供同步代码调用；已在事件循环中时请直接使用 astream_debate
+        """
+        yield from _iterate(self.astream_debate(free_debate_rounds, stream_tokens, speculative))
+
+    async def arun_full_debate(self, free_debate_rounds: int = 10, max_concurrency: int = 4, prepared: bool = False,
+                               resume=None):
+        """
+        异步运行完整辩论：互不依赖的发言并发生成（同时最多 max_concurrency 个），按发言顺序产出每条发言；
+        prepared=True 时双方立论同时起草、总结陈词与自由辩论并行起草，见 DebateManager.build_speech_plan；
+        resume 为已记录的发言，从中断处续跑（见 DebateManager.run_scheduled）
+        """
+        async for event in self.manager.run_scheduled(free_debate_rounds, max_concurrency, prepared, resume):
+            yield event["speech"]
 
     def _run_stage_with_callback(self, stage_func):
         """执行环节并触发回调"""
-        prev_count = len(self.manager.state.speaker_history)
-        stage_func()
-        new_speeches = self.manager.state.speaker_history[prev_count:]
-        if self.callback:
-            for speech in new_speeches:
-                self.callback(speech)  # 触发回调，传入单条发言
+        for event in _iterate(stage_func()):
+            if self.callback and event["type"] == "speech":
+                self.callback(event["speech"])  # 触发回调，传入单条发言
     def get_debate_state(self):
-        """获取当前辩论状态"""
+        """获取当前辩论状态（state.report() 为本场按环节、轮次、辩手统计的耗时与 token 报告）"""
         return self.manager.state
\ No newline at end of file
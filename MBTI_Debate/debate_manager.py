@@ -1,8 +1,12 @@
-from typing import List, Dict
+from typing import List, Dict, AsyncIterator
 import random
-from debate_state import DebateState
+import time
+from debate_state import DebateState, Speech
 from llm_client import DebateLLM
-from constants import STAGES
+from constants import STAGES, CONTEXT_MODES
+from transcript import TranscriptBuilder
+from scheduler import SpeechSpec, run_speech_plan
+from speculation import Speculation
 import re
 from text_utils import extract_analysis  # 导入文本处理工具
 
@@ -10,10 +14,23 @@ from text_utils import extract_analysis  # 导入文本处理工具
 class DebateManager:
     """管理辩论流程"""
 
-    def __init__(self, topic: str = None):
+    def __init__(self, topic: str = None, context_modes: Dict[str, tuple] = None, seed: int = None,
+                 llm: DebateLLM = None, verbose: bool = True, temperature: float = None,
+                 speech_log=None, debate_id: str = None):
         self.topic = topic if topic else self._get_topic_from_user()
-        self.state = DebateState()
-        self.llm = DebateLLM()
+        # 传入 speech_log（speech_log.SpeechLog）时每条发言完成即追加到磁盘日志，debate_id 标识本场辩论
+        self.state = DebateState(speech_log, debate_id)
+        # 自由辩论的发言人由带种子的随机数生成器选择，同一种子得到相同的发言顺序，便于提前规划发言
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # 各环节的历史发言模式，未指定的环节使用 constants.CONTEXT_MODES
+        self.context_modes = {**CONTEXT_MODES, **(context_modes or {})}
+        self.transcript = TranscriptBuilder(self.state.mbti_map)
+        # 批量辩论时多个实例共享同一个（限流的）客户端；未传入时按本场的 temperature 从共享池取客户端
+        self.llm = llm or DebateLLM(temperature=temperature)
+        self.verbose = verbose  # False 时不打印发言，多场辩论并发运行时避免输出交错
+        self.turn_latencies: List[dict] = []  # 自由辩论每次换人的间隔（见 run_free_debate_stage）
+        self._pending_calls: Dict[int, dict] = {}  # 并发生成中尚未记录的调用统计（按发言序号）
         self._init_chains()
 
     def _init_chains(self):
@@ -22,6 +39,12 @@ class DebateManager:
         self.cross_chain = self.llm.get_cross_examination_chain()
         self.free_chain = self.llm.get_free_debate_chain()
         self.summary_chain = self.llm.get_summary_chain()
+        self.chains = {
+            "argument": self.argument_chain,
+            "cross": self.cross_chain,
+            "free": self.free_chain,
+            "summary": self.summary_chain
+        }
 
     def _get_topic_from_user(self) -> str:
         """从用户输入获取辩题"""
@@ -48,173 +71,302 @@ class DebateManager:
                 print(f"{speaker_id} 使用默认 MBTI：{default_mbti}")
 
     def _get_history_summary(self) -> str:
-        """获取历史发言摘要"""
-        if not self.state.speaker_history:
-            return "（无历史发言）"
+        """获取历史发言摘要（按当前环节的上下文模式，由增量维护的辩论记录生成）"""
+        mode, recent_k = self.context_modes.get(self.state.stage, ("full", None))
+        return self.transcript.render(mode, recent_k)
 
-        summary = "\n\n".join([
-            f"轮次{sp['round']} [{sp['stage']}] {sp['agent_id']}（{self.state.mbti_map[sp['agent_id']]}）:\n{sp['content']}"
-            for sp in self.state.speaker_history
-        ])
-        return summary
+    def _record_speech(self, agent_id: str, result: str) -> str:
+        """拆分分析性内容、记录发言并打印，返回辩论正文"""
+        debate_content, analysis_list = extract_analysis(result)
+        self.state.add_speech(agent_id, debate_content, analysis_list)
+        self.transcript.append(agent_id, self.state.current_round, self.state.stage, debate_content)
+        if self.verbose:
+            print(f"轮次{self.state.current_round} [{self.state.stage}] {agent_id}:")
+            print(debate_content)  # 打印辩论正文
+        return debate_content
 
-    def run_argument_stage(self):
-        """执行立论环节"""
-        print(f"\n=== {STAGES['ARGUMENT']}环节（轮次{self.state.current_round}-{self.state.current_round + 1}）===")
+    def _call_stats(self, agent_id: str) -> dict:
+        """一次模型调用的统计字典，先放入 (环节, 轮次, 辩手)，其余字段由 DebateLLM 填写"""
+        return {"stage": self.state.stage, "round": self.state.current_round, "agent_id": agent_id}
 
-        # 正方一辩（pro1）立论
-        result = self.argument_chain.run(
+    def _record_call(self, stats: dict):
+        """记录一次模型调用的统计，发言被 max_tokens 截断时给出提示"""
+        self.state.metrics.record(stats)
+        if self.verbose and stats.get("finish_reason") == "length":
+            print(f"（提示：轮次{stats['round']} {stats['agent_id']} 的发言达到 max_tokens 上限被截断）")
+
+    def _speech_inputs(self, agent_id: str, position: str, speakers: str, history: str) -> dict:
+        """组装链条的输入变量"""
+        return dict(
             topic=self.topic,
-            history="",
-            speakers="正方一辩（pro1）",
-            position="正方",
-            speaker_id="pro1",
-            mbti=self.state.mbti_map["pro1"],
-            mbti_style=self.state.get_mbti_style("pro1")
+            history=history,
+            speakers=speakers,
+            position=position,
+            speaker_id=agent_id,
+            mbti=self.state.mbti_map[agent_id],
+            mbti_style=self.state.get_mbti_style(agent_id)
         )
-        # 调用 extract_analysis 拆分内容
-        debate_content, analysis_list = extract_analysis(result)
-        self.state.add_speech("pro1", debate_content, analysis_list)
-        print(f"轮次{self.state.current_round} [{self.state.stage}] {self.state.speaker_history[-1]['agent_id']}:")
-        print(debate_content)  # 打印辩论正文
+
+    async def _speak(self, chain, agent_id: str, position: str, speakers: str, history: str,
+                     source: AsyncIterator[str] = None, stats: dict = None):
+        """
+        流式生成一条发言：逐段产出 {"type": "delta", agent_id, stage, round, text}，
+        发言完成后拆分分析性内容并记录，再产出 {"type": "speech", agent_id, stage, round, speech}
+        source 为已开始的生成（如自由辩论提前生成的发言）及其调用统计 stats，为空时现场调用链条
+        """
+        meta = {"agent_id": agent_id, "stage": self.state.stage, "round": self.state.current_round}
+        if source is None:
+            stats = self._call_stats(agent_id)
+            source = self.llm.astream(chain, seed=self.seed, stats=stats,
+                                      **self._speech_inputs(agent_id, position, speakers, history))
+        parts = []
+        async for delta in source:
+            parts.append(delta)
+            yield {"type": "delta", **meta, "text": delta}
+        self._record_speech(agent_id, "".join(parts))
+        if stats is not None:
+            self._record_call(stats)
+        yield {"type": "speech", **meta, "speech": self.state.speaker_history[-1]}
+
+    async def run_argument_stage(self):
+        """执行立论环节（异步生成器，产出发言事件）"""
+        if self.verbose:
+            print(f"\n=== {STAGES['ARGUMENT']}环节（轮次{self.state.current_round}-{self.state.current_round + 1}）===")
+
+        # 正方一辩（pro1）立论
+        async for event in self._speak(self.argument_chain, "pro1", "正方", "正方一辩（pro1）", history=""):
+            yield event
         self.state.next_round()
 
         # 反方一辩（opp1）立论
-        result = self.argument_chain.run(
-            topic=self.topic,
-            history=self.state.speaker_history[0]['content'],
-            speakers="反方一辩（opp1）",
-            position="反方",
-            speaker_id="opp1",
-            mbti=self.state.mbti_map["opp1"],
-            mbti_style=self.state.get_mbti_style("opp1")
-        )
-        debate_content, analysis_list = extract_analysis(result)
-        self.state.add_speech("opp1", debate_content, analysis_list)
-        print(f"轮次{self.state.current_round} [{self.state.stage}] {self.state.speaker_history[-1]['agent_id']}:")
-        print(debate_content)  # 打印辩论正文
+        async for event in self._speak(self.argument_chain, "opp1", "反方", "反方一辩（opp1）",
+                                       history=self.state.speaker_history[0]['content']):
+            yield event
         self.state.next_round()
 
         # 切换环节
         self.state.switch_stage(STAGES["CROSS_EXAMINATION"])
 
-    def run_cross_examination_stage(self):
-        """执行攻辩环节"""
-        print(
-            f"\n=== {STAGES['CROSS_EXAMINATION']}环节（轮次{self.state.current_round}-{self.state.current_round + 3}）===")
+    async def run_cross_examination_stage(self):
+        """执行攻辩环节（异步生成器，产出发言事件）"""
+        if self.verbose:
+            print(f"\n=== {STAGES['CROSS_EXAMINATION']}环节"
+                  f"（轮次{self.state.current_round}-{self.state.current_round + 3}）===")
         speakers_pair = [("pro2", "opp2"), ("pro3", "opp3")]  # 攻辩组合
 
         for idx, (pro_speaker, opp_speaker) in enumerate(speakers_pair, start=1):
             # 正方向反方质询（轮次3、5）
             self.state.current_round = 3 + 2 * (idx - 1)
-            result = self.cross_chain.run(
-                topic=self.topic,
-                history=self._get_history_summary(),
-                speakers=f"正方{pro_speaker}质询反方{opp_speaker}",
-                position="正方",
-                speaker_id=pro_speaker,
-                mbti=self.state.mbti_map[pro_speaker],
-                mbti_style=self.state.get_mbti_style(pro_speaker)
-            )
-            debate_content, analysis_list = extract_analysis(result)
-            self.state.add_speech(pro_speaker, debate_content, analysis_list)
-            print(f"轮次{self.state.current_round} [{self.state.stage}] {pro_speaker}:")
-            print(debate_content)  # 打印辩论正文
+            async for event in self._speak(self.cross_chain, pro_speaker, "正方", f"正方{pro_speaker}质询反方{opp_speaker}",
+                                           history=self._get_history_summary()):
+                yield event
             self.state.next_round()
 
             # 反方回应（轮次4、6）
-            result = self.cross_chain.run(
-                topic=self.topic,
-                history=self._get_history_summary(),
-                speakers=f"反方{opp_speaker}回应{pro_speaker}",
-                position="反方",
-                speaker_id=opp_speaker,
-                mbti=self.state.mbti_map[opp_speaker],
-                mbti_style=self.state.get_mbti_style(opp_speaker)
-            )
-            debate_content, analysis_list = extract_analysis(result)
-            self.state.add_speech(opp_speaker, debate_content, analysis_list)
-            print(f"轮次{self.state.current_round} [{self.state.stage}] {opp_speaker}:")
-            print(debate_content)  # 打印辩论正文
+            async for event in self._speak(self.cross_chain, opp_speaker, "反方", f"反方{opp_speaker}回应{pro_speaker}",
+                                           history=self._get_history_summary()):
+                yield event
             self.state.next_round()
 
         # 切换环节
         self.state.switch_stage(STAGES["FREE_DEBATE"])
 
-    def run_free_debate_stage(self, max_rounds: int = 10):
-        """执行自由辩论环节"""
-        print(f"\n=== {STAGES['FREE_DEBATE']}环节（轮次{self.state.current_round}开始，最多{max_rounds}轮）===")
+    def _free_speaker(self, turn: int) -> tuple:
+        """自由辩论第 turn 轮的发言人：正方先发言、正反交替，从己方辩手中随机选一位"""
+        if turn % 2 == 0:
+            return self.rng.choice(self.state.pro_team), "正方"
+        return self.rng.choice(self.state.opp_team), "反方"
 
-        # 拆分正方和反方辩手池
-        pro_pool = self.state.pro_team  # 正方辩手
-        opp_pool = self.state.opp_team  # 反方辩手
+    async def run_free_debate_stage(self, max_rounds: int = 10, speculative: bool = False):
+        """
+        执行自由辩论环节（异步生成器，产出发言事件）
+        speculative=True 时，第 N 条发言开始生成的同时在后台提前生成第 N+1 条：
+        - 发言人在环节开始时全部选定（与逐轮选择得到的随机序列相同），因此能提前知道下一位发言人
+        - 提前生成使用与第 N 条相同的历史发言（前缀稳定，不含第 N 条），代价是该发言无法针对上一条发言反驳
+        - 第 N 条正常结束（有正文且未被截断）时采用提前生成的结果，出错、为空或被截断时丢弃，第 N+1 条改为现场生成
+        每轮从上一条发言结束到下一条发言第一个片段的间隔记录在 self.turn_latencies 中
+        """
+        if self.verbose:
+            print(f"\n=== {STAGES['FREE_DEBATE']}环节（轮次{self.state.current_round}开始，最多{max_rounds}轮）===")
 
-        turn = 0  # 0=正方发言，1=反方发言（确保正方先开始）
+        turns = [self._free_speaker(turn) for turn in range(max_rounds)]
+        speculation = None  # 为本轮提前开始的生成
+        speculation_stats = None
+        last_end = None
 
-        for _ in range(max_rounds):
-            if turn % 2 == 0:
-                # 正方随机选一位辩手发言
-                speaker_id = random.choice(pro_pool)
-                position = "正方"
-            else:
-                # 反方随机选一位辩手发言
-                speaker_id = random.choice(opp_pool)
-                position = "反方"
+        for turn, (speaker_id, position) in enumerate(turns):
+            history = self._get_history_summary()
+            inputs = self._speech_inputs(speaker_id, position, f"{position} {speaker_id}", history)
+            source = stats = None
+            if speculation:
+                stats = speculation_stats
+
+                def fallback(stats=stats, inputs=inputs):
+                    stats["speculative"] = False
+                    return self.llm.astream(self.free_chain, seed=self.seed, stats=stats, **inputs)
+
+                source = speculation.deltas(fallback)
+
+            next_speculation = next_stats = None
+            if speculative and turn + 1 < len(turns):
+                next_id, next_position = turns[turn + 1]
+                next_inputs = self._speech_inputs(next_id, next_position, f"{next_position} {next_id}", history)
+                next_stats = {"stage": self.state.stage, "round": self.state.current_round + 1, "agent_id": next_id,
+                              "speculative": True}
+                next_speculation = Speculation(
+                    lambda stats=next_stats, inputs=next_inputs: self.llm.astream(self.free_chain, seed=self.seed,
+                                                                                 stats=stats, **inputs))
 
             # 生成发言
-            result = self.free_chain.run(
-                topic=self.topic,
-                history=self._get_history_summary(),
-                speakers=f"{position} {speaker_id}",
-                position=position,
-                speaker_id=speaker_id,
-                mbti=self.state.mbti_map[speaker_id],
-                mbti_style=self.state.get_mbti_style(speaker_id)
-            )
-            debate_content, analysis_list = extract_analysis(result)
-            self.state.add_speech(speaker_id, debate_content, analysis_list)
-            print(f"轮次{self.state.current_round} [{self.state.stage}] {speaker_id}:")
-            print(debate_content)  # 打印辩论正文
+            try:
+                first = True
+                async for event in self._speak(self.free_chain, speaker_id, position, f"{position} {speaker_id}",
+                                               history=history, source=source, stats=stats):
+                    if first and last_end is not None:
+                        self.turn_latencies.append({
+                            "round": self.state.current_round,
+                            "agent_id": speaker_id,
+                            "speculative": speculation is not None,
+                            "gap_s": round(time.perf_counter() - last_end, 3)
+                        })
+                    first = False
+                    yield event
+            except BaseException:
+                # 第 N 条出错或调用方停止迭代：丢弃提前生成的第 N+1 条，同样计入统计
+                if next_speculation:
+                    next_speculation.discard()
+                    self._record_call({**next_stats, "discarded": True})
+                raise
+            last_end = time.perf_counter()
+
+            truncated = self.state.metrics.calls[-1].get("finish_reason") == "length"
+            if next_speculation and (truncated or not self.state.speaker_history[-1]['content']):
+                next_speculation.discard()
+                # 丢弃的提前生成也计入统计（已消耗 token），此时可能尚未结束
+                self._record_call({**next_stats, "discarded": True})
+                next_speculation = None
+            speculation, speculation_stats = next_speculation, next_stats
 
             self.state.next_round()
-            turn += 1  # 切换发言方
+
+        if self.verbose and self.turn_latencies:
+            gaps = [item["gap_s"] for item in self.turn_latencies]
+            print(f"自由辩论平均换人间隔：{sum(gaps) / len(gaps):.2f}秒")
 
         # 切换环节
         self.state.switch_stage(STAGES["SUMMARY"])
 
-    def run_summary_stage(self):
-        """执行总结陈词环节"""
-        print(f"\n=== {STAGES['SUMMARY']}环节（轮次{self.state.current_round}-{self.state.current_round + 1}）===")
+    async def run_summary_stage(self):
+        """执行总结陈词环节（异步生成器，产出发言事件）"""
+        if self.verbose:
+            print(f"\n=== {STAGES['SUMMARY']}环节（轮次{self.state.current_round}-{self.state.current_round + 1}）===")
 
         # 反方四辩（opp4）总结
         self.state.current_round = 8
-        result = self.summary_chain.run(
-            topic=self.topic,
-            history=self._get_history_summary(),
-            speakers="反方四辩（opp4）",
-            position="反方",
-            speaker_id="opp4",
-            mbti=self.state.mbti_map["opp4"],
-            mbti_style=self.state.get_mbti_style("opp4")
-        )
-        debate_content, analysis_list = extract_analysis(result)
-        self.state.add_speech("opp4", debate_content, analysis_list)
-        print(f"轮次{self.state.current_round} [{self.state.stage}] opp4:")
-        print(debate_content)  # 打印辩论正文
+        async for event in self._speak(self.summary_chain, "opp4", "反方", "反方四辩（opp4）",
+                                       history=self._get_history_summary()):
+            yield event
         self.state.next_round()
 
         # 正方四辩（pro4）总结
-        result = self.summary_chain.run(
-            topic=self.topic,
-            history=self._get_history_summary(),
-            speakers="正方四辩（pro4）",
-            position="正方",
-            speaker_id="pro4",
-            mbti=self.state.mbti_map["pro4"],
-            mbti_style=self.state.get_mbti_style("pro4")
-        )
-        debate_content, analysis_list = extract_analysis(result)
-        self.state.add_speech("pro4", debate_content, analysis_list)
-        print(f"轮次{self.state.current_round} [{self.state.stage}] pro4:")
-        print(debate_content)  # 打印辩论正文
-        self.state.next_round()
\ No newline at end of file
+        async for event in self._speak(self.summary_chain, "pro4", "正方", "正方四辩（pro4）",
+                                       history=self._get_history_summary()):
+            yield event
+        self.state.next_round()
+
+    def build_speech_plan(self, free_debate_rounds: int = 10, prepared: bool = False) -> List[SpeechSpec]:
+        """
+        按环节顺序列出全部发言及其依赖，轮次编号与逐环节执行时一致
+        - 默认：每条发言依赖前一条，生成结果与逐环节执行相同
+        - prepared=True（准备稿模式）：双方一辩立论互不依赖、同时起草；双方总结陈词在攻辩结束后即开始起草，
+          与自由辩论并行（总结陈词只参考立论和攻辩，反方四辩的发言正方四辩也看不到）
+        """
+        plan = []
+
+        def add(agent_id, stage, round_no, position, speakers, chain, history, deps=None):
+            index = len(plan)
+            deps = (index - 1,) if deps is None and index else (deps or ())
+            plan.append(SpeechSpec(index, agent_id, stage, round_no, position, speakers, chain, history, tuple(deps)))
+
+        # 立论（与 run_argument_stage 相同，从当前轮次开始）
+        round_no = self.state.current_round
+        add("pro1", STAGES["ARGUMENT"], round_no, "正方", "正方一辩（pro1）", "argument", "none")
+        add("opp1", STAGES["ARGUMENT"], round_no + 1, "反方", "反方一辩（opp1）", "argument",
+            "none" if prepared else "opening", deps=() if prepared else None)
+
+        # 攻辩：质询和回应依赖之前的全部发言（按顺序记录，依赖前一条即依赖全部）
+        for idx, (pro_speaker, opp_speaker) in enumerate([("pro2", "opp2"), ("pro3", "opp3")], start=1):
+            round_no = 3 + 2 * (idx - 1)
+            add(pro_speaker, STAGES["CROSS_EXAMINATION"], round_no, "正方", f"正方{pro_speaker}质询反方{opp_speaker}",
+                "cross", "transcript")
+            add(opp_speaker, STAGES["CROSS_EXAMINATION"], round_no + 1, "反方", f"反方{opp_speaker}回应{pro_speaker}",
+                "cross", "transcript")
+        cross_end = len(plan) - 1
+
+        # 自由辩论：发言人提前由 self.rng 选定，正反交替
+        for turn in range(free_debate_rounds):
+            speaker_id, position = self._free_speaker(turn)
+            add(speaker_id, STAGES["FREE_DEBATE"], 7 + turn, position, f"{position} {speaker_id}", "free", "transcript")
+
+        # 总结陈词（轮次从8开始，与 run_summary_stage 一致）
+        summary_deps = range(cross_end + 1) if prepared else None
+        add("opp4", STAGES["SUMMARY"], 8, "反方", "反方四辩（opp4）", "summary", "transcript", deps=summary_deps)
+        add("pro4", STAGES["SUMMARY"], 9, "正方", "正方四辩（pro4）", "summary", "transcript", deps=summary_deps)
+        return plan
+
+    def _render_history(self, spec: SpeechSpec) -> str:
+        """按发言计划中的历史来源渲染历史发言"""
+        if spec.history == "opening":
+            return self.state.speaker_history[0]['content']
+        if spec.history == "transcript":
+            mode, recent_k = self.context_modes.get(spec.stage, ("full", None))
+            return self.transcript.render(mode, recent_k)
+        return ""
+
+    async def _generate(self, spec: SpeechSpec, history: str) -> str:
+        stats = {"stage": spec.stage, "round": spec.round, "agent_id": spec.agent_id}
+        self._pending_calls[spec.index] = stats
+        return await self.llm.arun(self.chains[spec.chain], seed=self.seed, stats=stats,
+                                   **self._speech_inputs(spec.agent_id, spec.position, spec.speakers, history))
+
+    def _commit(self, spec: SpeechSpec, result: str) -> dict:
+        """按计划顺序记录一条发言，返回发言事件"""
+        if self.verbose and (spec.stage != self.state.stage or not self.state.speaker_history):
+            print(f"\n=== {spec.stage}环节 ===")
+        self.state.stage = spec.stage
+        self.state.current_round = spec.round
+        self._record_speech(spec.agent_id, result)
+        self._record_call(self._pending_calls.pop(spec.index))
+        self.state.next_round()
+        return {"type": "speech", "agent_id": spec.agent_id, "stage": spec.stage, "round": spec.round,
+                "speech": self.state.speaker_history[-1]}
+
+    def _restore(self, plan: List[SpeechSpec], speeches: List[Speech]) -> int:
+        """把日志中已记录的发言按计划顺序恢复到状态和辩论记录中，遇到与计划不符的发言即停止，返回恢复的条数"""
+        restored = 0
+        for spec, speech in zip(plan, speeches):
+            if (speech.agent_id, speech.stage, speech.round) != (spec.agent_id, spec.stage, spec.round):
+                break
+            self.state.restore_speech(speech)
+            self.transcript.append(speech.agent_id, speech.round, speech.stage, speech.content)
+            self.state.next_round()
+            restored += 1
+        return restored
+
+    async def run_scheduled(self, free_debate_rounds: int = 10, max_concurrency: int = 4, prepared: bool = False,
+                            resume: List[Speech] = None):
+        """
+        按依赖关系并发生成全部发言（异步生成器），按发言顺序产出发言事件，
+        辩论记录的顺序与逐环节执行时相同
+        resume 为本场辩论已记录的发言（如 SpeechLog.collect 的结果），续跑时这些发言不再生成，也不产出事件；
+        续跑需使用与之前相同的种子和参数，发言计划才能对上；对不上的部分丢弃重新生成，
+        并在发言日志中写入截断标记，下次 collect 不再返回这些旧发言
+        """
+        plan = self.build_speech_plan(free_debate_rounds, prepared)
+        resume = resume or []
+        done = self._restore(plan, resume)
+        if done < len(resume) and self.state.speech_log is not None:
+            self.state.speech_log.truncate(self.state.debate_id, done)
+        async for event in run_speech_plan(plan, self._render_history, self._generate, self._commit,
+                                           max_concurrency=max_concurrency, done=done):
+            yield event
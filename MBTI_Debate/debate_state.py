@@ -1,14 +1,59 @@
+import sys
 from typing import List, Dict
 from constants import MBTI_STYLES
+from instrumentation import DebateMetrics
+
+
+class Speech:
+    """
+    一条发言记录：用 __slots__ 存储，agent_id 和 stage 驻留（同一辩手、同一环节的字符串只保存一份）
+    支持 speech['content']、speech.get('analysis') 等按键访问，兼容原来的字典记录
+    """
+    __slots__ = ("agent_id", "round", "stage", "content", "analysis")
+
+    def __init__(self, agent_id: str, round: int, stage: str, content: str, analysis: List[str] = None):
+        self.agent_id = sys.intern(agent_id)
+        self.round = round
+        self.stage = sys.intern(stage)
+        self.content = content  # 辩论正文
+        self.analysis = list(analysis) if analysis else []  # 分析性内容列表
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Speech":
+        return cls(data["agent_id"], data["round"], data["stage"], data["content"], data.get("analysis"))
+
+    def __eq__(self, other):
+        return isinstance(other, Speech) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Speech({self.agent_id}, 轮次{self.round}, {self.stage})"
 
 
 class DebateState:
     """管理辩论赛全局状态（轮次、环节、历史发言等）"""
 
-    def __init__(self):
+    def __init__(self, speech_log=None, debate_id: str = None):
         self.current_round = 1  # 总轮次
         self.stage = "立论"  # 当前环节
-        self.speaker_history = []  # 存储所有发言
+        self.speaker_history: List[Speech] = []  # 存储所有发言
+        # 可选的追加写入日志（speech_log.SpeechLog），每条发言完成时写入磁盘
+        self.speech_log = speech_log
+        self.debate_id = debate_id
+        self.metrics = DebateMetrics()  # 每次模型调用的耗时、token 数、结束原因等
         self.pro_team = ["pro1", "pro2", "pro3", "pro4"]  # 正方辩手
         self.opp_team = ["opp1", "opp2", "opp3", "opp4"]  # 反方辩手
 
@@ -18,15 +63,23 @@ class DebateState:
             "opp1": "ISTJ", "opp2": "ESTJ", "opp3": "ESFP", "opp4": "INFJ"
         }
 
-    def add_speech(self, agent_id: str, content: str, analysis: list[str] = []):
-        """记录一轮发言，新增 analysis 字段存储分析性内容列表"""
-        self.speaker_history.append({
-            "agent_id": agent_id,
-            "round": self.current_round,
-            "stage": self.stage,
-            "content": content,      # 辩论正文
-            "analysis": analysis     # 分析性内容列表
-        })
+    def add_speech(self, agent_id: str, content: str, analysis: List[str] = None) -> Speech:
+        """记录一轮发言（analysis 为分析性内容列表），设置了发言日志时同时追加到日志"""
+        speech = Speech(agent_id, self.current_round, self.stage, content, analysis)
+        self.speaker_history.append(speech)
+        if self.speech_log is not None:
+            self.speech_log.append(self.debate_id, speech)
+        return speech
+
+    def restore_speech(self, speech: Speech):
+        """恢复一条已记录过的发言（从日志续跑时使用，不再写入日志）"""
+        self.stage = speech.stage
+        self.current_round = speech.round
+        self.speaker_history.append(speech)
+
+    def report(self) -> dict:
+        """本场辩论按环节、辩手汇总的计时与 token 报告（见 instrumentation.DebateMetrics.report）"""
+        return self.metrics.report()
 
     def next_round(self):
         """进入下一轮次"""
@@ -0,0 +1,66 @@
+from typing import Dict, List
+
+# DebateLLM 每次调用填写的统计字段（调用方可在同一个字典里预先放入 stage / round / agent_id 等标识）
+CALL_STATS_DEFAULTS = {
+    "latency_s": None,  # 调用总耗时
+    "first_token_s": None,  # 流式调用收到第一个片段的耗时
+    "prompt_tokens": None,
+    "completion_tokens": None,
+    "finish_reason": None,  # "length" 表示被 max_tokens 截断
+    "retries": 0,
+    "cached": False,  # 命中回复缓存，未调用模型
+}
+
+
+def _aggregate(calls: List[dict]) -> dict:
+    """
+    汇总一组调用；token 数只累计模型返回了用量的调用（命中缓存记为 0），
+    tokens_missing 为未返回用量的调用数，全部缺失时 token 数为 None 而不是 0
+    """
+    latencies = [call["latency_s"] for call in calls if call.get("latency_s") is not None]
+    reported = [call for call in calls if call.get("completion_tokens") is not None]
+    return {
+        "calls": len(calls),
+        "latency_s": round(sum(latencies), 3),
+        "avg_latency_s": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "max_latency_s": max(latencies) if latencies else None,
+        "prompt_tokens": sum(call.get("prompt_tokens") or 0 for call in reported) if reported else None,
+        "completion_tokens": sum(call["completion_tokens"] for call in reported) if reported else None,
+        "tokens_missing": len(calls) - len(reported),
+        "retries": sum(call.get("retries") or 0 for call in calls),
+        "cached": sum(1 for call in calls if call.get("cached")),
+        "truncated": sum(1 for call in calls if call.get("finish_reason") == "length"),
+    }
+
+
+class DebateMetrics:
+    """记录一场辩论中每次模型调用的 (环节, 轮次, 辩手)、耗时、token 数、结束原因和重试次数，并按环节和辩手汇总"""
+
+    def __init__(self):
+        self.calls: List[dict] = []
+
+    def record(self, call: dict):
+        self.calls.append(dict(call))
+
+    def _group(self, field: str) -> Dict[str, dict]:
+        groups: Dict[str, List[dict]] = {}
+        for call in self.calls:
+            groups.setdefault(call.get(field), []).append(call)
+        return {key: _aggregate(calls) for key, calls in groups.items()}
+
+    def report(self) -> dict:
+        """
+        本场辩论的计时与 token 报告：
+        totals 全场汇总，by_stage / by_speaker 按环节、辩手汇总，
+        truncated 为被 max_tokens 截断的发言，calls 为逐次调用明细
+        """
+        return {
+            "totals": _aggregate(self.calls),
+            "by_stage": self._group("stage"),
+            "by_speaker": self._group("agent_id"),
+            "truncated": [
+                {"stage": call.get("stage"), "round": call.get("round"), "agent_id": call.get("agent_id")}
+                for call in self.calls if call.get("finish_reason") == "length"
+            ],
+            "calls": list(self.calls),
+        }
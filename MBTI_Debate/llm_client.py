@@ -1,39 +1,43 @@
-from langchain.chat_models import ChatOpenAI
+try:
+    # langchain_openai 的客户端可在流式回复的最后一个片段返回 token 用量（stream_usage）
+    from langchain_openai import ChatOpenAI
+    STREAM_USAGE_KWARGS = {"stream_usage": True}
+except ImportError:
+    # 旧版客户端的流式回复不带用量，这些调用的 token 数记为缺失（见 instrumentation）
+    from langchain.chat_models import ChatOpenAI
+    STREAM_USAGE_KWARGS = {}
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
+import asyncio
+import contextlib
 import os
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
 from dotenv import load_dotenv
+from instrumentation import CALL_STATS_DEFAULTS
+from resilience import (DEBATE_LLM_MAX_RETRIES, DEBATE_LLM_TIMEOUT_S, ConcurrencyLimiter, backoff_delay,
+                        get_rate_limiter, is_retryable)
+from response_cache import CacheMiss, ResponseCache
 
 load_dotenv()
 
+DEFAULT_MODEL = "deepseek-chat"
+DEFAULT_TEMPERATURE = 0.6
+DEFAULT_MAX_TOKENS = 1000  # 增加最大 token 限制，确保完整输出
 
-class DebateLLM:
-    """处理与大语言模型的交互"""
+# 调用模式：live 直接调用模型 / cache 命中缓存时直接返回、未命中时调用并写入 /
+#           record 总是调用模型并写入缓存（录制离线测试用的回复）/ replay 只读缓存，未命中时抛出 CacheMiss
+LLM_MODES = ("live", "cache", "record", "replay")
+DEBATE_LLM_MODE = os.environ.get("DEBATE_LLM_MODE", "live")
+DEBATE_CACHE_DB = os.environ.get("DEBATE_CACHE_DB", "./debate_cache.db")
 
-    def __init__(self):
-        self.llm = self._init_llm()
+_DONE = object()  # 流式拉取结束的标记
 
-    def _init_llm(self) -> ChatOpenAI:
-        """初始化LLM模型"""
-        return ChatOpenAI(
-            model_name="deepseek-chat",
-            temperature=0.6,
-            base_url=os.environ["DEEPSEEK_BASE_URL"],
-            api_key=os.environ["DEEPSEEK_API_KEY"],
-            max_tokens=1000  # 增加最大 token 限制，确保完整输出
-        )
+INPUT_VARIABLES = ["topic", "history", "speakers", "position", "speaker_id", "mbti", "mbti_style"]
 
-    def create_chain(self, prompt_template: str) -> LLMChain:
-        """创建LLMChain"""
-        prompt = PromptTemplate(
-            input_variables=["topic", "history", "speakers", "position", "speaker_id", "mbti", "mbti_style"],
-            template=prompt_template
-        )
-        return LLMChain(llm=self.llm, prompt=prompt)
-
-    def get_argument_chain(self) -> LLMChain:
-        """立论环节链条"""
-        return self.create_chain("""
+# 立论环节提示词
+ARGUMENT_TEMPLATE = """
         你现在是辩论赛的{position}一辩（{speaker_id}），MBTI 类型为{mbti}，辩论风格{mbti_style}。
 
         请围绕辩题「{topic}」，结合你的 MBTI 辩论风格进行立论陈词：
@@ -45,11 +49,10 @@ class DebateLLM:
         - 字数严格控制在300-500字（必须完整输出，不得截断）
         - 语言正式，符合辩论赛风格
         - 回答中去除不必要的字符（比如'*'、'**'等），去除不必要的换行符
-        """)
+        """
 
-    def get_cross_examination_chain(self) -> LLMChain:
-        """攻辩环节链条"""
-        return self.create_chain("""
+# 攻辩环节提示词
+CROSS_EXAMINATION_TEMPLATE = """
         你现在是辩论赛的{position}辩手（{speaker_id}），MBTI 类型为{mbti}，辩论风格{mbti_style}。
         辩题是「{topic}」，当前处于攻辩环节。
 
@@ -65,11 +68,10 @@ class DebateLLM:
         - 必须体现{mbti_style}的辩论特点
         - 语言简洁有力，避免冗余
         - 回答中去除不必要的字符（比如'*'、'**'、'##'等），去除不必要的换行符
-        """)
+        """
 
-    def get_free_debate_chain(self) -> LLMChain:
-        """自由辩论环节链条"""
-        return self.create_chain("""
+# 自由辩论环节提示词
+FREE_DEBATE_TEMPLATE = """
         你现在是辩论赛的{position}辩手（{speaker_id}），MBTI 类型为{mbti}，辩论风格{mbti_style}。
         辩题是「{topic}」，当前处于自由辩论环节。
 
@@ -83,11 +85,10 @@ class DebateLLM:
         {history}
 
         要求：输出纯粹的辩论内容，无需额外说明
-        """)
+        """
 
-    def get_summary_chain(self) -> LLMChain:
-        """总结陈词环节链条"""
-        return self.create_chain("""
+# 总结陈词环节提示词
+SUMMARY_TEMPLATE = """
         你现在是辩论赛的{position}四辩（{speaker_id}），MBTI 类型为{mbti}，辩论风格{mbti_style}。
         辩题是「{topic}」，请结合全场历史发言：
 
@@ -99,4 +100,277 @@ class DebateLLM:
         - 升华价值层面论述
         - 字数控制在400-600字
         - 回答中去除不必要的字符（比如'*'、'**'等），去除不必要的换行符
-        """)
\ No newline at end of file
+        """
+
+# 提示词模板在导入时解析一次，所有辩论共用
+PROMPTS: Dict[str, PromptTemplate] = {
+    name: PromptTemplate(input_variables=INPUT_VARIABLES, template=template)
+    for name, template in {
+        "argument": ARGUMENT_TEMPLATE,
+        "cross": CROSS_EXAMINATION_TEMPLATE,
+        "free": FREE_DEBATE_TEMPLATE,
+        "summary": SUMMARY_TEMPLATE
+    }.items()
+}
+
+# 进程内共享的模型客户端和链条，按 (模型, temperature, max_tokens) 复用；
+# 客户端和 LLMChain 都不保存对话状态，可在多线程和多个事件循环任务间共用
+_clients: Dict[Tuple[str, float, int], ChatOpenAI] = {}
+_chains: Dict[Tuple[Tuple[str, float, int], str], LLMChain] = {}
+_pool_lock = threading.Lock()
+
+
+def get_chat_model(model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                   max_tokens: int = DEFAULT_MAX_TOKENS) -> ChatOpenAI:
+    """获取共享的模型客户端，同样参数只创建一次（复用底层 HTTP 连接）"""
+    key = (model_name, temperature, max_tokens)
+    with _pool_lock:
+        if key not in _clients:
+            _clients[key] = ChatOpenAI(
+                model_name=model_name,
+                temperature=temperature,
+                base_url=os.environ["DEEPSEEK_BASE_URL"],
+                api_key=os.environ["DEEPSEEK_API_KEY"],
+                max_tokens=max_tokens,
+                max_retries=0,  # 重试由 DebateLLM 统一处理（带退避并计入调用统计），客户端内部不再重试
+                **STREAM_USAGE_KWARGS
+            )
+        return _clients[key]
+
+
+def get_shared_chain(name: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                     max_tokens: int = DEFAULT_MAX_TOKENS) -> LLMChain:
+    """获取共享的环节链条（name 为 PROMPTS 中的键），同样参数只创建一次"""
+    key = ((model_name, temperature, max_tokens), name)
+    llm = get_chat_model(model_name, temperature, max_tokens)
+    with _pool_lock:
+        if key not in _chains:
+            _chains[key] = LLMChain(llm=llm, prompt=PROMPTS[name])
+        return _chains[key]
+
+
+class DebateLLM:
+    """处理与大语言模型的交互（底层客户端和链条从进程内共享池获取，temperature 等参数可按场次覆盖）"""
+
+    def __init__(self, max_concurrency: int = None, temperature: float = None, model_name: str = None,
+                 max_tokens: int = None, mode: str = None, cache_path: str = None, timeout_s: float = None,
+                 max_retries: int = None, rate_limiter=None):
+        self.model_name = model_name or DEFAULT_MODEL
+        self.temperature = DEFAULT_TEMPERATURE if temperature is None else temperature
+        self.max_tokens = max_tokens or DEFAULT_MAX_TOKENS
+        self.llm = self._init_llm()
+        # 同一客户端上同时进行的异步调用上限，多场辩论共享一个客户端时用于整体限流；None 为不限
+        # 不绑定事件循环，同一客户端可在多次同步运行（各自的私有事件循环）和多个线程间共用
+        self._limiter = ConcurrencyLimiter(max_concurrency) if max_concurrency else None
+        self.mode = mode or DEBATE_LLM_MODE
+        if self.mode not in LLM_MODES:
+            raise ValueError(f"未知的调用模式：{self.mode}，可选 {LLM_MODES}")
+        self.cache = ResponseCache(cache_path or DEBATE_CACHE_DB) if self.mode != "live" else None
+        # 异步调用（arun / astream）的超时、重试次数和限流；限流默认使用进程内共享的令牌桶（resilience.get_rate_limiter）
+        self.timeout_s = timeout_s or DEBATE_LLM_TIMEOUT_S
+        self.max_retries = DEBATE_LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+
+    def _init_llm(self) -> ChatOpenAI:
+        """初始化LLM模型（从共享池获取）"""
+        return get_chat_model(self.model_name, self.temperature, self.max_tokens)
+
+    def create_chain(self, prompt_template: str) -> LLMChain:
+        """用自定义提示词创建LLMChain（内置环节请用 get_*_chain，复用预编译的模板）"""
+        prompt = PromptTemplate(input_variables=INPUT_VARIABLES, template=prompt_template)
+        return LLMChain(llm=self.llm, prompt=prompt)
+
+    def _shared_chain(self, name: str) -> LLMChain:
+        return get_shared_chain(name, self.model_name, self.temperature, self.max_tokens)
+
+    def _lookup(self, chain: LLMChain, prompt: str, seed: Optional[int]) -> Tuple[str, Optional[str]]:
+        """返回 (缓存键, 缓存的回复)；record 模式不读缓存，replay 模式未命中时抛出 CacheMiss
+        读写缓存是同步的 SQLite 操作，异步调用里放到线程中执行，避免阻塞事件循环"""
+        key = ResponseCache.key(prompt, getattr(chain.llm, "model_name", None), getattr(chain.llm, "temperature", None),
+                                seed, getattr(chain.llm, "max_tokens", None))
+        cached = self.cache.get(key) if self.mode in ("cache", "replay") else None
+        if cached is None and self.mode == "replay":
+            raise CacheMiss(f"回放缓存中没有该提示词的回复（种子 {seed}）")
+        return key, cached
+
+    def _store(self, chain: LLMChain, key: str, prompt: str, seed: Optional[int], response: str):
+        self.cache.put(key, prompt, getattr(chain.llm, "model_name", None),
+                       getattr(chain.llm, "temperature", None), seed, response)
+
+    @staticmethod
+    def _usage(message) -> Tuple[Optional[int], Optional[int]]:
+        """从回复（或流式片段）中取 (提示词 token 数, 生成 token 数)，模型未返回用量时为 None"""
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            return usage.get("input_tokens"), usage.get("output_tokens")
+        token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+        return token_usage.get("prompt_tokens"), token_usage.get("completion_tokens")
+
+    def _note_response(self, stats: dict, message):
+        """把回复中的结束原因和 token 用量写入统计"""
+        finish_reason = (getattr(message, "response_metadata", None) or {}).get("finish_reason")
+        if finish_reason:
+            stats["finish_reason"] = finish_reason
+        prompt_tokens, completion_tokens = self._usage(message)
+        if completion_tokens is not None:
+            stats["prompt_tokens"], stats["completion_tokens"] = prompt_tokens, completion_tokens
+
+    def stream(self, chain: LLMChain, seed: int = None, stats: dict = None, **inputs) -> Iterator[str]:
+        """
+        同步流式调用链条（与 chain.run 使用相同的提示词），逐段返回生成的文本；不做超时、重试和限流，辩论环节使用 astream
+        seed 为本场辩论的随机种子，只用于缓存键；命中缓存时整条回复作为一段返回
+        stats 不为空时写入本次调用的耗时、token 数、结束原因等（字段见 instrumentation.CALL_STATS_DEFAULTS）
+        """
+        stats = {} if stats is None else stats
+        stats.update(CALL_STATS_DEFAULTS)
+        start = time.perf_counter()
+        prompt = chain.prompt.format(**inputs)
+        key = cached = None
+        if self.cache is not None:
+            key, cached = self._lookup(chain, prompt, seed)
+            if cached is not None:
+                stats.update(cached=True, prompt_tokens=0, completion_tokens=0,
+                             latency_s=round(time.perf_counter() - start, 3), first_token_s=0.0)
+                yield cached
+                return
+        parts = []
+        for chunk in chain.llm.stream(prompt):
+            self._note_response(stats, chunk)
+            if chunk.content:
+                if stats["first_token_s"] is None:
+                    stats["first_token_s"] = round(time.perf_counter() - start, 3)
+                parts.append(chunk.content)
+                yield chunk.content
+        stats["latency_s"] = round(time.perf_counter() - start, 3)
+        if self.cache is not None:
+            # 只缓存完整生成的回复，中途中断（如丢弃提前生成）时不会执行到这里
+            self._store(chain, key, prompt, seed, "".join(parts))
+
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        """取得一次调用的名额：先过令牌桶，再占用并发上限（若设置了 max_concurrency）"""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        if self._limiter is None:
+            yield
+        else:
+            async with self._limiter:
+                yield
+
+    async def _retry_wait(self, error: Exception, attempt: int, stats: dict):
+        """可重试的错误且未用完重试次数时退避等待，否则重新抛出"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+        stats["retries"] += 1
+        await asyncio.sleep(backoff_delay(attempt))
+
+    async def arun(self, chain: LLMChain, seed: int = None, stats: dict = None, **inputs) -> str:
+        """
+        异步调用链条（与 chain.arun 使用相同的提示词）：每次尝试超时 timeout_s 秒，
+        超时、限流和服务端临时错误按指数退避重试最多 max_retries 次；缓存和统计规则同 stream
+        """
+        stats = {} if stats is None else stats
+        stats.update(CALL_STATS_DEFAULTS)
+        start = time.perf_counter()
+        prompt = chain.prompt.format(**inputs)
+        key = None
+        if self.cache is not None:
+            key, cached = await asyncio.to_thread(self._lookup, chain, prompt, seed)
+            if cached is not None:
+                stats.update(cached=True, prompt_tokens=0, completion_tokens=0, latency_s=0.0)
+                return cached
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._slot():
+                    message = await asyncio.wait_for(chain.llm.ainvoke(prompt), self.timeout_s)
+                break
+            except Exception as e:
+                await self._retry_wait(e, attempt, stats)
+        stats["latency_s"] = round(time.perf_counter() - start, 3)
+        self._note_response(stats, message)
+        if self.cache is not None:
+            await asyncio.to_thread(self._store, chain, key, prompt, seed, message.content)
+        return message.content
+
+    async def _pull(self, chain: LLMChain, prompt: str, stats: dict, start: float, queue: asyncio.Queue):
+        """一次流式尝试：占用名额后从模型拉取全部片段放入队列，拉取超时 timeout_s 秒；结束时放入 _DONE 或异常"""
+        try:
+            async with self._slot():
+                await asyncio.wait_for(self._pull_chunks(chain, prompt, stats, start, queue), self.timeout_s)
+        except Exception as e:
+            queue.put_nowait(e)
+            return
+        queue.put_nowait(_DONE)
+
+    async def _pull_chunks(self, chain: LLMChain, prompt: str, stats: dict, start: float, queue: asyncio.Queue):
+        chunks = chain.llm.astream(prompt).__aiter__()
+        try:
+            async for chunk in chunks:
+                self._note_response(stats, chunk)
+                if chunk.content:
+                    if stats["first_token_s"] is None:
+                        stats["first_token_s"] = round(time.perf_counter() - start, 3)
+                    queue.put_nowait(chunk.content)
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    async def astream(self, chain: LLMChain, seed: int = None, stats: dict = None, **inputs) -> AsyncIterator[str]:
+        """
+        异步流式调用链条，逐段返回生成的文本：每次尝试（从发起到最后一个片段）超时 timeout_s 秒；
+        片段由后台任务拉取并缓冲，超时和并发名额只计模型生成的时间，不计调用方处理片段的时间；
+        在产出第一个片段之前失败的可重试错误按指数退避重试，已经产出片段后失败则直接抛出（已输出的内容无法撤回）
+        缓存和统计规则同 stream
+        """
+        stats = {} if stats is None else stats
+        stats.update(CALL_STATS_DEFAULTS)
+        start = time.perf_counter()
+        prompt = chain.prompt.format(**inputs)
+        key = None
+        if self.cache is not None:
+            key, cached = await asyncio.to_thread(self._lookup, chain, prompt, seed)
+            if cached is not None:
+                stats.update(cached=True, prompt_tokens=0, completion_tokens=0,
+                             latency_s=round(time.perf_counter() - start, 3), first_token_s=0.0)
+                yield cached
+                return
+        parts = []
+        for attempt in range(self.max_retries + 1):
+            queue = asyncio.Queue()
+            puller = asyncio.ensure_future(self._pull(chain, prompt, stats, start, queue))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    parts.append(item)
+                    yield item
+                break
+            except Exception as e:
+                if parts:
+                    raise
+                await self._retry_wait(e, attempt, stats)
+            finally:
+                # 调用方停止迭代或出错时取消拉取，释放名额并关闭模型的流
+                puller.cancel()
+        stats["latency_s"] = round(time.perf_counter() - start, 3)
+        if self.cache is not None:
+            await asyncio.to_thread(self._store, chain, key, prompt, seed, "".join(parts))
+
+    def get_argument_chain(self) -> LLMChain:
+        """立论环节链条"""
+        return self._shared_chain("argument")
+
+    def get_cross_examination_chain(self) -> LLMChain:
+        """攻辩环节链条"""
+        return self._shared_chain("cross")
+
+    def get_free_debate_chain(self) -> LLMChain:
+        """自由辩论环节链条"""
+        return self._shared_chain("free")
+
+    def get_summary_chain(self) -> LLMChain:
+        """总结陈词环节链条"""
+        return self._shared_chain("summary")
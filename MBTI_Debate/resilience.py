@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import os
+import random
+import threading
+import time
+
+# 模型调用的超时、重试和限流参数（可用环境变量调整）
+DEBATE_LLM_TIMEOUT_S = float(os.environ.get("DEBATE_LLM_TIMEOUT_S", "120"))  # 单次调用（含流式输出）的超时
+DEBATE_LLM_MAX_RETRIES = int(os.environ.get("DEBATE_LLM_MAX_RETRIES", "3"))
+DEBATE_LLM_BACKOFF_S = float(os.environ.get("DEBATE_LLM_BACKOFF_S", "1"))  # 第一次重试前的等待，之后逐次翻倍
+DEBATE_LLM_BACKOFF_MAX_S = float(os.environ.get("DEBATE_LLM_BACKOFF_MAX_S", "30"))
+DEBATE_LLM_RPS = float(os.environ.get("DEBATE_LLM_RPS", "5"))  # 进程内每秒最多发起的调用数，0 为不限
+DEBATE_LLM_BURST = int(os.environ.get("DEBATE_LLM_BURST", "10"))
+
+# 可重试的 HTTP 状态码（限流、超时和服务端临时错误）及异常类名（openai SDK 新旧版本），不直接依赖 openai 包
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+    "ServiceUnavailableError", "Timeout", "TimeoutException", "ConnectError", "ReadTimeout",
+}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """超时、限流（429）、连接错误和 5xx 可以重试；参数错误、鉴权失败等直接抛出"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def backoff_delay(attempt: int, base: float = DEBATE_LLM_BACKOFF_S, cap: float = DEBATE_LLM_BACKOFF_MAX_S) -> float:
+    """第 attempt 次重试（从 0 开始）前的等待：指数退避，上限 cap，乘以 0.5~1 的随机抖动避免多场辩论同时重试"""
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+class TokenBucket:
+    """
+    令牌桶限流：每秒补充 rate 个令牌，最多积累 capacity 个，每次调用消耗一个
+    只用线程锁计算等待时间、用 asyncio.sleep 等待，不绑定事件循环，可被多个事件循环和线程共用
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """取一个令牌，成功返回 0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class ConcurrencyLimiter:
+    """
+    并发上限：同时持有名额的调用不超过 limit 个，等待者按先后顺序获得名额
+    与 TokenBucket 一样只用线程锁记账，等待者在各自的事件循环里等待，可被多个事件循环和线程共用
+    （asyncio.Semaphore 绑定首次争用时的事件循环，换一个循环使用会报错）
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._waiters = collections.deque()  # (事件循环, future)
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # 取消时名额已经转交给自己，交还给下一个等待者
+            self.release()
+            raise
+
+    def release(self):
+        """释放名额：有等待者时直接转交给最早的一个，否则空出一个名额"""
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(_grant, future)
+                    return
+            self._active -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """进程内所有 DebateLLM 共用的令牌桶，DEBATE_LLM_RPS 为 0 时返回 None（不限流）"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None and DEBATE_LLM_RPS > 0:
+            _rate_limiter = TokenBucket(DEBATE_LLM_RPS, DEBATE_LLM_BURST)
+        return _rate_limiter
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Optional
+
+
+class CacheMiss(KeyError):
+    """回放模式下缓存中没有对应的回复"""
+
+
+class ResponseCache:
+    """
+    按内容寻址的模型回复缓存（本地 SQLite 文件）
+    键为 sha256(渲染后的提示词, 模型, temperature, 种子, max_tokens)，同一提示词在同样参数下只对应一条回复
+    每次操作单独打开连接，可在多个线程中使用（DebateLLM 的异步调用经 asyncio.to_thread 在工作线程中读写）
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, model TEXT, temperature REAL, seed INTEGER, "
+                "prompt TEXT NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def key(prompt: str, model: str, temperature: float, seed: Optional[int], max_tokens: Optional[int] = None) -> str:
+        payload = json.dumps([prompt, model, temperature, seed, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, prompt: str, model: str, temperature: float, seed: Optional[int], response: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, temperature, seed, prompt, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, temperature, seed, prompt, response, time.time()),
+            )
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
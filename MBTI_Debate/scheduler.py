@@ -0,0 +1,66 @@
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, List, Tuple
+
+
+@dataclass(frozen=True)
+class SpeechSpec:
+    """
+    一条待生成的发言
+    - history：传给模型的历史发言来源，"none" 为空，"opening" 为正方一辩立论原文，"transcript" 为按环节上下文模式渲染的辩论记录
+    - deps：依赖的发言序号（只能是更早的发言），这些发言全部记录后才开始生成
+    """
+    index: int
+    agent_id: str
+    stage: str
+    round: int
+    position: str
+    speakers: str
+    chain: str
+    history: str
+    deps: Tuple[int, ...]
+
+
+async def run_speech_plan(
+        plan: List[SpeechSpec],
+        render_history: Callable[[SpeechSpec], str],
+        generate: Callable[[SpeechSpec, str], Awaitable[str]],
+        commit: Callable[[SpeechSpec, str], dict],
+        max_concurrency: int = 4,
+        done: int = 0
+) -> AsyncIterator[dict]:
+    """
+    按依赖关系并发生成发言，按计划顺序逐条记录并产出 commit 的返回值
+    - 一条发言的依赖全部记录后立即开始生成，历史发言在开始生成时渲染，此时记录中恰好是已记录的前缀，结果与生成快慢无关
+    - 同时进行的生成不超过 max_concurrency 个
+    - 中途出错或调用方停止迭代时取消尚未完成的生成
+    - done 为已经记录过的发言条数（续跑时），这些发言不再生成
+    """
+    for spec in plan:
+        if any(dep >= spec.index for dep in spec.deps):
+            raise ValueError(f"发言 {spec.index}（{spec.agent_id}）依赖了不早于自身的发言：{spec.deps}")
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = {}
+    committed = done - 1
+
+    async def run(spec: SpeechSpec, history: str) -> str:
+        async with semaphore:
+            return await generate(spec, history)
+
+    def launch_ready():
+        for spec in plan:
+            if spec.index > committed and spec.index not in tasks and all(dep <= committed for dep in spec.deps):
+                tasks[spec.index] = asyncio.ensure_future(run(spec, render_history(spec)))
+
+    try:
+        launch_ready()
+        for spec in plan[done:]:
+            content = await tasks[spec.index]
+            event = commit(spec, content)
+            committed = spec.index
+            launch_ready()
+            yield event
+    finally:
+        for task in tasks.values():
+            task.cancel()
@@ -0,0 +1,42 @@
+import asyncio
+from typing import AsyncIterator, Callable
+
+_DONE = object()
+
+
+class Speculation:
+    """
+    在后台任务里提前流式生成一条发言，片段按顺序放入队列，轮到该发言时再取出（需在事件循环中创建）
+    - discard()：丢弃提前生成的结果并取消后台任务
+    - deltas(fallback)：按顺序取出片段；若在产出任何片段前就失败，改为调用 fallback() 现场生成
+    """
+
+    def __init__(self, stream: Callable[[], AsyncIterator[str]]):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run(stream))
+
+    async def _run(self, stream: Callable[[], AsyncIterator[str]]):
+        try:
+            async for delta in stream():
+                self._queue.put_nowait(delta)
+        except Exception as e:
+            self._queue.put_nowait(e)
+        self._queue.put_nowait(_DONE)
+
+    def discard(self):
+        self._task.cancel()
+
+    async def deltas(self, fallback: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        started = False
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                if started:
+                    raise item
+                async for delta in fallback():
+                    yield delta
+                return
+            started = True
+            yield item
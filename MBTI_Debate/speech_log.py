@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from debate_state import Speech
+
+# 截断标记：{"debate_id": ..., "truncate": n} 表示该辩论此前记录的发言只保留前 n 条
+TRUNCATE_KEY = "truncate"
+
+
+def _iter_records(path: str, debate_ids: Iterable[str] = None) -> Iterator[Tuple[str, dict]]:
+    """逐行读取日志，产出 (辩论ID, 记录)；写了一半的行（写入时中断）直接跳过"""
+    wanted = set(debate_ids) if debate_ids is not None else None
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            debate_id = record.pop("debate_id", None)
+            if wanted is None or debate_id in wanted:
+                yield debate_id, record
+
+
+def iter_speeches(path: str, debate_ids: Iterable[str] = None) -> Iterator[Tuple[str, Speech]]:
+    """
+    逐行读取发言日志，产出 (辩论ID, 发言)，不会把整个文件读进内存
+    debate_ids 不为空时只产出这些辩论的发言；截断标记跳过（被截断的旧发言仍会产出，续跑请用 SpeechLog.collect）
+    """
+    for debate_id, record in _iter_records(path, debate_ids):
+        if TRUNCATE_KEY not in record:
+            yield debate_id, Speech.from_dict(record)
+
+
+class SpeechLog:
+    """
+    追加写入的发言日志（JSONL，每行一条发言及所属辩论ID），发言完成即写入磁盘，
+    批量辩论时内存中不必保留已结束辩论的记录；中断后可用 collect 取回未完成辩论已有的发言续跑
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # 上次写入中断留下的半行补一个换行，避免与新写入的行粘连
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def append(self, debate_id: str, speech: Speech):
+        line = json.dumps({"debate_id": debate_id, **speech.to_dict()}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def truncate(self, debate_id: str, keep: int):
+        """
+        追加截断标记：该辩论此前记录的发言只保留前 keep 条（续跑时日志与发言计划对不上，
+        如换了种子或轮数，之后重新生成的发言接在保留的部分后面）
+        """
+        line = json.dumps({"debate_id": debate_id, TRUNCATE_KEY: keep}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def collect(self, debate_ids: Iterable[str]) -> Dict[str, List[Speech]]:
+        """按辩论ID取回已记录的发言（按写入顺序，已按截断标记去掉旧发言），只扫描一遍文件"""
+        with self._lock:
+            self._file.flush()
+        speeches: Dict[str, List[Speech]] = {}
+        for debate_id, record in _iter_records(self.path, debate_ids):
+            kept = speeches.setdefault(debate_id, [])
+            if TRUNCATE_KEY in record:
+                del kept[record[TRUNCATE_KEY]:]
+            else:
+                kept.append(Speech.from_dict(record))
+        return speeches
+
+    def __iter__(self) -> Iterator[Tuple[str, Speech]]:
+        return iter_speeches(self.path)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,50 @@
+# 测试调用统计的汇总：按环节、辩手分组，token 只累计返回了用量的调用，缺失的计入 tokens_missing
+from debate_engine import DebateEngine
+from debate_manager import DebateManager
+from instrumentation import DebateMetrics, _aggregate
+
+
+def test_aggregate_counts_missing_tokens():
+    totals = _aggregate([
+        {"latency_s": 1.0, "prompt_tokens": 10, "completion_tokens": 5},
+        {"latency_s": 3.0, "prompt_tokens": None, "completion_tokens": None, "retries": 2},
+        {"latency_s": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cached": True},
+        {"latency_s": None, "finish_reason": "length", "completion_tokens": 7},
+    ])
+    assert totals["calls"] == 4
+    assert totals["latency_s"] == 4.0 and totals["avg_latency_s"] == round(4.0 / 3, 3) and totals["max_latency_s"] == 3.0
+    assert (totals["prompt_tokens"], totals["completion_tokens"], totals["tokens_missing"]) == (10, 12, 1)
+    assert (totals["retries"], totals["cached"], totals["truncated"]) == (2, 1, 1)
+
+
+def test_all_tokens_missing_reports_none():
+    totals = _aggregate([{"latency_s": 1.0, "completion_tokens": None}] * 2)
+    assert totals["prompt_tokens"] is None and totals["completion_tokens"] is None
+    assert totals["tokens_missing"] == 2
+    assert _aggregate([])["avg_latency_s"] is None
+
+
+def test_report_groups_by_stage_and_speaker():
+    metrics = DebateMetrics()
+    call = {"stage": "立论", "round": 1, "agent_id": "pro1", "prompt_tokens": 3, "completion_tokens": 4}
+    metrics.record(call)
+    call["agent_id"] = "opp1"  # record 保存的是副本
+    metrics.record({**call, "round": 2, "finish_reason": "length"})
+    metrics.record({"stage": "攻辩", "round": 3, "agent_id": "pro1", "completion_tokens": None})
+
+    report = metrics.report()
+    assert report["totals"]["calls"] == 3 and report["totals"]["tokens_missing"] == 1
+    assert report["by_stage"]["立论"]["completion_tokens"] == 8
+    assert report["by_stage"]["攻辩"]["completion_tokens"] is None
+    assert report["by_speaker"]["pro1"]["calls"] == 2
+    assert report["truncated"] == [{"stage": "立论", "round": 2, "agent_id": "opp1"}]
+    assert report["calls"][0]["agent_id"] == "pro1"
+
+
+def test_debate_records_stub_usage(fake_llm):
+    manager = DebateManager("测试辩题", seed=1, llm=fake_llm, verbose=False)
+    list(DebateEngine(manager).run_full_debate(2))
+    totals = manager.state.report()["totals"]
+    # 假模型在最后一个流式片段返回用量，每次调用都有 token 数
+    assert totals["calls"] == 2 + 4 + 2 + 2 and totals["tokens_missing"] == 0
+    assert totals["prompt_tokens"] > 0 and totals["completion_tokens"] > 0
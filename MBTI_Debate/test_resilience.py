@@ -0,0 +1,140 @@
+# 测试模型调用的限流、重试和超时：令牌桶、退避时间、可重试错误的判断、跨事件循环的并发上限，
+# 以及 DebateLLM.astream 的超时只计模型生成时间、调用方停止迭代时释放并发名额
+import asyncio
+import threading
+import time
+
+from conftest import FakeDebateLLM
+from resilience import ConcurrencyLimiter, TokenBucket, backoff_delay, is_retryable
+
+INPUTS = dict(topic="辩题", history="", speakers="", position="正方", speaker_id="pro1", mbti="INTJ", mbti_style="")
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def test_is_retryable():
+    assert is_retryable(asyncio.TimeoutError())
+    assert is_retryable(ConnectionError())
+    assert is_retryable(StatusError(429)) and is_retryable(StatusError(503))
+    assert not is_retryable(StatusError(400)) and not is_retryable(StatusError(401))
+    assert is_retryable(RateLimitError())
+    assert not is_retryable(ValueError())
+
+
+def test_backoff_delay_grows_with_jitter_and_cap():
+    for attempt in range(6):
+        delay = backoff_delay(attempt, base=1, cap=8)
+        expected = min(8, 2 ** attempt)
+        assert expected * 0.5 <= delay <= expected
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=50, capacity=3)
+
+    async def take(n):
+        start = time.monotonic()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(take(3)) < 0.02  # 突发容量内不等待
+    assert asyncio.run(take(5)) >= 5 / 50 * 0.8
+
+
+def test_concurrency_limiter_across_threads_and_loops():
+    limiter = ConcurrencyLimiter(2)
+    active, peak, lock = [0], [0], threading.Lock()
+
+    async def work():
+        async with limiter:
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.01)
+            with lock:
+                active[0] -= 1
+
+    async def many():
+        await asyncio.gather(*(work() for _ in range(5)))
+
+    threads = [threading.Thread(target=lambda: asyncio.run(many())) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    asyncio.run(many())  # 同一个限流器换一个事件循环继续使用
+    assert peak[0] == 2
+    assert limiter._active == 0 and not limiter._waiters
+
+
+def test_concurrency_limiter_cancelled_waiter():
+    limiter = ConcurrencyLimiter(1)
+
+    async def run():
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire(), 1)  # 取消的等待者没有占走名额
+        limiter.release()
+
+    asyncio.run(run())
+    assert limiter._active == 0
+
+
+def test_astream_timeout_excludes_consumer_time():
+    llm = FakeDebateLLM(mode="live", max_concurrency=1, timeout_s=0.05, max_retries=0)
+    chain = llm.get_free_debate_chain()
+
+    async def slow_consumer():
+        parts = []
+        async for delta in llm.astream(chain, **INPUTS):
+            parts.append(delta)
+            await asyncio.sleep(0.05)  # 调用方处理片段的时间超过 timeout_s，不应超时
+        return "".join(parts)
+
+    assert asyncio.run(slow_consumer()) == llm.model.reply(chain.prompt.format(**INPUTS))
+
+
+def test_astream_releases_slot_when_consumer_stops():
+    llm = FakeDebateLLM(mode="live", max_concurrency=1, max_retries=0)
+    chain = llm.get_free_debate_chain()
+
+    async def run():
+        stream = llm.astream(chain, **INPUTS)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        # 名额已释放，下一次调用不会一直等待
+        return await asyncio.wait_for(llm.arun(chain, **INPUTS), 1)
+
+    assert asyncio.run(run())
+    assert llm._limiter._active == 0
+
+
+def test_arun_retries_retryable_errors(monkeypatch):
+    llm = FakeDebateLLM(mode="live", max_retries=2)
+    chain = llm.get_argument_chain()
+    original = llm.model.ainvoke
+    failures = [ConnectionError("断开")]
+
+    async def flaky(prompt):
+        if failures:
+            raise failures.pop()
+        return await original(prompt)
+
+    monkeypatch.setattr(llm.model, "ainvoke", flaky)
+    monkeypatch.setattr("llm_client.backoff_delay", lambda attempt: 0)
+    stats = {}
+    assert asyncio.run(llm.arun(chain, stats=stats, **INPUTS))
+    assert stats["retries"] == 1
@@ -0,0 +1,54 @@
+# 测试模型回复缓存：键区分生成参数，replay 模式未命中时抛出 CacheMiss，
+# record 模式录制的整场辩论可在 replay 模式下离线重放（不调用模型）
+import asyncio
+
+import pytest
+
+from conftest import FakeChatModel, FakeDebateLLM
+from debate_engine import DebateEngine
+from debate_manager import DebateManager
+from response_cache import CacheMiss, ResponseCache
+
+
+def test_key_covers_generation_parameters():
+    base = ResponseCache.key("提示词", "m", 0.6, 1, 1000)
+    assert base == ResponseCache.key("提示词", "m", 0.6, 1, 1000)
+    assert len({base, ResponseCache.key("提示词2", "m", 0.6, 1, 1000), ResponseCache.key("提示词", "m2", 0.6, 1, 1000),
+                ResponseCache.key("提示词", "m", 0.7, 1, 1000), ResponseCache.key("提示词", "m", 0.6, 2, 1000),
+                ResponseCache.key("提示词", "m", 0.6, 1, 500)}) == 6
+
+
+def test_get_put(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    key = ResponseCache.key("提示词", "m", 0.6, None)
+    assert cache.get(key) is None
+    cache.put(key, "提示词", "m", 0.6, None, "回复")
+    assert cache.get(key) == "回复" and len(cache) == 1
+
+
+def test_replay_miss_raises(tmp_path):
+    llm = FakeDebateLLM(mode="replay", cache_path=str(tmp_path / "cache.db"))
+    chain = llm.get_argument_chain()
+    with pytest.raises(CacheMiss):
+        asyncio.run(llm.arun(chain, seed=1, topic="辩题", history="", speakers="", position="正方",
+                             speaker_id="pro1", mbti="INTJ", mbti_style=""))
+    assert llm.model.calls == 0
+
+
+def test_record_then_replay_debate_without_model_calls(tmp_path):
+    cache_path = str(tmp_path / "fixtures.db")
+    recorder = FakeDebateLLM(mode="record", cache_path=cache_path)
+    recorded = DebateManager("测试辩题", seed=7, llm=recorder, verbose=False)
+    list(DebateEngine(recorded).run_full_debate(3, speculative=True))
+    assert recorder.model.calls > 0
+
+    model = FakeChatModel()
+    replayed = DebateManager("测试辩题", seed=7, llm=FakeDebateLLM(model, mode="replay", cache_path=cache_path),
+                             verbose=False)
+
+    async def collect():
+        return [speech async for speech in DebateEngine(replayed).astream_debate(3, speculative=True)]
+
+    assert asyncio.run(collect()) == recorded.state.speaker_history
+    assert model.calls == 0
+    assert all(call["cached"] for call in replayed.state.metrics.calls)
@@ -0,0 +1,78 @@
+# 测试按依赖关系并发生成发言：依赖记录后才开始生成、按计划顺序记录，并发上限和续跑跳过已记录的发言
+import asyncio
+
+import pytest
+
+from debate_engine import DebateEngine
+from debate_manager import DebateManager
+from scheduler import SpeechSpec, run_speech_plan
+
+
+def _spec(index: int, deps=()) -> SpeechSpec:
+    return SpeechSpec(index, f"a{index}", "立论", index + 1, "正方", "", "argument", "transcript", tuple(deps))
+
+
+def _run(plan, delays, max_concurrency=4, done=0):
+    """按 delays 模拟各条发言的生成耗时，返回 (产出的事件, 每条开始生成时已记录的序号, 同时生成的最大条数)"""
+    committed, seen_at_start, running = [], {}, [0, 0]
+
+    def render_history(spec):
+        seen_at_start[spec.index] = list(committed)
+        return ""
+
+    async def generate(spec, history):
+        running[0] += 1
+        running[1] = max(running[1], running[0])
+        await asyncio.sleep(delays[spec.index])
+        running[0] -= 1
+        return f"内容{spec.index}"
+
+    def commit(spec, content):
+        committed.append(spec.index)
+        return content
+
+    async def collect():
+        return [event async for event in run_speech_plan(plan, render_history, generate, commit,
+                                                          max_concurrency=max_concurrency, done=done)]
+
+    return asyncio.run(collect()), seen_at_start, running[1]
+
+
+def test_commits_in_plan_order_and_waits_for_deps():
+    plan = [_spec(0), _spec(1), _spec(2, deps=[0]), _spec(3, deps=[1, 2])]
+    events, seen_at_start, _ = _run(plan, [0.03, 0.0, 0.0, 0.0])
+    # 1 比 0 先生成完，仍按计划顺序记录
+    assert events == ["内容0", "内容1", "内容2", "内容3"]
+    assert seen_at_start[0] == seen_at_start[1] == []
+    assert 0 in seen_at_start[2]
+    assert seen_at_start[3] == [0, 1, 2]
+
+
+def test_max_concurrency_and_resume():
+    plan = [_spec(i) for i in range(6)]
+    events, seen_at_start, peak = _run(plan, [0.01] * 6, max_concurrency=2)
+    assert len(events) == 6 and peak == 2
+    events, seen_at_start, _ = _run(plan, [0.0] * 6, done=4)
+    assert events == ["内容4", "内容5"]
+    assert sorted(seen_at_start) == [4, 5]
+
+
+def test_rejects_forward_dependency():
+    with pytest.raises(ValueError):
+        _run([_spec(0, deps=[1]), _spec(1)], [0.0, 0.0])
+
+
+def test_scheduled_debate_matches_sequential(fake_llm):
+    """并发生成的辩论记录与逐环节顺序执行的相同（假模型的回复只由提示词决定）"""
+    sequential = DebateManager("测试辩题", seed=3, llm=fake_llm, verbose=False)
+    list(DebateEngine(sequential).run_full_debate(3))
+
+    scheduled = DebateManager("测试辩题", seed=3, llm=fake_llm, verbose=False)
+
+    async def collect():
+        return [speech async for speech in DebateEngine(scheduled).arun_full_debate(3, max_concurrency=4)]
+
+    speeches = asyncio.run(collect())
+    assert len(speeches) == 2 + 4 + 3 + 2  # 立论、攻辩、3 轮自由辩论、总结陈词
+    assert speeches == sequential.state.speaker_history
+    assert len(scheduled.state.metrics.calls) == len(speeches)
@@ -0,0 +1,74 @@
+# 测试自由辩论的提前生成：片段按顺序取出、开始前失败时改为现场生成、丢弃时取消后台任务并计入统计
+import asyncio
+
+import pytest
+
+from debate_engine import DebateEngine
+from debate_manager import DebateManager
+from speculation import Speculation
+
+
+def _stream(pieces, error: Exception = None, delay: float = 0.0):
+    async def stream():
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            yield piece
+        if error is not None:
+            raise error
+    return stream
+
+
+async def _collect(speculation: Speculation, fallback) -> list:
+    return [delta async for delta in speculation.deltas(fallback)]
+
+
+def test_deltas_in_order_without_fallback():
+    async def run():
+        return await _collect(Speculation(_stream(["甲", "乙"])), _stream(["备用"]))
+    assert asyncio.run(run()) == ["甲", "乙"]
+
+
+def test_falls_back_when_failing_before_first_delta():
+    async def run():
+        return await _collect(Speculation(_stream([], ConnectionError("断开"))), _stream(["现场", "生成"]))
+    assert asyncio.run(run()) == ["现场", "生成"]
+
+
+def test_raises_when_failing_after_first_delta():
+    async def run():
+        return await _collect(Speculation(_stream(["甲"], ValueError("中途失败"))), _stream(["备用"]))
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_discard_cancels_background_task():
+    async def run():
+        speculation = Speculation(_stream(["甲"] * 100, delay=0.01))
+        await asyncio.sleep(0.02)
+        speculation.discard()
+        await asyncio.sleep(0)
+        return speculation._task.cancelled()
+    assert asyncio.run(run())
+
+
+def test_speculative_free_debate(fake_llm):
+    manager = DebateManager("测试辩题", seed=1, llm=fake_llm, verbose=False)
+    speeches = list(DebateEngine(manager).run_full_debate(4, speculative=True))
+    assert len(speeches) == 2 + 4 + 4 + 2
+    free_calls = [call for call in manager.state.metrics.calls if call["stage"] == "自由辩论"]
+    # 第一条现场生成，之后每条都采用了提前生成的结果
+    assert [call.get("speculative", False) for call in free_calls] == [False, True, True, True]
+    assert [item["speculative"] for item in manager.turn_latencies] == [True, True, True]
+
+
+def test_stopping_mid_speech_records_discarded_speculation(fake_llm):
+    manager = DebateManager("测试辩题", seed=1, llm=fake_llm, verbose=False)
+    events = DebateEngine(manager).run_full_debate(4, stream_tokens=True, speculative=True)
+    for event in events:
+        if event["stage"] == "自由辩论":
+            break
+    events.close()
+    discarded = [call for call in manager.state.metrics.calls if call.get("discarded")]
+    # 自由辩论第一条（轮次7）中途停止：已开始提前生成的第二条（反方，轮次8）被丢弃并计入统计
+    assert len(discarded) == 1
+    assert discarded[0]["round"] == 8 and discarded[0]["agent_id"].startswith("opp")
@@ -0,0 +1,64 @@
+# 测试发言日志：写了一半的行被跳过、按辩论ID取回发言续跑，续跑与发言计划对不上时写入截断标记
+import asyncio
+
+from debate_engine import DebateEngine
+from debate_manager import DebateManager
+from debate_state import Speech
+from speech_log import SpeechLog, iter_speeches
+
+
+def test_torn_last_line_is_skipped_and_not_glued(tmp_path):
+    path = str(tmp_path / "speeches.jsonl")
+    log = SpeechLog(path)
+    log.append("d1", Speech("pro1", 1, "立论", "第一条"))
+    log.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"debate_id": "d1", "agent_id": "opp1", "rou')  # 写入时中断
+
+    log = SpeechLog(path)
+    log.append("d1", Speech("opp1", 2, "立论", "第二条"))
+    log.append("d2", Speech("pro1", 1, "立论", "另一场"))
+    assert [speech.content for speech in log.collect(["d1"])["d1"]] == ["第一条", "第二条"]
+    assert [debate_id for debate_id, _ in iter_speeches(path)] == ["d1", "d1", "d2"]
+    log.close()
+
+
+def _run(log: SpeechLog, llm, seed: int, resume=None, stop_after: int = None):
+    manager = DebateManager("测试辩题", seed=seed, llm=llm, verbose=False, speech_log=log, debate_id="d")
+
+    async def collect():
+        generated = []
+        async for speech in DebateEngine(manager).arun_full_debate(3, resume=resume):
+            generated.append(speech)
+            if stop_after is not None and len(generated) == stop_after:
+                break
+        return generated
+
+    return asyncio.run(collect()), manager
+
+
+def test_resume_generates_only_the_rest(tmp_path, fake_llm):
+    log = SpeechLog(str(tmp_path / "speeches.jsonl"))
+    _run(log, fake_llm, seed=2, stop_after=5)  # 中断
+    logged = log.collect(["d"])["d"]
+    assert len(logged) == 5
+
+    generated, manager = _run(log, fake_llm, seed=2, resume=logged)
+    assert len(generated) == len(manager.state.speaker_history) - 5
+    assert log.collect(["d"])["d"] == manager.state.speaker_history
+    log.close()
+
+
+def test_mismatched_resume_truncates_stale_entries(tmp_path, fake_llm):
+    log = SpeechLog(str(tmp_path / "speeches.jsonl"))
+    _run(log, fake_llm, seed=2)
+    # 换了种子：自由辩论的发言人对不上，对不上的部分重新生成
+    generated, manager = _run(log, fake_llm, seed=5, resume=log.collect(["d"])["d"])
+    assert generated
+    with open(log.path, encoding="utf-8") as f:
+        assert '"truncate"' in f.read()
+    assert log.collect(["d"])["d"] == manager.state.speaker_history
+    # 再次续跑时日志与计划一致，不再生成
+    generated, _ = _run(log, fake_llm, seed=5, resume=log.collect(["d"])["d"])
+    assert generated == []
+    log.close()
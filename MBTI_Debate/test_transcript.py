@@ -0,0 +1,52 @@
+# 测试增量维护的辩论记录：full 模式返回全文，bounded 模式保留最近 K 条原文、更早的发言并入双方滚动摘要
+from transcript import TranscriptBuilder, first_sentence
+
+
+def _builder(count: int, **kwargs) -> TranscriptBuilder:
+    builder = TranscriptBuilder({"pro1": "INTJ", "opp1": "ISTJ"}, **kwargs)
+    for i in range(count):
+        agent_id = "pro1" if i % 2 == 0 else "opp1"
+        builder.append(agent_id, i + 1, "自由辩论", f"第{i}条要点。后面的展开")
+    return builder
+
+
+def test_empty_and_full():
+    builder = _builder(0)
+    assert builder.full() == TranscriptBuilder.EMPTY
+    builder = _builder(2)
+    assert len(builder) == 2
+    assert builder.full().startswith("轮次1 [自由辩论] pro1（INTJ）:\n第0条要点。")
+    assert builder.render("full") == builder.full()
+
+
+def test_bounded_within_window_is_full_text():
+    builder = _builder(3, recent_k=3)
+    assert builder.bounded() == builder.full()
+
+
+def test_bounded_keeps_recent_and_summarizes_older():
+    builder = _builder(5, recent_k=2)
+    text = builder.render("bounded")
+    summary, recent = text.split("最近2条发言：")
+    # 滑出窗口的前 3 条只以第一句出现在所属方的摘要里
+    assert "正方要点：第0条要点。；第2条要点。" in summary
+    assert "反方要点：第1条要点。" in summary
+    assert "后面的展开" not in summary
+    assert "第3条要点。后面的展开" in recent and "第4条要点。后面的展开" in recent
+    assert "第2条要点。后面的展开" not in recent
+
+
+def test_summary_folds_each_speech_once_and_drops_oldest_points():
+    builder = _builder(6, recent_k=1, summary_points=2)
+    builder.bounded()
+    builder.bounded()  # 重复渲染不会重复并入
+    assert builder._summaries["正方"] == ["第2条要点。", "第4条要点。"]
+    assert builder._summaries["反方"] == ["第1条要点。", "第3条要点。"]
+    # 窗口变小时继续并入新滑出的发言
+    assert "最近0条" not in builder.bounded(recent_k=0)
+    assert builder._summaries["反方"] == ["第3条要点。", "第5条要点。"]
+
+
+def test_first_sentence_truncates():
+    assert first_sentence("短句！后文") == "短句！"
+    assert first_sentence("长" * 100, max_chars=10) == "长" * 10 + "…"
@@ -0,0 +1,173 @@
+"""
+批量辩论（锦标赛）：辩题 × MBTI 对阵组合，多场辩论在同一个事件循环里并发运行
+- 正方四位辩手使用同一 MBTI 类型，反方四位辩手使用另一类型，默认遍历 16×16 全部组合
+- 所有辩论共享一个限流的 DebateLLM 客户端（同时进行的 LLM 调用不超过 --llm-concurrency，
+  每秒发起的调用数受 DEBATE_LLM_RPS 令牌桶限制，超时和临时错误自动退避重试，见 resilience.py）
+- 每场辩论结束立即追加一行到 JSONL 结果文件；中断后重新运行同一命令会跳过已成功完成的场次
+- 指定 --speech-log 时每条发言完成即追加到发言日志，结果文件只记录每场的元信息；
+  中断的场次续跑时从日志恢复已有发言，只生成剩余部分
+- 指定 --parquet 且安装了 pyarrow 时，结束后把 JSONL 结果导出为 Parquet
+
+用法（在 MBTI_Debate 目录下）：
+    python tournament.py --topics topics.txt --out results.jsonl --debates 8 --llm-concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Iterable, List, Tuple
+
+from debate_engine import DebateEngine
+from debate_manager import DebateManager
+from llm_client import LLM_MODES, DebateLLM
+from speech_log import SpeechLog
+
+MBTI_TYPES = ["".join(letters) for letters in itertools.product("EI", "SN", "TF", "JP")]
+DEFAULT_TOPIC = "人工智能是否会取代人类工作"
+
+
+def debate_key(topic: str, pro_type: str, opp_type: str, seed: int) -> str:
+    return f"{topic}|{pro_type}|{opp_type}|{seed}"
+
+
+def build_matches(topics: Iterable[str], pairings: Iterable[Tuple[str, str]], seed: int) -> List[dict]:
+    return [
+        {"key": debate_key(topic, pro_type, opp_type, seed), "topic": topic,
+         "pro_type": pro_type, "opp_type": opp_type, "seed": seed}
+        for topic in topics for pro_type, opp_type in pairings
+    ]
+
+
+def completed_keys(path: str) -> set:
+    """读取已有结果文件中成功完成的场次，最后一行写了一半（中断时）直接忽略"""
+    keys = set()
+    if not os.path.exists(path):
+        return keys
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                keys.add(record["key"])
+    return keys
+
+
+async def run_match(match: dict, llm: DebateLLM, free_debate_rounds: int, speech_log: SpeechLog = None,
+                    resume: list = None) -> dict:
+    manager = DebateManager(match["topic"], seed=match["seed"], llm=llm, verbose=False,
+                            speech_log=speech_log, debate_id=match["key"])
+    for speaker_id in manager.state.pro_team:
+        manager.state.mbti_map[speaker_id] = match["pro_type"]
+    for speaker_id in manager.state.opp_team:
+        manager.state.mbti_map[speaker_id] = match["opp_type"]
+    engine = DebateEngine(manager)
+    start = time.perf_counter()
+    generated = 0
+    async for _ in engine.arun_full_debate(free_debate_rounds, resume=resume):
+        generated += 1
+    speech_count = len(manager.state.speaker_history)
+    record = {**match, "status": "ok", "elapsed_s": round(time.perf_counter() - start, 2),
+              "speech_count": speech_count, "resumed": speech_count - generated}
+    if speech_log is None:
+        record["speeches"] = [speech.to_dict() for speech in manager.state.speaker_history]
+    return record
+
+
+async def run_tournament(matches: List[dict], out_path: str, llm: DebateLLM, max_debates: int = 8,
+                         free_debate_rounds: int = 10, speech_log: SpeechLog = None):
+    """并发运行尚未完成的场次，每场结束立即写入结果文件（成功或失败各写一行，失败的场次下次运行时重试）"""
+    done = completed_keys(out_path)
+    pending = [match for match in matches if match["key"] not in done]
+    print(f"共 {len(matches)} 场，已完成 {len(matches) - len(pending)} 场，本次运行 {len(pending)} 场")
+    # 未完成场次在日志里已有的发言（只扫描一遍日志）
+    partial = speech_log.collect(match["key"] for match in pending) if speech_log else {}
+
+    semaphore = asyncio.Semaphore(max_debates)
+    finished = 0
+
+    async def run_one(match: dict, out):
+        nonlocal finished
+        async with semaphore:
+            try:
+                record = await run_match(match, llm, free_debate_rounds, speech_log, partial.pop(match["key"], None))
+            except Exception as e:
+                record = {**match, "status": "error", "error": f"{type(e).__name__}: {e}"}
+        # 单线程事件循环里逐行追加，不会出现交错写入
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        finished += 1
+        print(f"[{finished}/{len(pending)}] {match['key']} {record['status']}")
+
+    with open(out_path, "a", encoding="utf-8") as out:
+        await asyncio.gather(*(run_one(match, out) for match in pending))
+
+
+def export_parquet(jsonl_path: str, parquet_path: str):
+    """把 JSONL 结果导出为 Parquet（每场一行，发言列表以 JSON 字符串保存），需要 pyarrow"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("未安装 pyarrow，跳过 Parquet 导出")
+        return
+    rows = {}
+    with open(jsonl_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            rows[record["key"]] = record  # 同一场次重试过时以最后一次结果为准
+    columns = ["key", "topic", "pro_type", "opp_type", "seed", "status", "elapsed_s", "speech_count", "error",
+               "speeches"]
+    table = pa.table({
+        column: [
+            json.dumps(row.get(column), ensure_ascii=False) if column == "speeches" else row.get(column)
+            for row in rows.values()
+        ]
+        for column in columns
+    })
+    pq.write_table(table, parquet_path)
+    print(f"已导出 {len(rows)} 场结果到 {parquet_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量辩论：辩题 × MBTI 对阵组合")
+    parser.add_argument("--topics", help="辩题文件，每行一个辩题（默认只用一个内置辩题）")
+    parser.add_argument("--types", default=",".join(MBTI_TYPES), help="参与对阵的 MBTI 类型，逗号分隔")
+    parser.add_argument("--out", default="tournament_results.jsonl")
+    parser.add_argument("--speech-log", help="发言日志路径（JSONL），指定后发言逐条写入日志，可从中断处续跑")
+    parser.add_argument("--parquet", help="结束后导出的 Parquet 文件路径")
+    parser.add_argument("--debates", type=int, default=8, help="同时进行的辩论场数")
+    parser.add_argument("--llm-concurrency", type=int, default=16, help="所有辩论共享的 LLM 并发调用上限")
+    parser.add_argument("--free-rounds", type=int, default=10)
+    parser.add_argument("--temperature", type=float, help="覆盖默认的生成温度")
+    parser.add_argument("--llm-mode", choices=LLM_MODES, help="模型调用模式（默认取 DEBATE_LLM_MODE，见 llm_client）")
+    parser.add_argument("--seed", type=int, default=0, help="自由辩论发言人选择的随机种子，各场相同便于对比")
+    args = parser.parse_args()
+
+    if args.topics:
+        with open(args.topics, encoding="utf-8") as f:
+            topics = [line.strip() for line in f if line.strip()]
+    else:
+        topics = [DEFAULT_TOPIC]
+    types = [t.strip().upper() for t in args.types.split(",") if t.strip()]
+    matches = build_matches(topics, itertools.product(types, types), args.seed)
+
+    llm = DebateLLM(max_concurrency=args.llm_concurrency, temperature=args.temperature, mode=args.llm_mode)
+    speech_log = SpeechLog(args.speech_log) if args.speech_log else None
+    try:
+        asyncio.run(run_tournament(matches, args.out, llm, args.debates, args.free_rounds, speech_log))
+    finally:
+        if speech_log:
+            speech_log.close()
+    if args.parquet:
+        export_parquet(args.out, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
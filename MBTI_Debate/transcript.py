@@ -0,0 +1,79 @@
+import re
+from typing import Callable, Dict, List, Optional
+
+
+def default_side(agent_id: str) -> str:
+    """按辩手 ID 判断所属方（pro* 为正方，其余为反方）"""
+    return "正方" if agent_id.startswith("pro") else "反方"
+
+
+def first_sentence(content: str, max_chars: int = 80) -> str:
+    """取发言的第一句作为要点，超长时截断"""
+    sentence = re.split(r"(?<=[。！？!?；;])", content.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars] + "…"
+
+
+class TranscriptBuilder:
+    """
+    增量维护辩论记录：每条发言只渲染一次并追加到全文中
+    - full 模式：返回全部历史发言
+    - bounded 模式：最近 K 条发言原文 + 更早发言的双方滚动摘要
+    """
+
+    EMPTY = "（无历史发言）"
+
+    def __init__(self, mbti_map: Dict[str, str], recent_k: int = 6, summary_points: int = 8,
+                 summarizer: Callable[[str], str] = first_sentence, side_of: Callable[[str], str] = default_side):
+        self.mbti_map = mbti_map
+        self.recent_k = recent_k
+        self.summary_points = summary_points  # 每方摘要最多保留的要点数，超出时丢弃最早的要点
+        self.summarizer = summarizer
+        self.side_of = side_of
+        self._rendered: List[str] = []
+        self._agents: List[str] = []
+        self._contents: List[str] = []
+        self._full = ""
+        self._summaries: Dict[str, List[str]] = {}
+        self._summarized = 0  # 已并入滚动摘要的发言条数
+
+    def __len__(self):
+        return len(self._rendered)
+
+    def append(self, agent_id: str, round_no: int, stage: str, content: str):
+        """追加一条发言（只在发言完成时调用一次）"""
+        rendered = f"轮次{round_no} [{stage}] {agent_id}（{self.mbti_map.get(agent_id, '未知')}）:\n{content}"
+        self._full = f"{self._full}\n\n{rendered}" if self._full else rendered
+        self._rendered.append(rendered)
+        self._agents.append(agent_id)
+        self._contents.append(content)
+
+    def full(self) -> str:
+        return self._full or self.EMPTY
+
+    def bounded(self, recent_k: Optional[int] = None) -> str:
+        k = self.recent_k if recent_k is None else recent_k
+        if len(self._rendered) <= k:
+            return self.full()
+        self._roll_summaries(len(self._rendered) - k)
+        summary = "\n".join(
+            f"{side}要点：" + "；".join(points) for side, points in self._summaries.items() if points
+        )
+        recent = "\n\n".join(self._rendered[-k:] if k else [])
+        parts = [f"前情摘要：\n{summary}"] if summary else []
+        if recent:
+            parts.append(f"最近{k}条发言：\n{recent}")
+        return "\n\n".join(parts)
+
+    def render(self, mode: str = "full", recent_k: Optional[int] = None) -> str:
+        """按上下文模式返回历史发言：full / bounded"""
+        if mode == "bounded":
+            return self.bounded(recent_k)
+        return self.full()
+
+    def _roll_summaries(self, upto: int):
+        """把滑出最近 K 条窗口的发言并入所属方的摘要，每条发言只处理一次"""
+        for index in range(self._summarized, upto):
+            points = self._summaries.setdefault(self.side_of(self._agents[index]), [])
+            points.append(self.summarizer(self._contents[index]))
+            del points[:-self.summary_points]
+        self._summarized = max(self._summarized, upto)
@@ -1,19 +1,33 @@
 
 import os
-from langchain_community.document_loaders import TextLoader, UnstructuredPDFLoader, UnstructuredWordDocumentLoader, UnstructuredMarkdownLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI
+import threading
 from langchain.tools import tool
+from llm_factory import get_llm, get_embeddings
+from logging_config import get_logger
+from shared_state import file_digest, get_index_store
+
+logger = get_logger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
 
 class FileQASystem:
-    def __init__(self, file_path):
+    def __init__(self, file_path, llm=None):
         self.file_path = file_path
-        self.documents = self.load_documents(file_path)
-        self.vector_store = self.build_vector_store(self.documents)
-        self.llm = ChatOpenAI(temperature=0.0)
+        # 索引按“文件内容+向量化参数”寻址，存放在共享目录里，多个worker只解析/向量化一次
+        self.index_key = index_key_for(file_path)
+        self.documents = None
+        self.vector_store, built = get_index_store().get_or_build(
+            self.index_key,
+            self._build_index,
+            get_embeddings(EMBEDDING_MODEL),
+        )
+        logger.info("文件索引%s: %s", "已新建" if built else "复用共享索引", file_path)
+        # 使用调用方选择的provider/模型，未指定时回退到默认的openai客户端
+        self.llm = llm if llm is not None else get_llm("openai", "gpt-4-turbo")
+        from langchain.chains import RetrievalQA
         self.qa = RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
@@ -21,8 +35,15 @@ class FileQASystem:
             return_source_documents=True
         )
 
+    def _build_index(self):
+        self.documents = self.load_documents(self.file_path)
+        return self.build_vector_store(self.documents)
+
     @staticmethod
     def load_documents(file_path):
+        # unstructured等文档解析依赖较重，首次使用文件问答时才导入
+        from langchain_community.document_loaders import (TextLoader, UnstructuredPDFLoader,
+                                                          UnstructuredWordDocumentLoader, UnstructuredMarkdownLoader)
         SUPPORTED_EXTS = [".txt", ".pdf", ".docx", ".md"]
         LOADER_MAP = {
             ".txt": TextLoader,
@@ -39,9 +60,11 @@ class FileQASystem:
 
     @staticmethod
     def build_vector_store(documents):
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        from langchain.text_splitter import CharacterTextSplitter
+        from langchain_community.vectorstores import FAISS
+        text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
         texts = text_splitter.split_documents(documents)
-        embeddings = OpenAIEmbeddings()
+        embeddings = get_embeddings(EMBEDDING_MODEL)
         return FAISS.from_documents(texts, embeddings)
 
     def ask(self, query):
@@ -51,16 +74,35 @@ class FileQASystem:
         return answer, sources
 
 
+def index_key_for(file_path):
+    return f"{file_digest(file_path)[:32]}-{EMBEDDING_MODEL}-{CHUNK_SIZE}-{CHUNK_OVERLAP}"
+
+
+_file_qa_lock = threading.Lock()
+_file_qa_cache = {}
+
+
+def get_file_qa_system(file_path, llm=None):
+    """进程内复用FileQASystem：同一文件内容+同一模型客户端只加载一次索引"""
+    cache_key = (index_key_for(file_path), id(llm))
+    with _file_qa_lock:
+        file_qa = _file_qa_cache.get(cache_key)
+    if file_qa is None:
+        file_qa = FileQASystem(file_path, llm)
+        with _file_qa_lock:
+            file_qa = _file_qa_cache.setdefault(cache_key, file_qa)
+    return file_qa
+
+
 # 下面保留get_fileqa_tool函数不变
 
 def get_fileqa_tool(llm):
-    file_qa_cache = {}
-    
+
     @tool
     def fileqa_tool(input_str: str) -> dict:
         """文件问答工具，用于处理文档相关问题。输入格式：'<文件路径>|<问题>'"""
         try:
-            print(f"fileqa_tool被调用，输入: {input_str}")
+            logger.debug("fileqa_tool被调用，输入: %s", input_str)
             
             if "|" not in input_str:
                 return {"result": "file_qa 代理输入格式错误，应为 '<文件路径>|<问题>'"}
@@ -69,26 +111,20 @@ def get_fileqa_tool(llm):
             file_path = file_path.strip()
             query = query.strip()
             
-            print(f"解析文件路径: {file_path}")
-            print(f"解析查询问题: {query}")
+            logger.debug("解析文件路径: %s，查询问题: %s", file_path, query)
             
             # 检查文件是否存在
             if not os.path.exists(file_path):
                 return {"result": f"文件不存在: {file_path}"}
             
-            cache_key = (file_path, )
-            if cache_key not in file_qa_cache:
-                try:
-                    print(f"开始加载文件: {file_path}")
-                    file_qa_cache[cache_key] = FileQASystem(file_path)
-                    print(f"文件加载成功: {file_path}")
-                except Exception as e:
-                    error_msg = f"文件加载失败 ({file_path}): {str(e)}"
-                    print(f"❌ {error_msg}")
-                    return {"result": error_msg}
+            try:
+                file_qa = get_file_qa_system(file_path, llm)
+            except Exception as e:
+                error_msg = f"文件加载失败 ({file_path}): {str(e)}"
+                logger.warning(error_msg)
+                return {"result": error_msg}
             
-            file_qa = file_qa_cache[cache_key]
-            print(f"开始问答处理...")
+            logger.debug("开始问答处理...")
             answer, sources = file_qa.ask(query)
             
             # 构建结果
@@ -99,12 +135,12 @@ def get_fileqa_tool(llm):
                     source = getattr(doc.metadata, 'source', '未知')
                     result += f"\n{i}. {source}"
             
-            print(f"问答处理完成，结果长度: {len(result)}")
+            logger.debug("问答处理完成，结果长度: %d", len(result))
             return {"result": result}
             
         except Exception as e:
             error_msg = f"fileqa_tool执行失败: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.exception(error_msg)
             return {"result": error_msg}
     
     return fileqa_tool
\ No newline at end of file
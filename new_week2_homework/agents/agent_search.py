@@ -1,19 +1,197 @@
-from langchain_community.tools import DuckDuckGoSearchRun
-from langchain.tools import tool
+import asyncio
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import wait
+from urllib.parse import urlsplit
+from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+from langchain_core.tools import StructuredTool
+from deadlines import abandon, remaining, submit
+from logging_config import get_logger
+from metrics import METRICS
+
+logger = get_logger(__name__)
+
+# 多路改写查询并发搜索：原问题的搜索立即开始，同时让小模型生成改写查询，改写完成后追加搜索，
+# 所有搜索共享同一个超时；结果按URL和内容哈希去重、按多路排名融合+与问题的词重合度排序，只把前top_k条交给总结模型
+SEARCH_REFORMULATIONS = int(os.environ.get("SEARCH_REFORMULATIONS", "2"))  # 改写查询条数，0为只搜原问题
+SEARCH_TIMEOUT_S = float(os.environ.get("SEARCH_TIMEOUT_S", "8"))
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "5"))  # 每条查询取多少条结果
+SEARCH_TOP_K = int(os.environ.get("SEARCH_TOP_K", "6"))
+
+# 搜索是阻塞I/O，每条查询用deadlines.submit单独起线程：超时被放弃的搜索不占用固定大小的线程池，
+# 由duckduckgo_search客户端自身的请求超时（默认10秒）结束
+# 同步调用（AgentExecutor.invoke）走线程+llm.invoke，异步调用走事件循环+llm.ainvoke，不在同步路径里新建事件循环
+
+METRICS.describe("multi_agent_search_errors_total", "单条搜索查询失败的次数（按异常类型），失败的查询按无结果处理", "counter")
+
+
+def _normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip().lower())
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    return f"{host}{parts.path.rstrip('/')}"
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(re.sub(r"\s+", " ", text).strip().lower().encode("utf-8")).hexdigest()
+
+
+def _terms(text: str) -> set:
+    """英文按单词、中文按相邻两字切分，用于估计片段与问题的相关度"""
+    text = text.lower()
+    terms = set(re.findall(r"[a-z0-9]+", text))
+    for run in re.findall(r"[一-鿿]+", text):
+        terms.update(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+    return terms
+
+
+def rank_snippets(query: str, result_lists: list, top_k: int = SEARCH_TOP_K) -> list:
+    """
+    合并多路查询的结果：同一URL或同样内容的片段只保留一条，
+    得分 = 各路排名的倒数融合（RRF，多路都搜到的更靠前） + 与原问题的词重合度
+    """
+    query_terms = _terms(query)
+    merged = []
+    by_url, by_hash = {}, {}
+    for results in result_lists:
+        for rank, item in enumerate(results):
+            snippet = (item.get("snippet") or "").strip()
+            if not snippet:
+                continue
+            url_key = _normalize_url(item.get("link", "")) if item.get("link") else None
+            hash_key = _content_hash(snippet)
+            entry = by_url.get(url_key) if url_key else None
+            entry = entry or by_hash.get(hash_key)
+            if entry is None:
+                entry = {"title": item.get("title", ""), "snippet": snippet, "link": item.get("link", ""), "rrf": 0.0}
+                merged.append(entry)
+            entry["rrf"] += 1 / (60 + rank)
+            if url_key:
+                by_url[url_key] = entry
+            by_hash[hash_key] = entry
+    for entry in merged:
+        terms = _terms(f"{entry['title']} {entry['snippet']}")
+        overlap = len(query_terms & terms) / len(query_terms) if query_terms else 0.0
+        entry["score"] = entry["rrf"] * 60 + overlap
+    merged.sort(key=lambda entry: entry["score"], reverse=True)
+    return merged[:top_k]
+
+
+def _reformulate_prompt(query: str, n: int) -> str:
+    return (
+        f"请把下面的问题改写成{n}条不同角度、适合搜索引擎的简短查询，每行一条，不要编号和解释。\n"
+        f"问题：{query}"
+    )
+
+
+def _parse_reformulations(content: str, query: str) -> list:
+    queries = [line.strip(" -•\t") for line in content.splitlines() if line.strip(" -•\t")]
+    return [q for q in queries if q != query][:SEARCH_REFORMULATIONS]
+
+
+def _summary_prompt(query: str, snippets: list) -> str:
+    search_result = "\n\n".join(
+        f"[{i}] {item['title']}\n{item['snippet']}\n来源：{item['link']}" for i, item in enumerate(snippets, 1)
+    )
+    return (
+        "你是一位互联网信息专家，擅长检索和整合最新权威信息。请结合当前问题和以下搜索结果，为用户做出权威、简明、结构化的回答。\n"
+        "要求：1. 筛选有用信息，去除重复和无关内容；2. 结构化分点总结；3. 如有多条信息，按条列出。\n"
+        f"用户问题：{query}\n"
+        f"搜索结果：\n{search_result}\n"
+        "助手："
+    )
+
 
 def get_search_tool(llm):
-    search = DuckDuckGoSearchRun()
-    @tool
+    # 搜索客户端在第一次搜索时才创建，避免构建工作流时加载duckduckgo_search
+    search_clients = []
+
+    def search_client():
+        if not search_clients:
+            search_clients.append(DuckDuckGoSearchAPIWrapper())
+        return search_clients[0]
+
+    def search_one(query: str) -> list:
+        try:
+            return search_client().results(query, SEARCH_MAX_RESULTS)
+        except Exception as e:
+            # 单条查询失败不影响其他查询，记录下来，避免全部失败时只看到“没有结果”
+            logger.warning("搜索失败，按无结果处理: %s", query, exc_info=True)
+            METRICS.inc("multi_agent_search_errors_total", error=type(e).__name__)
+            return []
+
+    def reformulate(query: str) -> list:
+        if SEARCH_REFORMULATIONS <= 0:
+            return []
+        return _parse_reformulations(llm.invoke(_reformulate_prompt(query, SEARCH_REFORMULATIONS)).content, query)
+
+    def gather_results(query: str) -> list:
+        """原问题与改写查询并发搜索，超时时只使用已返回的结果"""
+        deadline = time.monotonic() + SEARCH_TIMEOUT_S
+        searches = [submit(search_one, query)]
+        reformulated = submit(reformulate, query)
+        wait([reformulated], timeout=remaining(deadline))
+        if reformulated.done() and reformulated.exception() is None:
+            searches.extend(submit(search_one, q) for q in reformulated.result())
+        else:
+            abandon(reformulated)
+        wait(searches, timeout=remaining(deadline))
+        for future in searches:
+            if not future.done():
+                abandon(future)
+        return [future.result() for future in searches if future.done() and future.exception() is None]
+
     def search_tool(query: str) -> dict:
-        """互联网搜索与结构化总结"""
-        search_result = search.run(query)
-        prompt = (
-            "你是一位互联网信息专家，擅长检索和整合最新权威信息。请结合当前问题和以下搜索结果，为用户做出权威、简明、结构化的回答。\n"
-            "要求：1. 筛选有用信息，去除重复和无关内容；2. 结构化分点总结；3. 如有多条信息，按条列出。\n"
-            f"用户问题：{query}\n"
-            f"搜索结果：{search_result}\n"
-            "助手："
-        )
-        answer = llm.invoke(prompt).content
+        snippets = rank_snippets(query, gather_results(query))
+        if not snippets:
+            return {"result": f"未能在{SEARCH_TIMEOUT_S:.0f}秒内获取到与「{query}」相关的搜索结果"}
+        answer = llm.invoke(_summary_prompt(query, snippets)).content
         return {"result": answer}
-    return search_tool 
\ No newline at end of file
+
+    async def asearch_one(query: str) -> list:
+        future = submit(search_one, query)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            abandon(future)
+            raise
+
+    async def areformulate(query: str) -> list:
+        if SEARCH_REFORMULATIONS <= 0:
+            return []
+        content = (await llm.ainvoke(_reformulate_prompt(query, SEARCH_REFORMULATIONS))).content
+        return _parse_reformulations(content, query)
+
+    async def agather_results(query: str) -> list:
+        """gather_results的异步版本"""
+        tasks = [asyncio.ensure_future(asearch_one(query))]
+
+        async def search_reformulations():
+            try:
+                queries = await areformulate(query)
+            except Exception:
+                return
+            tasks.extend(asyncio.ensure_future(asearch_one(q)) for q in queries)
+            await asyncio.gather(*tasks[1:], return_exceptions=True)
+
+        extra = asyncio.ensure_future(search_reformulations())
+        await asyncio.wait([tasks[0], extra], timeout=SEARCH_TIMEOUT_S)
+        extra.cancel()
+        for task in tasks:
+            task.cancel()
+        return [task.result() for task in tasks if task.done() and not task.cancelled() and task.exception() is None]
+
+    async def asearch_tool(query: str) -> dict:
+        snippets = rank_snippets(query, await agather_results(query))
+        if not snippets:
+            return {"result": f"未能在{SEARCH_TIMEOUT_S:.0f}秒内获取到与「{query}」相关的搜索结果"}
+        answer = (await llm.ainvoke(_summary_prompt(query, snippets))).content
+        return {"result": answer}
+
+    return StructuredTool.from_function(
+        func=search_tool,
+        coroutine=asearch_tool,
+        name="search_tool",
+        description="互联网搜索与结构化总结",
+    )
@@ -0,0 +1,58 @@
+# 对比单工具Agent在tool_calling与direct两种模式下的耗时和LLM调用次数：--agents中的每个Agent两种模式各跑一遍，
+# 与默认配置无关（DEFAULT_AGENT_MODES中只有math默认为direct，knowledge默认为tool_calling），输出中默认模式标*
+# 用法（在new_week2_homework目录下）：python -m benchmarks.bench_agent_modes --latency 0.2 --runs 5
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+from benchmarks.fakes import FakeChatModel
+from llm_factory import register_provider
+from langgraph_multi_agent import DEFAULT_AGENT_MODES, TrueMultiAgentSystem
+
+
+def bench_agent(system, fake_llm, agent_name: str, question: str, runs: int) -> dict:
+    agent_input = {"input": question, "question": question, "chat_history": []}
+    latencies = []
+    fake_llm.reset()
+    for _ in range(runs):
+        start = time.perf_counter()
+        system.agents[agent_name].invoke(agent_input)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "mean_s": statistics.mean(latencies),
+        "max_s": max(latencies),
+        "llm_calls": fake_llm.call_count / runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent执行模式对比")
+    parser.add_argument("--latency", type=float, default=0.2, help="假模型每次调用的延迟（秒）")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--agents", default="math,knowledge")
+    args = parser.parse_args()
+
+    fake_llm = FakeChatModel(latency=args.latency)
+    register_provider("fake", lambda model, **params: fake_llm)
+
+    question = "2的100次方是多少？"
+    agent_names = args.agents.split(",")
+    systems = {
+        mode: TrueMultiAgentSystem("bench_agent_modes", "fake", "fake-model",
+                                   agent_modes={name: mode for name in agent_names})
+        for mode in ("tool_calling", "direct")
+    }
+
+    print(f"{'agent':<12}{'mode':<14}{'平均耗时(s)':>12}{'最大耗时(s)':>12}{'LLM调用/次':>12}")
+    for agent_name in agent_names:
+        for mode, system in systems.items():
+            stats = bench_agent(system, fake_llm, agent_name, question, args.runs)
+            label = f"{mode}*" if DEFAULT_AGENT_MODES.get(agent_name) == mode else mode
+            print(f"{agent_name:<12}{label:<14}{stats['mean_s']:>12.3f}{stats['max_s']:>12.3f}{stats['llm_calls']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
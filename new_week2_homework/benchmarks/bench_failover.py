@@ -0,0 +1,89 @@
+# 熔断与故障切换演练：主provider用可注入故障的假模型，备用provider用健康的假模型
+# 场景：down（全部失败）/ flaky（按比例失败）/ slow（变慢）/ recover（故障一段时间后恢复，验证半开探测后关闭）
+# 用法（在new_week2_homework目录下）：python -m benchmarks.bench_failover --calls 40
+import argparse
+import statistics
+import time
+
+import llm_factory
+from benchmarks.fakes import FakeChatModel
+from circuit_breaker import provider_health
+from metrics import METRICS
+
+# 演练用的熔断参数，比线上默认值小，几秒内就能走完打开/半开/关闭
+BREAKER_CONFIG = {
+    "breaker_window": 10,
+    "breaker_min_calls": 5,
+    "breaker_failure_rate": 0.5,
+    "breaker_slow_call_s": 0.2,
+    "breaker_slow_rate": 0.8,
+    "breaker_open_s": 0.5,
+}
+
+SCENARIOS = {
+    # 场景名: (主provider错误率, 主provider延迟)
+    "down": (1.0, 0.01),
+    "flaky": (0.6, 0.01),
+    "slow": (0.0, 0.3),
+    "recover": (1.0, 0.01),
+}
+
+
+def run_scenario(name: str, calls: int, interval: float) -> dict:
+    error_rate, latency = SCENARIOS[name]
+    primary_name, backup_name = f"fake_{name}", f"fake_{name}_backup"
+    primary = FakeChatModel(model_name="primary", reply="primary", latency=latency, error_rate=error_rate, seed=1)
+    backup = FakeChatModel(model_name="backup", reply="backup", latency=0.01)
+    llm_factory.register_provider(primary_name, lambda model, **params: primary, **BREAKER_CONFIG)
+    llm_factory.register_provider(backup_name, lambda model, **params: backup, **BREAKER_CONFIG)
+    llm_factory.FAILOVER_MODELS[f"{primary_name}:fake-model"] = f"{backup_name}:fake-model"
+    llm = llm_factory.get_stage_llm(primary_name, "fake-model", "agent")
+
+    served = {"primary": 0, "backup": 0, "failed": 0}
+    latencies = []
+    states = []
+    for i in range(calls):
+        if name == "recover" and i == calls // 2:
+            primary.error_rate = 0.0
+            # 等熔断器进入半开，让下一次调用成为探测调用
+            time.sleep(BREAKER_CONFIG["breaker_open_s"])
+        start = time.perf_counter()
+        try:
+            served[llm.invoke("你好").content] += 1
+        except Exception:
+            served["failed"] += 1
+        latencies.append(time.perf_counter() - start)
+        state = provider_health()[primary_name]["state"]
+        if not states or states[-1] != state:
+            states.append(state)
+        time.sleep(interval)
+    return {
+        "served": served,
+        "primary_calls": primary.call_count,
+        "state_transitions": " -> ".join(states),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="熔断与故障切换演练")
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.02, help="两次调用之间的间隔（秒）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    args = parser.parse_args()
+
+    for name in args.scenarios.split(","):
+        result = run_scenario(name, args.calls, args.interval)
+        print(f"\n=== {name} ===")
+        for key, value in result.items():
+            print(f"{key:>18}: {value}")
+
+    print("\n=== /metrics 中的provider健康指标 ===")
+    for line in METRICS.render_prometheus().splitlines():
+        if line.startswith("multi_agent_provider_"):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
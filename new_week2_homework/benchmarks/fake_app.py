@@ -0,0 +1,20 @@
+# 多worker压测用的应用入口：在每个worker进程里装上假模型/假搜索/假向量化，再导出FastAPI的app
+# 用法（在new_week2_homework目录下，需要真实Redis，fakeredis无法跨进程共享）：
+#   REDIS_URL=redis://localhost:6379/15 WARMUP_MODELS=fake:fake-model \
+#       gunicorn benchmarks.fake_app:app -c gunicorn.conf.py
+#   python -m benchmarks.loadtest --target http --url http://127.0.0.1:8000 --concurrency 16
+# 假模型参数通过环境变量配置：FAKE_LLM_LATENCY / FAKE_TOKEN_RATE / FAKE_SEARCH_LATENCY / FAKE_ROUTE
+import os
+from types import SimpleNamespace
+
+from benchmarks.loadtest import install_fakes
+
+install_fakes(SimpleNamespace(
+    llm_latency=float(os.environ.get("FAKE_LLM_LATENCY", "0.05")),
+    token_rate=float(os.environ.get("FAKE_TOKEN_RATE", "0")),
+    search_latency=float(os.environ.get("FAKE_SEARCH_LATENCY", "0.05")),
+    route=os.environ.get("FAKE_ROUTE", "knowledge"),
+    redis_url=os.environ["REDIS_URL"],
+))
+
+from fastapi_conn import app  # noqa: E402
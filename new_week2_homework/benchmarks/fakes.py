@@ -0,0 +1,135 @@
+# 压测/基准测试用的替身：不访问任何外部服务，延迟可配置
+import json
+import random
+import threading
+import time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from pydantic import PrivateAttr
+from prompts import CLASSIFY_SYSTEM_PROMPT, PLAN_SYSTEM_PROMPT
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    确定性的假聊天模型
+    绑定了tools且最后一条消息不是工具结果时，返回对第一个工具的调用；
+    分类/协作计划提示词分别返回route_label和plan_agents对应的结果；否则返回固定回复
+    error_rate>0时按该概率抛出FakeProviderError，配合latency可模拟provider故障和变慢
+    """
+    model_name: str = "fake-model"
+    latency: float = 0.05  # 每次调用的首token延迟（秒）
+    tokens_per_second: float = 0  # 模拟生成速度，0表示不额外计算生成耗时
+    reply: str = "这是模拟回复"
+    route_label: str = "knowledge"
+    plan_agents: List[str] = ["search", "knowledge"]
+    error_rate: float = 0.0
+    seed: int = 0
+    _rng: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _calls: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def call_count(self) -> int:
+        return self._calls
+
+    def reset(self):
+        with self._lock:
+            self._calls = 0
+
+    def _next_call_id(self) -> int:
+        with self._lock:
+            self._calls += 1
+            return self._calls
+
+    def _should_fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            if self._rng is None:
+                self._rng = random.Random(self.seed)
+            return self._rng.random() < self.error_rate
+
+    def _build_message(self, messages: List[BaseMessage], call_id: int, tools) -> AIMessage:
+        if tools and not isinstance(messages[-1], ToolMessage):
+            function = tools[0]["function"]
+            arg_name = next(iter(function.get("parameters", {}).get("properties", {})), "query")
+            args = {arg_name: str(messages[-1].content)}
+            tool_call_id = f"call_{call_id}"
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": function["name"], "args": args, "id": tool_call_id}],
+                additional_kwargs={"tool_calls": [{
+                    "id": tool_call_id,
+                    "type": "function",
+                    "function": {"name": function["name"], "arguments": json.dumps(args, ensure_ascii=False)},
+                }]},
+            )
+        system_prompt = messages[0].content if messages and messages[0].type == "system" else ""
+        if system_prompt == CLASSIFY_SYSTEM_PROMPT:
+            return AIMessage(content=self.route_label)
+        if system_prompt == PLAN_SYSTEM_PROMPT:
+            plan = {
+                "agents": self.plan_agents,
+                "tasks": {agent: f"{agent}任务" for agent in self.plan_agents},
+                "collaboration": "并行处理后整合",
+            }
+            return AIMessage(content=json.dumps(plan, ensure_ascii=False))
+        return AIMessage(content=self.reply)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs) -> ChatResult:
+        call_id = self._next_call_id()
+        time.sleep(self.latency)
+        if self._should_fail():
+            raise FakeProviderError(f"{self.model_name} 模拟的provider故障")
+        message = self._build_message(messages, call_id, kwargs.get("tools"))
+        prompt_tokens = sum(len(str(m.content)) for m in messages)
+        completion_tokens = len(str(message.content))
+        if self.tokens_per_second:
+            time.sleep(completion_tokens / self.tokens_per_second)
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "model_name": self.model_name,
+                "token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+            },
+        )
+
+
+class FakeProviderError(ConnectionError):
+    """假模型模拟的provider错误"""
+
+
+class FakeSearch:
+    """替代DuckDuckGoSearchAPIWrapper的假搜索，返回固定格式的搜索结果"""
+
+    def __init__(self, latency: float = 0.1):
+        self.latency = latency
+
+    def results(self, query: str, max_results: int) -> list:
+        time.sleep(self.latency)
+        return [
+            {
+                "title": f"示例网站{i}",
+                "snippet": f"关于「{query}」的模拟搜索结果{i}：示例网站报道了相关的最新数据。",
+                "link": f"https://example.com/{i}",
+            }
+            for i in range(max_results)
+        ]
+
+
+def fake_embeddings(size: int = 256) -> DeterministicFakeEmbedding:
+    """相同文本得到相同向量的假向量化模型"""
+    return DeterministicFakeEmbedding(size=size)
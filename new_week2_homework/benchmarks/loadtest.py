@@ -0,0 +1,218 @@
+# 离线压测：用假模型/假搜索/假向量化/fakeredis驱动多代理系统，统计延迟分位数、吞吐量和每请求LLM调用次数
+# 用法（在new_week2_homework目录下）：
+#   python -m benchmarks.loadtest --target system --requests 50 --concurrency 8
+#   python -m benchmarks.loadtest --target fastapi --concurrency 16 --save-baseline
+#   python -m benchmarks.loadtest --target core_api --redis-url redis://localhost:6379/15
+#   python -m benchmarks.loadtest --target http --url http://127.0.0.1:8000 --concurrency 16
+# target: system（直接调用TrueMultiAgentSystem.ask）/ core_api（multi_agent_ask）/ fastapi（进程内调用/chat接口）
+#         http（通过HTTP压测已启动的服务，如用gunicorn启动的多worker benchmarks.fake_app，见该文件说明）
+# 不指定--redis-url时使用fakeredis；与baselines.json中同一场景的基线对比，退化时返回码为1
+import argparse
+import json
+import math
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+BASELINE_FILE = Path(__file__).with_name("baselines.json")
+
+QUESTIONS = [
+    "100元能在云南的花季时买几束玫瑰花",
+    "请介绍一下牛顿三大定律",
+    "今天北京的最高气温是多少",
+    "2的100次方是多少？",
+]
+
+
+def install_fakes(args):
+    """注册假模型provider、假搜索、假向量化，并在未指定Redis时换成fakeredis"""
+    import llm_factory
+    from agents import agent_search
+    from benchmarks.fakes import FakeChatModel, FakeSearch, fake_embeddings
+
+    fake_llm = FakeChatModel(
+        latency=args.llm_latency,
+        tokens_per_second=args.token_rate,
+        route_label=args.route,
+    )
+    llm_factory.register_provider("fake", lambda model, **params: fake_llm)
+    llm_factory._embeddings_cache["text-embedding-ada-002"] = fake_embeddings()
+    agent_search.DuckDuckGoSearchAPIWrapper = lambda: FakeSearch(args.search_latency)
+
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        import fakeredis
+        import redis
+        server = fakeredis.FakeServer()
+
+        def from_url(url=None, **kwargs):
+            return fakeredis.FakeRedis(server=server)
+
+        redis.from_url = from_url
+        redis.Redis.from_url = from_url
+    return fake_llm
+
+
+def make_driver(target: str, model: str, url: str = None):
+    """返回 call(session_id, question)，按target选择调用入口"""
+    if target == "system":
+        from langgraph_multi_agent import TrueMultiAgentSystem
+
+        def call(session_id, question):
+            return TrueMultiAgentSystem(session_id, "fake", model).ask(question)
+        return call
+    if target == "core_api":
+        from core_api import multi_agent_ask
+
+        def call(session_id, question):
+            return multi_agent_ask(session_id, question, "fake", model)
+        return call
+    if target == "fastapi":
+        from fastapi.testclient import TestClient
+        from fastapi_conn import app
+        local = threading.local()
+
+        def call(session_id, question):
+            if not hasattr(local, "client"):
+                local.client = TestClient(app)
+            response = local.client.post(
+                "/chat",
+                json={"session_id": session_id, "question": question, "provider": "fake", "model": model},
+            )
+            response.raise_for_status()
+            return response.json()
+        return call
+    if target == "http":
+        import httpx
+        local = threading.local()
+
+        def call(session_id, question):
+            if not hasattr(local, "client"):
+                local.client = httpx.Client(base_url=url, timeout=300)
+            response = local.client.post(
+                "/chat",
+                json={"session_id": session_id, "question": question, "provider": "fake", "model": model},
+            )
+            response.raise_for_status()
+            return response.json()
+        return call
+    raise ValueError(f"不支持的target: {target}")
+
+
+def percentile(sorted_values, p: float) -> float:
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def run_load(call, fake_llm, args) -> dict:
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(i):
+        session_id = f"bench-{i % args.sessions}"
+        question = QUESTIONS[i % len(QUESTIONS)]
+        start = time.perf_counter()
+        try:
+            call(session_id, question)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    # 预热一次，避免把首次导入/建图的耗时算进结果
+    call("bench-warmup", QUESTIONS[0])
+    if fake_llm is not None:
+        fake_llm.reset()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "errors": len(errors),
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "mean_s": round(statistics.mean(latencies), 4) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        # http模式下假模型在服务端进程里，统计不到调用次数
+        "llm_calls_per_request": round(fake_llm.call_count / args.requests, 2) if fake_llm is not None else None,
+        "first_errors": errors[:3],
+    }
+
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float) -> list:
+    """返回退化项的描述列表；延迟越低越好、吞吐越高越好、LLM调用次数不应增加"""
+    regressions = []
+    for key in ("p50_s", "p95_s", "p99_s"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key]} -> {result[key]}")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput_rps: {baseline['throughput_rps']} -> {result['throughput_rps']}")
+    if (result["llm_calls_per_request"] is not None and baseline.get("llm_calls_per_request") is not None
+            and result["llm_calls_per_request"] > baseline["llm_calls_per_request"] + 0.01):
+        regressions.append(
+            f"llm_calls_per_request: {baseline['llm_calls_per_request']} -> {result['llm_calls_per_request']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多代理系统离线压测")
+    parser.add_argument("--target", choices=["system", "core_api", "fastapi", "http"], default="system")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=8, help="请求分布到多少个会话")
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--route", default="knowledge", help="假模型的分类结果，general只走单Agent")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--token-rate", type=float, default=0, help="假模型每秒生成的token数，0为不模拟")
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    parser.add_argument("--redis-url", default=None, help="使用真实Redis，不指定则用fakeredis")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="target为http时的服务地址")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="与基线对比时允许的相对退化幅度")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为该场景的基线")
+    args = parser.parse_args()
+
+    # http模式压测的是外部进程，假模型由服务端的benchmarks.fake_app安装
+    fake_llm = install_fakes(args) if args.target != "http" else None
+    call = make_driver(args.target, args.model, args.url)
+    result = run_load(call, fake_llm, args)
+    scenario = f"{args.target}-c{args.concurrency}-{args.route}-lat{args.llm_latency}"
+    print(f"场景: {scenario}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    baselines = json.loads(BASELINE_FILE.read_text(encoding="utf-8")) if BASELINE_FILE.exists() else {}
+    if args.save_baseline:
+        baselines[scenario] = {k: v for k, v in result.items() if k != "first_errors"}
+        BASELINE_FILE.write_text(json.dumps(baselines, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"已保存基线到 {BASELINE_FILE}")
+        return
+    if scenario not in baselines:
+        print("该场景没有基线，可加 --save-baseline 保存")
+        return
+    regressions = compare_with_baseline(result, baselines[scenario], args.tolerance)
+    if regressions:
+        print("❌ 相比基线出现退化：")
+        for item in regressions:
+            print(f"  - {item}")
+        raise SystemExit(1)
+    print("✅ 未发现退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# 冷启动导入耗时分析：用 python -X importtime 在子进程中导入各入口模块，输出总耗时、最慢的依赖，
+# 并检查导入API入口时是否提前加载了文件问答/搜索的重依赖
+# 用法（在new_week2_homework目录下）：python -m benchmarks.profile_imports --top 15
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+ENTRY_MODULES = ["fastapi_conn", "core_api", "langgraph_multi_agent", "agents.agent_fileqa"]
+
+# 应该推迟到首次使用时才加载的模块
+DEFERRED_MODULES = ["unstructured", "faiss", "langchain_community.vectorstores.faiss", "duckduckgo_search"]
+
+
+def profile_module(module: str) -> list:
+    """返回 [(累计耗时us, 自身耗时us, 模块名)]，按累计耗时降序"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows
+
+
+def loaded_deferred_modules(module: str) -> list:
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, capture_output=True, text=True)
+    return [m for m in proc.stdout.strip().split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导入耗时分析")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--modules", default=",".join(ENTRY_MODULES))
+    args = parser.parse_args()
+
+    for module in args.modules.split(","):
+        rows = profile_module(module)
+        total = next((cumulative for cumulative, _, name in rows if name == module), rows[0][0] if rows else 0)
+        print(f"\n=== {module}: 总导入耗时 {total / 1e6:.3f}s ===")
+        print(f"{'累计(ms)':>10}{'自身(ms)':>10}  模块")
+        for cumulative, self_us, name in rows[:args.top]:
+            print(f"{cumulative / 1000:>10.1f}{self_us / 1000:>10.1f}  {name}")
+        deferred = loaded_deferred_modules(module)
+        if deferred:
+            print(f"⚠️ 导入时已加载应延迟的模块: {', '.join(deferred)}")
+        else:
+            print("✅ 未提前加载文件问答/搜索的重依赖")
+
+
+if __name__ == "__main__":
+    main()
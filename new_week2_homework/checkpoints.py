@@ -0,0 +1,116 @@
+# 工作流检查点：每个节点完成后保存一次精简的状态，同一轮问答重试时从最后完成的节点继续，已成功的Agent不再重跑
+#   - 按(会话ID, 轮次ID)存取，轮次ID默认由“当前历史条数+问题哈希”生成，客户端原样重试即可命中
+#   - 只保存节点产出的字段，对话历史已在Redis会话记录里，不重复序列化；截止时间每次请求重新计算
+#   - 过期时间CHECKPOINT_TTL_S，问答成功后立即删除
+# 存储后端由CHECKPOINT_BACKEND选择：redis（默认，使用REDIS_URL）/ sqlite（CHECKPOINT_DB）/ none（关闭）
+import abc
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CHECKPOINT_BACKEND = os.environ.get("CHECKPOINT_BACKEND", "redis")
+CHECKPOINT_TTL_S = int(os.environ.get("CHECKPOINT_TTL_S", "3600"))
+# 默认放在本模块所在目录下，不随启动时的工作目录变化（多个worker从不同目录启动时仍共用同一个文件）
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints.db"))
+CHECKPOINT_KEY_PREFIX = "workflow_checkpoint:"
+
+# 需要保存的状态字段（节点产出），其余字段（对话历史、截止时间等）每次请求重新构造
+CHECKPOINT_FIELDS = (
+    "next_agents", "agent_tasks", "route_label", "collaboration_plan", "agent_results", "agent_analysis",
+    "missing_agents", "failed_agents", "degraded", "final_answer", "_skip_collaborate", "_skip_finalize",
+)
+
+
+def make_turn_id(history_length: int, user_input: str) -> str:
+    """同一会话、同一历史位置上的同一个问题得到相同的轮次ID"""
+    return f"{history_length}-{hashlib.sha1(user_input.encode('utf-8')).hexdigest()[:16]}"
+
+
+def compact_state(state: dict) -> dict:
+    return {field: state[field] for field in CHECKPOINT_FIELDS if field in state}
+
+
+class CheckpointStore(abc.ABC):
+    @abc.abstractmethod
+    def load(self, key: str):
+        """返回 {"node": 最后完成的节点, "state": 精简状态} 或 None"""
+
+    @abc.abstractmethod
+    def save(self, key: str, node: str, state: dict):
+        """记录node完成后的精简状态，覆盖之前的检查点"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """删除检查点，不存在时忽略"""
+
+
+class RedisCheckpointStore(CheckpointStore):
+    def __init__(self, url: str = None, ttl: int = CHECKPOINT_TTL_S):
+        import redis
+        self.client = redis.Redis.from_url(url or os.environ.get("REDIS_URL"))
+        self.ttl = ttl
+
+    def load(self, key: str):
+        raw = self.client.get(CHECKPOINT_KEY_PREFIX + key)
+        return json.loads(raw) if raw is not None else None
+
+    def save(self, key: str, node: str, state: dict):
+        payload = json.dumps({"node": node, "state": compact_state(state)}, ensure_ascii=False, default=str)
+        self.client.set(CHECKPOINT_KEY_PREFIX + key, payload, ex=self.ttl)
+
+    def delete(self, key: str):
+        self.client.delete(CHECKPOINT_KEY_PREFIX + key)
+
+
+class SqliteCheckpointStore(CheckpointStore):
+    """本地SQLite文件，同一台机器上的多个worker可共享；过期记录在写入时顺带清理"""
+
+    def __init__(self, path: str = CHECKPOINT_DB, ttl: int = CHECKPOINT_TTL_S):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints "
+                "(key TEXT PRIMARY KEY, node TEXT NOT NULL, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT node, state FROM checkpoints WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return {"node": row[0], "state": json.loads(row[1])} if row else None
+
+    def save(self, key: str, node: str, state: dict):
+        now = time.time()
+        payload = json.dumps(compact_state(state), ensure_ascii=False, default=str)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (key, node, state, expires_at) VALUES (?, ?, ?, ?)",
+                (key, node, payload, now + self.ttl),
+            )
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """按CHECKPOINT_BACKEND创建进程内唯一的检查点存储，none时返回None"""
+    global _store
+    with _store_lock:
+        if _store is None and CHECKPOINT_BACKEND != "none":
+            _store = SqliteCheckpointStore() if CHECKPOINT_BACKEND == "sqlite" else RedisCheckpointStore()
+        return _store
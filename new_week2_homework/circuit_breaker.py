@@ -0,0 +1,217 @@
+# provider级熔断：按最近N次调用的错误率和慢调用比例判断provider是否健康
+#   closed     正常放行，统计窗口内错误率或慢调用比例超过阈值时打开
+#   open       拒绝调用（立即抛出CircuitOpenError，由llm_factory切到备用provider），open_seconds后进入半开
+#   half_open  放行一个探测调用，成功则关闭，失败则重新打开
+# 熔断状态和调用结果写入METRICS，在/metrics中以multi_agent_provider_*导出
+import os
+import threading
+import time
+from collections import deque
+from langchain_core.runnables import Runnable
+from metrics import METRICS
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# 默认熔断参数，单个provider可在PROVIDER_CONFIGS里用同名键覆盖
+BREAKER_DEFAULTS = {
+    "breaker_window": int(os.environ.get("BREAKER_WINDOW", "20")),  # 统计最近多少次调用
+    "breaker_min_calls": int(os.environ.get("BREAKER_MIN_CALLS", "5")),  # 窗口内至少多少次调用才判断
+    "breaker_failure_rate": float(os.environ.get("BREAKER_FAILURE_RATE", "0.5")),
+    "breaker_slow_call_s": float(os.environ.get("BREAKER_SLOW_CALL_S", "30")),  # 超过该耗时记为慢调用
+    "breaker_slow_rate": float(os.environ.get("BREAKER_SLOW_RATE", "0.8")),
+    "breaker_open_s": float(os.environ.get("BREAKER_OPEN_S", "30")),  # 打开后多久进入半开
+}
+
+METRICS.describe("multi_agent_provider_state", "provider熔断状态（0关闭/1半开/2打开）", "gauge")
+METRICS.describe("multi_agent_provider_error_rate", "provider最近调用窗口内的错误率", "gauge")
+METRICS.describe("multi_agent_provider_slow_rate", "provider最近调用窗口内的慢调用比例", "gauge")
+METRICS.describe("multi_agent_provider_calls_total", "各provider的LLM调用结果（ok/error/slow/rejected）", "counter")
+METRICS.describe("multi_agent_provider_failover_total", "切换到备用provider的调用次数", "counter")
+
+
+class CircuitOpenError(RuntimeError):
+    """provider处于熔断打开状态，调用被拒绝"""
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, breaker_window: int, breaker_min_calls: int, breaker_failure_rate: float,
+                 breaker_slow_call_s: float, breaker_slow_rate: float, breaker_open_s: float):
+        self.provider = provider
+        self.min_calls = breaker_min_calls
+        self.failure_rate = breaker_failure_rate
+        self.slow_call_s = breaker_slow_call_s
+        self.slow_rate = breaker_slow_rate
+        self.open_s = breaker_open_s
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=breaker_window)  # (是否失败, 是否慢调用)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._publish()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _rates(self):
+        calls = len(self._window)
+        if not calls:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, slow in self._window if slow)
+        return failures / calls, slow_calls / calls
+
+    def _publish(self):
+        failure_rate, slow_rate = self._rates()
+        METRICS.set("multi_agent_provider_state", STATE_VALUES[self._state], provider=self.provider)
+        METRICS.set("multi_agent_provider_error_rate", round(failure_rate, 3), provider=self.provider)
+        METRICS.set("multi_agent_provider_slow_rate", round(slow_rate, 3), provider=self.provider)
+
+    def _transition(self, state: str):
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probe_started = None
+        if state == CLOSED:
+            self._window.clear()
+        self._publish()
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_s:
+            self._transition(HALF_OPEN)
+
+    def allow(self) -> bool:
+        """是否放行本次调用；半开状态同一时间只放行一个探测调用（探测超过open_s未结束时允许再探测）"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN:
+                now = time.monotonic()
+                if self._probe_started is None or now - self._probe_started >= self.open_s:
+                    self._probe_started = now
+                    return True
+            METRICS.inc("multi_agent_provider_calls_total", provider=self.provider, outcome="rejected")
+            return False
+
+    def record(self, success: bool, latency: float):
+        slow = latency >= self.slow_call_s
+        outcome = "error" if not success else ("slow" if slow else "ok")
+        METRICS.inc("multi_agent_provider_calls_total", provider=self.provider, outcome=outcome)
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED if success and not slow else OPEN)
+                return
+            self._window.append((not success, slow))
+            failure_rate, slow_rate = self._rates()
+            if (self._state == CLOSED and len(self._window) >= self.min_calls
+                    and (failure_rate >= self.failure_rate or slow_rate >= self.slow_rate)):
+                self._transition(OPEN)
+            else:
+                self._publish()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._maybe_half_open()
+            failure_rate, slow_rate = self._rates()
+            return {
+                "state": self._state,
+                "calls": len(self._window),
+                "failure_rate": round(failure_rate, 3),
+                "slow_rate": round(slow_rate, 3),
+            }
+
+
+class BreakerGuard(Runnable):
+    """
+    包在provider的LLM外面：调用前检查熔断器（打开时抛出CircuitOpenError），结束时记录结果和耗时
+    只是转发调用，不创建自己的运行记录、不改动传入的config，外层挂的统计回调照常收到模型调用事件
+    failover_from不为空表示这是备用provider，开始调用时计一次切换
+    """
+
+    def __init__(self, llm, breaker: CircuitBreaker, failover_from: str = None):
+        self.llm = llm
+        self.breaker = breaker
+        self.failover_from = failover_from
+
+    @property
+    def InputType(self):
+        return self.llm.InputType
+
+    @property
+    def OutputType(self):
+        return self.llm.OutputType
+
+    def _start(self) -> float:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"provider {self.breaker.provider} 熔断中")
+        if self.failover_from:
+            METRICS.inc("multi_agent_provider_failover_total", source=self.failover_from, target=self.breaker.provider)
+        return time.monotonic()
+
+    def _finish(self, start: float, success: bool):
+        self.breaker.record(success, time.monotonic() - start)
+
+    def invoke(self, input, config=None, **kwargs):
+        start, failed = self._start(), False
+        try:
+            return self.llm.invoke(input, config, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._finish(start, not failed)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        start, failed = self._start(), False
+        try:
+            return await self.llm.ainvoke(input, config, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._finish(start, not failed)
+
+    def stream(self, input, config=None, **kwargs):
+        start, failed = self._start(), False
+        try:
+            yield from self.llm.stream(input, config, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._finish(start, not failed)
+
+    async def astream(self, input, config=None, **kwargs):
+        start, failed = self._start(), False
+        try:
+            async for chunk in self.llm.astream(input, config, **kwargs):
+                yield chunk
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._finish(start, not failed)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str, config: dict = None) -> CircuitBreaker:
+    """每个provider一个熔断器，config中的breaker_*键覆盖默认参数"""
+    with _breakers_lock:
+        if provider not in _breakers:
+            params = {key: (config or {}).get(key, default) for key, default in BREAKER_DEFAULTS.items()}
+            _breakers[provider] = CircuitBreaker(provider, **params)
+        return _breakers[provider]
+
+
+def provider_health() -> dict:
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {provider: breaker.snapshot() for provider, breaker in breakers.items()}
@@ -3,14 +3,49 @@
 from dotenv import load_dotenv
 load_dotenv()
 from memory_manager import RedisConversationMemory
+from logging_config import request_context
 import redis
+import math
 import os
+import queue
+import threading
+import statistics
 import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
-def multi_agent_ask(session_id: str, question: str, provider: str = "openai", model: str = "gpt-4-turbo") -> dict:
+# 批量问答同时处理的会话数上限：每个会话同时还会为各Agent和带超时的调用占用线程，
+# 请求里的max_concurrency超过该值时按该值执行
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "16"))
+
+def warm_up(models=(("openai", "gpt-4-turbo"),)) -> dict:
+    """
+    预加载多代理模块并为给定的(provider, 模型)构建工作流，返回各项耗时（秒）
+    供FastAPI启动时调用，避免首个请求承担导入和建图的开销
+    """
+    timings = {}
+    start = time.perf_counter()
+    from langgraph_multi_agent import get_workflow
+    timings["import"] = round(time.perf_counter() - start, 3)
+    for provider, model in models:
+        start = time.perf_counter()
+        get_workflow(provider, model)
+        timings[f"{provider}:{model}"] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+def multi_agent_ask(session_id: str, question: str, provider: str = "openai", model: str = "gpt-4-turbo",
+                    deadline_s: float = None, turn_id: str = None) -> dict:
     """
     多代理问答主入口，返回AI回复和提问时间
+    deadline_s为本次请求的总时间预算（秒），超时的环节降级处理，返回结果中degraded为True
+    turn_id为本轮的检查点ID，重试同一轮时从上次最后完成的节点继续（不传时按历史条数和问题自动生成）
     """
+    with request_context(session_id):
+        return _multi_agent_ask(session_id, question, provider, model, deadline_s, turn_id=turn_id)
+
+
+def _resolve_question(session_id: str, question: str) -> str:
     # 自动补全文件路径：如果问题里没有|，自动加上session记忆的文件路径
     if "|" not in question:
         r = redis.Redis.from_url(os.environ.get("REDIS_URL"))
@@ -19,21 +54,133 @@ def multi_agent_ask(session_id: str, question: str, provider: str = "openai", mo
         if files:
             file_path = list(files)[-1].decode()  # 取最新上传的文件
             question = f"{file_path}|{question}"
+    return question
+
+
+def _multi_agent_ask(session_id: str, question: str, provider: str, model: str, deadline_s: float = None,
+                     route_label: str = None, resolved: bool = False, turn_id: str = None) -> dict:
+    if not resolved:
+        question = _resolve_question(session_id, question)
     from langgraph_multi_agent import TrueMultiAgentSystem
     multi_agent = TrueMultiAgentSystem(session_id, provider, model)
-    result = multi_agent.ask(question)
+    result = multi_agent.ask(question, deadline_s, route_label, turn_id)
     # 记录时间戳
     r = redis.Redis.from_url(os.environ.get("REDIS_URL"))
     time_key = f"chat_message_time:{session_id}"
     history_len = r.hlen(time_key)
     now = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     r.hset(time_key, history_len, now)
-    return {"answer": result, "question_time": now}
+    # run_report为本轮各节点/Agent/工具的耗时，以及各环节模型调用的token用量和估算费用
+    run_report = multi_agent.last_run_report
+    return {"answer": result, "question_time": now, "run_report": run_report,
+            "degraded": bool(run_report.get("degraded"))}
+
+def _percentile(sorted_values, p: float) -> float:
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def multi_agent_ask_many(items, provider: str = "openai", model: str = "gpt-4-turbo",
+                         max_concurrency: int = 8, deadline_s: float = None):
+    """
+    批量问答：items为[(session_id, question), ...]，按完成顺序逐条产出结果，最后产出一条汇总
+    - 不同会话并发执行（最多max_concurrency个，不超过BATCH_MAX_CONCURRENCY），同一会话内的问题按顺序执行，
+      保证对话历史正确；每个问题的文件路径补全、分类和问答都在各自的会话线程里进行，完成即产出，不等其他问题
+    - 同一批中相同的问题只调用一次分类模型，其余直接复用分类结果
+    每条结果：{"type": "result", "index", "session_id", "question", "answer", "question_time", "degraded",
+              "elapsed_s", "error"}
+    汇总：{"type": "summary", "total", "succeeded", "failed", "wall_s", "classify_calls", "classify_s", "mean_s",
+          "p50_s", "p95_s", "throughput_qps"}（classify_s为各次分类调用的耗时之和）
+    """
+    from langgraph_multi_agent import get_workflow
+    items = list(items)
+    max_concurrency = max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY))
+    start = time.perf_counter()
+    workflow = get_workflow(provider, model)
+
+    routes = {}
+    routes_lock = threading.Lock()
+    classify_stats = {"calls": 0, "seconds": 0.0}
+
+    def route_for(question: str):
+        """相同问题的分类只做一次：第一个线程负责分类，其余线程等待同一个结果"""
+        with routes_lock:
+            future = routes.get(question)
+            owner = future is None
+            if owner:
+                future = routes[question] = Future()
+        if owner:
+            classify_start = time.perf_counter()
+            future.set_result(workflow.classify(question))
+            with routes_lock:
+                classify_stats["calls"] += 1
+                classify_stats["seconds"] += time.perf_counter() - classify_start
+        return future.result()
+
+    sessions = OrderedDict()
+    for index, (session_id, _) in enumerate(items):
+        sessions.setdefault(session_id, []).append(index)
+    results = queue.Queue()
+    stopped = threading.Event()
+
+    def run_session(session_id, indexes):
+        for index in indexes:
+            if stopped.is_set():
+                return
+            question_start = time.perf_counter()
+            record = {"type": "result", "index": index, "session_id": session_id, "question": items[index][1]}
+            try:
+                with request_context(session_id):
+                    question = _resolve_question(session_id, items[index][1])
+                    answer = _multi_agent_ask(session_id, question, provider, model, deadline_s,
+                                              route_label=route_for(question), resolved=True)
+                record.update(answer=answer["answer"], question_time=answer["question_time"],
+                              degraded=answer["degraded"], error=None)
+            except Exception as e:
+                record.update(answer=None, question_time=None, degraded=False, error=str(e))
+            record["elapsed_s"] = round(time.perf_counter() - question_start, 3)
+            results.put(record)
+
+    pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ask_many")
+    try:
+        for session_id, indexes in sessions.items():
+            pool.submit(run_session, session_id, indexes)
+        latencies = []
+        failed = 0
+        for _ in range(len(items)):
+            record = results.get()
+            latencies.append(record["elapsed_s"])
+            failed += record["error"] is not None
+            yield record
+    finally:
+        # 调用方中途停止读取（如客户端断开）时不再执行剩余的问题
+        stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    wall_s = time.perf_counter() - start
+    latencies.sort()
+    yield {
+        "type": "summary",
+        "total": len(items),
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "wall_s": round(wall_s, 3),
+        "classify_calls": classify_stats["calls"],
+        "classify_s": round(classify_stats["seconds"], 3),
+        "mean_s": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        "p50_s": _percentile(latencies, 50),
+        "p95_s": _percentile(latencies, 95),
+        "throughput_qps": round(len(items) / wall_s, 3) if wall_s else 0.0,
+    }
+
 
 def upload_knowledge_file(session_id: str, file_path: str) -> str:
     from langgraph_multi_agent import TrueMultiAgentSystem
-    multi_agent = TrueMultiAgentSystem(session_id, "openai", "gpt-4-turbo")
-    result = multi_agent.upload_file(file_path)
+    with request_context(session_id):
+        multi_agent = TrueMultiAgentSystem(session_id, "openai", "gpt-4-turbo")
+        result = multi_agent.upload_file(file_path)
     # 记忆文件路径到session
     r = redis.Redis.from_url(os.environ.get("REDIS_URL"))
     file_key = f"session_files:{session_id}"
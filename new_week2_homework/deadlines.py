@@ -0,0 +1,141 @@
+# 请求截止时间与各环节时间预算：
+#   - 一次问答有总截止时间（REQUEST_DEADLINE_S），以绝对时间写进工作流状态，在各节点间传递
+#   - 每个节点/每个Agent另有自己的预算，实际可用时间取 min(预算, 距截止时间的剩余)
+#   - 超时的调用不再等待，由调用方降级处理（已开始执行的线程无法强制终止，会在后台跑完后被丢弃）
+#   - 被放弃的调用最长占用线程到底层I/O超时为止（LLM见llm_factory的timeout，搜索见agent_search），
+#     因此每个调用单独起一个守护线程，不放进固定大小的共享线程池，避免放弃的调用占满线程池、拖住后续所有请求；
+#     同时运行的调用数由请求并发限制（uvicorn线程池、批量接口的max_concurrency），
+#     另有进程内的线程总数上限（DEADLINE_MAX_THREADS，含被放弃仍在运行的），用满时新调用直接失败，由调用方按超时降级
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from metrics import METRICS
+
+REQUEST_DEADLINE_S = float(os.environ.get("REQUEST_DEADLINE_S", "60"))
+AGENT_BUDGET_S = float(os.environ.get("AGENT_BUDGET_S", "30"))
+NODE_BUDGETS_S = {
+    "analyze_question": float(os.environ.get("ANALYZE_BUDGET_S", "10")),
+    "execute_agents": float(os.environ.get("EXECUTE_AGENTS_BUDGET_S", "40")),
+    "collaborate": float(os.environ.get("COLLABORATE_BUDGET_S", "15")),
+    "finalize": float(os.environ.get("FINALIZE_BUDGET_S", "10")),
+}
+# 剩余时间少于该值时直接跳过可选环节（如最终润色），留出返回响应的余量
+MIN_STEP_S = float(os.environ.get("MIN_STEP_S", "1"))
+# 进程内同时存在的调用线程上限，下游持续超时时避免被放弃的线程无限堆积
+DEADLINE_MAX_THREADS = int(os.environ.get("DEADLINE_MAX_THREADS", "256"))
+
+METRICS.describe("multi_agent_abandoned_calls", "超时被放弃、仍在后台运行的调用数", "gauge")
+METRICS.describe("multi_agent_call_threads", "正在运行的调用线程数（含被放弃的）", "gauge")
+METRICS.describe("multi_agent_call_threads_limit", "调用线程数上限（DEADLINE_MAX_THREADS）", "gauge")
+METRICS.describe("multi_agent_call_threads_rejected_total", "线程数达到上限而直接失败的调用数", "counter")
+METRICS.set("multi_agent_call_threads_limit", DEADLINE_MAX_THREADS)
+
+
+class DeadlineExceeded(TimeoutError):
+    """调用在时间预算内没有完成"""
+
+
+def new_deadline(seconds: float = None) -> float:
+    """返回绝对截止时间（time.monotonic()时钟）"""
+    return time.monotonic() + (REQUEST_DEADLINE_S if seconds is None else seconds)
+
+
+def remaining(deadline: float) -> float:
+    if deadline is None:
+        return float("inf")
+    return max(0.0, deadline - time.monotonic())
+
+
+def node_deadline(deadline: float, node: str) -> float:
+    """某个节点的截止时间：节点预算和整体截止时间取较早者"""
+    node_end = time.monotonic() + NODE_BUDGETS_S[node]
+    return node_end if deadline is None else min(deadline, node_end)
+
+
+_abandoned = 0
+_abandoned_lock = threading.Lock()
+
+
+def _track_abandoned(delta: int):
+    global _abandoned
+    with _abandoned_lock:
+        _abandoned += delta
+        METRICS.set("multi_agent_abandoned_calls", _abandoned)
+
+
+_threads = 0
+_threads_lock = threading.Lock()
+
+
+def _reserve_thread() -> bool:
+    global _threads
+    with _threads_lock:
+        if _threads >= DEADLINE_MAX_THREADS:
+            return False
+        _threads += 1
+        METRICS.set("multi_agent_call_threads", _threads)
+        return True
+
+
+def _release_thread():
+    global _threads
+    with _threads_lock:
+        _threads -= 1
+        METRICS.set("multi_agent_call_threads", _threads)
+
+
+def _run(future: Future, ctx: contextvars.Context, fn, args, kwargs):
+    try:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = ctx.run(fn, *args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+    finally:
+        _release_thread()
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    在独立的守护线程里执行，复制当前上下文，使LangChain的回调配置和日志关联ID在子线程里仍然有效
+    线程数已达DEADLINE_MAX_THREADS时不再起线程，返回的Future直接以DeadlineExceeded失败
+    """
+    future = Future()
+    if not _reserve_thread():
+        METRICS.inc("multi_agent_call_threads_rejected_total")
+        future.set_exception(DeadlineExceeded(f"调用线程数已达上限{DEADLINE_MAX_THREADS}"))
+        return future
+    ctx = contextvars.copy_context()
+    try:
+        threading.Thread(target=_run, args=(future, ctx, fn, args, kwargs), name="deadline", daemon=True).start()
+    except BaseException:
+        _release_thread()
+        raise
+    return future
+
+
+def abandon(future: Future):
+    """调用方不再等待该调用：尚未开始的直接取消，已在运行的计入被放弃调用数，结束时扣除"""
+    if future.cancel() or future.done():
+        return
+    _track_abandoned(1)
+    future.add_done_callback(lambda _: _track_abandoned(-1))
+
+
+def call_with_timeout(fn, timeout: float, *args, **kwargs):
+    """在timeout秒内返回fn的结果，否则抛出DeadlineExceeded"""
+    if timeout <= 0:
+        raise DeadlineExceeded("没有剩余时间")
+    future = submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if future.done():
+            raise  # 调用本身抛出的超时（或线程数已达上限），不是等待超时
+        abandon(future)
+        raise DeadlineExceeded(f"超过{timeout:.1f}秒未完成") from None
@@ -1,16 +1,40 @@
 from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
-from core_api import multi_agent_ask, get_chat_history, upload_knowledge_file, delete_chat_history, rename_session_id
-import logging
+from contextlib import asynccontextmanager
+from core_api import multi_agent_ask, multi_agent_ask_many, get_chat_history, upload_knowledge_file, delete_chat_history, rename_session_id, warm_up
+from metrics import METRICS
+from logging_config import get_logger, shutdown_logging
+import json
 import os
 from pathlib import Path
 
+# 启动时预热的(provider, 模型)，格式如 "openai:gpt-4-turbo,qwen:qwen-turbo"，置空则不预热
+WARMUP_MODELS = os.environ.get("WARMUP_MODELS", "openai:gpt-4-turbo")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时预加载多代理模块并构建常用模型的工作流，文件问答的重依赖（unstructured、FAISS）仍在首次使用时加载"""
+    models = [tuple(item.split(":", 1)) for item in WARMUP_MODELS.split(",") if ":" in item]
+    if models:
+        try:
+            timings = await run_in_threadpool(warm_up, models)
+            logger.info("工作流预热完成: %s", timings)
+        except Exception as e:
+            logger.warning("工作流预热失败，将在首个请求时构建: %r", e)
+    yield
+    # 关闭前写出日志队列里剩余的记录（进程退出时atexit也会兜底）
+    shutdown_logging()
+
+
 app = FastAPI(
     title="多智能体问答系统API",
     description="提供多智能体问答、知识库上传和历史记录获取功能的API服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -22,9 +46,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# 配置日志（结构化、异步队列写出，级别和格式见logging_config）
+logger = get_logger(__name__)
 
 # 创建上传目录
 UPLOAD_DIR = Path("./uploads")
@@ -37,6 +60,9 @@ class ChatRequest(BaseModel):
     question: str
     provider: Optional[str] = "openai"
     model: Optional[str] = "gpt-4-turbo"
+    debug: Optional[bool] = False  # 为True时在响应中附带本轮的耗时和token统计
+    deadline_s: Optional[float] = Field(None, gt=0, le=300)  # 本次请求的总时间预算（秒），默认REQUEST_DEADLINE_S
+    turn_id: Optional[str] = None  # 本轮的检查点ID，重试同一轮时传相同的值可从上次中断处继续
 
 class ChatResponse(BaseModel):
     answer: str
@@ -44,6 +70,21 @@ class ChatResponse(BaseModel):
     model_used: str
     success: bool
     question_time: str  # 新增：返回提问时间
+    metrics: Optional[Dict] = None  # debug模式下返回各节点/Agent/工具耗时和token用量
+    degraded: bool = False  # 有环节超出时间预算、返回的是降级答案
+
+
+class BatchItem(BaseModel):
+    session_id: str
+    question: str = Field(..., min_length=1)
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=10000)
+    provider: Optional[str] = "openai"
+    model: Optional[str] = "gpt-4-turbo"
+    max_concurrency: int = Field(8, ge=1, le=64)  # 最多同时处理多少个会话（服务端按BATCH_MAX_CONCURRENCY封顶）
+    deadline_s: Optional[float] = Field(None, gt=0, le=300)  # 每个问题的时间预算（秒）
 
 
 class HistoryResponse(BaseModel):
@@ -69,13 +110,21 @@ def read_root():
     return {"欢迎使用": "多智能体问答系统API", "文档": "/docs"}
 
 
+# Prometheus指标接口
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(METRICS.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 # GET方式聊天接口（异步化处理）
 @app.get("/chat/{session_id}", response_model=ChatResponse)
 async def chat_via_get(
         session_id: str,
         question: str = Query(..., min_length=1, max_length=500),
         provider: str = Query("openai", regex="^(openai|qwen)$"),
-        model: str = Query("gpt-4-turbo", regex="^(gpt-3.5-turbo|gpt-4-turbo|qwen-turbo)$")
+        model: str = Query("gpt-4-turbo", regex="^(gpt-3.5-turbo|gpt-4-turbo|qwen-turbo)$"),
+        debug: bool = Query(False),
+        deadline_s: Optional[float] = Query(None, gt=0, le=300)
 ):
     try:
         logger.info(f"Processing question: {question} with {model}")
@@ -86,7 +135,8 @@ async def chat_via_get(
             session_id=session_id,
             question=question,
             provider=provider,
-            model=model
+            model=model,
+            deadline_s=deadline_s
         )
 
         return {
@@ -94,7 +144,9 @@ async def chat_via_get(
             "session_id": session_id,
             "model_used": model,
             "success": True,
-            "question_time": result["question_time"]  # 新增时间戳返回
+            "question_time": result["question_time"],  # 新增时间戳返回
+            "metrics": result["run_report"] if debug else None,
+            "degraded": result["degraded"]
         }
     except Exception as e:
         logger.error(f"Error in chat_via_get: {str(e)}")
@@ -116,7 +168,9 @@ async def chat_via_post(request: ChatRequest):
             session_id=request.session_id,
             question=request.question,
             provider=request.provider,
-            model=request.model
+            model=request.model,
+            deadline_s=request.deadline_s,
+            turn_id=request.turn_id
         )
 
         return {
@@ -124,7 +178,9 @@ async def chat_via_post(request: ChatRequest):
             "session_id": request.session_id,
             "model_used": request.model,
             "success": True,
-            "question_time": result["question_time"]
+            "question_time": result["question_time"],
+            "metrics": result["run_report"] if request.debug else None,
+            "degraded": result["degraded"]
         }
     except Exception as e:
         logger.error(f"Error in chat_via_post: {str(e)}")
@@ -134,6 +190,22 @@ async def chat_via_post(request: ChatRequest):
         )
 
 
+# 批量问答接口：按完成顺序以NDJSON逐行返回每个问题的结果，最后一行为汇总耗时（type为summary）
+@app.post("/chat/batch")
+def chat_batch(request: BatchRequest):
+    logger.info("Processing batch of %d questions with %s", len(request.items), request.model)
+    results = multi_agent_ask_many(
+        [(item.session_id, item.question) for item in request.items],
+        provider=request.provider,
+        model=request.model,
+        max_concurrency=request.max_concurrency,
+        deadline_s=request.deadline_s,
+    )
+    # 同步生成器由StreamingResponse放到线程池里迭代，不阻塞事件循环
+    lines = (json.dumps(record, ensure_ascii=False) + "\n" for record in results)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
 # 文件上传接口（修复上传逻辑，支持前端文件流）
 @app.post("/upload", response_model=UploadResponse)
 async def upload_file(
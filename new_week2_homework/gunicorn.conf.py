@@ -0,0 +1,20 @@
+# 多worker部署配置：gunicorn管理多个uvicorn worker进程
+# 用法（在new_week2_homework目录下）：gunicorn fastapi_conn:app -c gunicorn.conf.py
+# 不用gunicorn时也可以：uvicorn fastapi_conn:app --host 0.0.0.0 --port 8000 --workers 4
+# 多worker之间不共享进程内存，会话历史和共享状态走Redis（REDIS_URL），
+# 文件问答索引放在所有worker都能访问的目录（SHARED_INDEX_DIR），多台机器部署时应挂载为共享存储
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "uvicorn.workers.UvicornWorker"
+# 多Agent协作一次请求可能要几十秒，默认30秒会误杀worker
+timeout = int(os.environ.get("WORKER_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+# 每个worker在自己的lifespan里预热工作流；不在master里预加载，避免fork后共享HTTP连接池
+preload_app = False
+# 定期重启worker，释放长期运行积累的内存
+max_requests = int(os.environ.get("MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
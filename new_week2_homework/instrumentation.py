@@ -0,0 +1,96 @@
+import time
+from usage_tracker import StageUsageTracker
+from metrics import METRICS
+
+# 工作流中的节点名，只统计这些节点本身的运行（节点内部的子调用也带有langgraph_node元数据）
+WORKFLOW_NODES = ("analyze_question", "execute_agents", "collaborate", "finalize")
+
+# Agent运行名的前缀，_execute_agents_node调用Agent时以 agent:<名称> 作为run_name
+AGENT_RUN_PREFIX = "agent:"
+
+
+class RunInstrumentation(StageUsageTracker):
+    """
+    挂在LangGraph一次运行上的回调：在StageUsageTracker的基础上统计各节点、各Agent、各工具的耗时，
+    并把耗时和token用量同步写入进程级的METRICS（/metrics接口导出）
+    """
+
+    def __init__(self, registry=METRICS):
+        super().__init__()
+        self.registry = registry
+        self._spans = {}
+        self.timings = {"node": {}, "agent": {}, "tool": {}}
+
+    def _span_kind(self, name, metadata):
+        if name in WORKFLOW_NODES and (metadata or {}).get("langgraph_node") == name:
+            return "node"
+        if name and name.startswith(AGENT_RUN_PREFIX):
+            return "agent"
+        return None
+
+    def _open_span(self, run_id, kind, name):
+        with self._lock:
+            self._spans[run_id] = (kind, name, time.perf_counter())
+
+    def _close_span(self, run_id, status):
+        end = time.perf_counter()
+        with self._lock:
+            span = self._spans.pop(run_id, None)
+            if span is None:
+                return
+            kind, name, start = span
+            elapsed = end - start
+            stats = self.timings[kind].setdefault(name, {"count": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0})
+            stats["count"] += 1
+            stats["total_s"] += elapsed
+            stats["max_s"] = max(stats["max_s"], elapsed)
+            if status != "ok":
+                stats["errors"] += 1
+        self.registry.observe(f"multi_agent_{kind}_duration_seconds", elapsed, **{kind: name, "status": status})
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        kind = self._span_kind(name, metadata)
+        if kind == "agent":
+            name = name[len(AGENT_RUN_PREFIX):]
+        if kind:
+            self._open_span(run_id, kind, name)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._close_span(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._close_span(run_id, "error")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._open_span(run_id, "tool", name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._close_span(run_id, "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._close_span(run_id, "error")
+
+    def _record_llm(self, stage, node, model, latency, usage):
+        super()._record_llm(stage, node, model, latency, usage)
+        self.registry.observe("multi_agent_llm_duration_seconds", latency, stage=stage, model=model)
+        self.registry.inc("multi_agent_llm_calls_total", stage=stage, model=model, status="ok")
+        for token_type in ("prompt", "completion", "cached"):
+            self.registry.inc("multi_agent_llm_tokens_total", usage[f"{token_type}_tokens"],
+                              stage=stage, model=model, type=token_type)
+
+    def _record_llm_error(self, stage, node, model, latency):
+        super()._record_llm_error(stage, node, model, latency)
+        self.registry.inc("multi_agent_llm_calls_total", stage=stage, model=model, status="error")
+
+    def report(self) -> dict:
+        """在分环节统计的基础上附带节点/Agent/工具的耗时"""
+        report = super().report()
+        with self._lock:
+            report["timings"] = {
+                kind: {name: dict(stats, total_s=round(stats["total_s"], 3), max_s=round(stats["max_s"], 3))
+                       for name, stats in entries.items()}
+                for kind, entries in self.timings.items()
+            }
+        return report
@@ -6,24 +6,36 @@
 """
 
 import os
+import json
+import time
+import logging
+import threading
 import asyncio
+from concurrent.futures import wait
 from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langgraph.graph import StateGraph, END
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_openai_tools_agent, AgentExecutor
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import Runnable, RunnableLambda
 import sys
-sys.stdout.reconfigure(encoding='utf-8')
 
 # 导入现有的组件
 from agents.agent_math import get_math_tool
 from agents.agent_search import get_search_tool
 from agents.agent_knowledge import get_knowledge_tool
 from agents.agent_fileqa import get_fileqa_tool
-from llm_factory import get_llm
+from llm_factory import get_stage_llm, resolve_stage_model, STAGE_ESCALATION
 from memory_manager import RedisConversationMemory
+from instrumentation import RunInstrumentation, AGENT_RUN_PREFIX
+from metrics import METRICS
+from logging_config import get_logger
+from deadlines import (AGENT_BUDGET_S, MIN_STEP_S, NODE_BUDGETS_S, DeadlineExceeded, abandon, call_with_timeout,
+                       new_deadline, node_deadline, remaining, submit)
+from checkpoints import get_checkpoint_store, make_turn_id
+from prompts import (AGENT_SYSTEM_PROMPTS, classify_messages, plan_messages,
+                     collaborate_messages, finalize_messages)
 
 load_dotenv()
 
@@ -33,6 +45,29 @@ from typing import TypedDict, Annotated
 os.environ['HTTP_PROXY'] = 'http://127.0.0.1:7890'
 os.environ['HTTPS_PROXY'] = 'http://127.0.0.1:7890'
 
+logger = get_logger(__name__)
+
+# AgentExecutor是否打印中间步骤（调试用，默认关闭）
+AGENT_VERBOSE = os.environ.get("AGENT_VERBOSE", "0") == "1"
+
+# 分类标签与Agent名称一致
+AGENT_LABELS = ("general", "math", "search", "knowledge", "fileqa")
+
+# Agent执行模式：tool_calling为LLM工具调用循环，direct为直接执行唯一的工具并返回其结果
+# math工具内部已经调用LLM作答，direct模式省掉了"决定调用工具"和"复述工具结果"两次LLM调用
+# knowledge依赖多轮上下文，默认仍由Agent结合历史改写问题后再调用工具
+AGENT_MODES = ("tool_calling", "direct")
+DEFAULT_AGENT_MODES = {
+    "general": "tool_calling",
+    "math": "direct",
+    "search": "tool_calling",
+    "knowledge": "tool_calling",
+    "fileqa": "tool_calling",
+}
+
+# direct模式下随问题一起交给工具的最近历史消息条数
+DIRECT_HISTORY_MESSAGES = int(os.environ.get("DIRECT_HISTORY_MESSAGES", "6"))
+
 class MultiAgentState(TypedDict):
     user_input: Annotated[str, "用户输入"]
     chat_history: Annotated[List[BaseMessage], "对话历史"]
@@ -41,20 +76,35 @@ class MultiAgentState(TypedDict):
     collaboration_plan: Annotated[str, "协作计划"]
     final_answer: Annotated[str, "最终答案"]
     next_agents: Annotated[List[str], "下一步要执行的Agent"]
-
-class TrueMultiAgentSystem:
-    """真正的多代理协作系统"""
+    deadline: Annotated[Optional[float], "请求截止时间（time.monotonic()时钟）"]
+    missing_agents: Annotated[List[str], "超时未返回结果的Agent"]
+    failed_agents: Annotated[List[str], "执行出错的Agent，从检查点恢复时和超时的Agent一起重跑"]
+    degraded: Annotated[List[str], "因超时降级的环节"]
+    agent_tasks: Annotated[Dict[str, str], "各个Agent的子任务"]
+    route_label: Annotated[Optional[str], "预先（批量）分好的问题类别，有效时跳过分类调用"]
+    checkpoint_key: Annotated[Optional[str], "检查点键（会话ID:轮次ID），为空时不保存检查点"]
+    _completed_node: Annotated[Optional[str], "最后完成的节点，从检查点恢复时据此决定从哪个节点继续"]
+    _skip_collaborate: Annotated[bool, "只有一个Agent或没有可整合的结果时跳过协作"]
+    _skip_finalize: Annotated[bool, "协作超时降级后跳过最终优化"]
+
+class MultiAgentWorkflow:
+    """多代理协作工作流：工具、Agent和LangGraph图都与会话无关，按(provider, 模型, 执行模式)在进程内复用"""
     
-    def __init__(self, session_id: str, provider: str = "openai", model: str = "gpt-4-turbo"):
-        self.session_id = session_id
-        self.memory = RedisConversationMemory(session_id)
-        self.llm = get_llm(provider, model)
-        self.file_qa_cache = {}
-        
-        # 创建各个Agent的工具
-        self.math_tool = get_math_tool(self.llm)
-        self.search_tool = get_search_tool(self.llm)
-        self.knowledge_tool = get_knowledge_tool(self.llm)
+    def __init__(self, provider: str = "openai", model: str = "gpt-4-turbo",
+                 agent_modes: Optional[Dict[str, str]] = None):
+        self.provider = provider
+        self.model = model
+        unknown_agents = set(agent_modes or {}) - set(AGENT_LABELS)
+        if unknown_agents:
+            raise ValueError(f"agent_modes中有未知的Agent: {sorted(unknown_agents)}，可选: {list(AGENT_LABELS)}")
+        self.agent_modes = {**DEFAULT_AGENT_MODES, **(agent_modes or {})}
+        # 各Agent的工具调用与回复使用用户选择的模型，其余环节见llm_factory.STAGE_MODELS
+        self.llm = get_stage_llm(provider, model, "agent")
+        
+        # 创建各个Agent的工具（工具内部的LLM调用按环节分配模型）
+        self.math_tool = get_math_tool(self._stage_llm("math_tool"))
+        self.search_tool = get_search_tool(self._stage_llm("search_summary"))
+        self.knowledge_tool = get_knowledge_tool(self._stage_llm("knowledge_tool"))
         self.fileqa_tool = get_fileqa_tool(self.llm)
         
         # 创建各个Agent
@@ -63,138 +113,131 @@ class TrueMultiAgentSystem:
         # 创建LangGraph工作流
         self.workflow = self._create_workflow()
 
+    def _stage_llm(self, stage: str, escalate: bool = False):
+        """获取某个环节使用的LLM"""
+        return get_stage_llm(self.provider, self.model, stage, escalate)
+
+    def _invoke_stage(self, stage: str, messages, accept=None) -> str:
+        """
+        用环节配置的模型调用LLM，accept(content)返回False表示输出不合法（按格式校验，不是模型置信度），
+        开启STAGE_ESCALATION时改用用户选择的模型重试一次
+        """
+        content = self._stage_llm(stage).invoke(messages).content
+        if accept is None or accept(content) or not STAGE_ESCALATION:
+            return content
+        if resolve_stage_model(self.provider, self.model, stage) == self.model:
+            return content
+        logger.info("[%s] 小模型输出不合法，升级到 %s 重试", stage, self.model)
+        return self._stage_llm(stage, escalate=True).invoke(messages).content
+
     
-    def _create_agents(self) -> Dict[str, AgentExecutor]:
+    def _create_agents(self) -> Dict[str, Runnable]:
         """创建各个专业Agent"""
         agents = {}
         
         # 通用对话Agent
         general_prompt = ChatPromptTemplate.from_messages([
-            ("system", 
-"""你是一个通用对话助手，专注于与用户进行日常闲聊、常见问答和一般性问题的解答。你的任务是：
-1. 用自然、亲切、简洁的语言回复用户。
-2. 回答要有温度，避免机械式回复。
-3. 只处理日常对话、闲聊、简单问候等问题，遇到专业领域问题请建议用户提更具体的问题。
-
-【示例】
-用户：你好！
-你：你好呀！很高兴见到你，有什么可以帮您的吗？
-用户：讲个笑话
-你：好的！为什么数学书总是很难过？因为它有太多的问题！
-"""),
+            ("system", AGENT_SYSTEM_PROMPTS["general"]),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder("agent_scratchpad"),
         ])
         general_agent = create_openai_tools_agent(self.llm, [], general_prompt)
-        agents["general"] = AgentExecutor(agent=general_agent, tools=[], verbose=True)
+        agents["general"] = AgentExecutor(agent=general_agent, tools=[], verbose=AGENT_VERBOSE)
         
         # 数学Agent
         math_prompt = ChatPromptTemplate.from_messages([
-            ("system", 
-"""你是顶级数学专家，专注于数学计算、推理和公式推导。你的任务是：
-1. 对于用户的数学问题，给出详细的计算步骤和最终答案。
-2. 如果问题包含非数学部分，请将相关部分交由其他agent处理，不要直接拒绝。
-3. 回答要简明、准确，必要时分点说明。
-4. 只处理与数学相关的问题，不要编造与数学无关的内容。
-
-【示例】
-用户：2的100次方是多少？
-你：步骤1：2^10=1024，2^20=1048576，2^100=1267650600228229401496703205376
-最终答案：2的100次方是1267650600228229401496703205376
-用户：请查一下今天北京的最高气温，并计算比昨天高了多少度，如果昨天是28度。
-你：本问题需要与search agent协作，search agent负责查找今天北京的最高气温，我将根据其结果进行温度差计算。
-"""),
+            ("system", AGENT_SYSTEM_PROMPTS["math"]),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder("agent_scratchpad"),
         ])
         math_agent = create_openai_tools_agent(self.llm, [self.math_tool], math_prompt)
-        agents["math"] = AgentExecutor(agent=math_agent, tools=[self.math_tool], verbose=True)
+        agents["math"] = AgentExecutor(agent=math_agent, tools=[self.math_tool], verbose=AGENT_VERBOSE)
 
 
         # 搜索Agent
         search_prompt = ChatPromptTemplate.from_messages([
-            ("system", 
-"""你是权威信息检索专家，专注于为用户查找最新、最权威的实时信息。你的任务是：
-1. 必须主动使用互联网工具（如search工具）快速定位，查找并返回用户需要的最新权威信息，不要让用户自己去查。
-2. 回答时要简明扼要，直接给出结论，并注明信息来源（如网站名、数据出处）。
-3. 如果查不到相关信息，必须如实说明“未查到”并建议用户尝试其他方式。
-4. 只处理需要实时信息或外部数据的问题，遇到其他问题请建议用户咨询相关专家。
-
-【示例】
-用户：现在北京的天气怎么样？
-你：根据中国气象局官网，当前北京天气为晴，气温25℃。
-用户：请查一下今天北京的最高气温
-你：search工具结果显示，今天北京的最高气温为30℃（来源：新浪天气）。
-"""),
+            ("system", AGENT_SYSTEM_PROMPTS["search"]),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder("agent_scratchpad"),
         ])
         search_agent = create_openai_tools_agent(self.llm, [self.search_tool], search_prompt)
-        agents["search"] = AgentExecutor(agent=search_agent, tools=[self.search_tool], verbose=True)
+        agents["search"] = AgentExecutor(agent=search_agent, tools=[self.search_tool], verbose=AGENT_VERBOSE)
         
         # 知识库Agent
         knowledge_prompt = ChatPromptTemplate.from_messages([
-            ("system", 
-"""你是知识库与历史对话专家，专注于基于知识库和历史对话为用户提供深入分析和解释。你的任务是：
-1. 结合知识库内容和用户历史提问，给出结构化、条理清晰的答案。
-2. 回答要有逻辑、分点说明，必要时引用知识库内容。
-3. 只处理与知识库相关的问题，遇到实时信息、数学、文件等问题请建议用户咨询对应专家。
-4. 不要编造知识库外的信息。
-
-【示例】
-用户：请介绍一下牛顿三大定律。
-你：根据知识库，牛顿三大定律包括：
-1. 第一运动定律（惯性定律）...
-2. 第二运动定律（加速度定律）...
-3. 第三运动定律（作用与反作用定律）...
-"""),
+            ("system", AGENT_SYSTEM_PROMPTS["knowledge"]),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder("agent_scratchpad"),
         ])
         knowledge_agent = create_openai_tools_agent(self.llm, [self.knowledge_tool], knowledge_prompt)
-        agents["knowledge"] = AgentExecutor(agent=knowledge_agent, tools=[self.knowledge_tool], verbose=True)
+        agents["knowledge"] = AgentExecutor(agent=knowledge_agent, tools=[self.knowledge_tool], verbose=AGENT_VERBOSE)
         
         # 文件问答Agent
         fileqa_prompt = ChatPromptTemplate.from_messages([
-            ("system", 
-"""你是文档分析专家，专注于基于用户上传的文件内容进行问答。你的任务是：
-1. 只基于上传文件内容回答问题，不要编造文件外的信息。
-2. 回答要结构化、分点说明，必要时引用文件原文。
-3. 如果输入格式为'<文件路径>|<问题>'，请直接调用fileqa_tool工具。
-4. 如果输入没有文件路径，你可以尝试调用fileqa_tool工具，自动补全为最近一次上传的文件路径和用户问题，不要让用户重复输入文件路径。
-5. 不要处理与文件无关的问题，遇到此类问题请建议用户咨询其他专家。
-
-【示例】
-用户：D:/docs/合同.pdf|请总结这份合同的主要条款
-你：文件内容分析结果：1. 合同主体... 2. 合同金额... 3. 合同期限...（如需引用原文请注明页码）
-"""),
+            ("system", AGENT_SYSTEM_PROMPTS["fileqa"]),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder("agent_scratchpad"),
         ])
         fileqa_agent = create_openai_tools_agent(self.llm, [self.fileqa_tool], fileqa_prompt)
-        agents["fileqa"] = AgentExecutor(agent=fileqa_agent, tools=[self.fileqa_tool], verbose=True)
+        agents["fileqa"] = AgentExecutor(agent=fileqa_agent, tools=[self.fileqa_tool], verbose=AGENT_VERBOSE)
+        
+        # 单工具Agent按配置切换为direct模式
+        for agent_name, mode in self.agent_modes.items():
+            if mode == "direct":
+                tools = agents[agent_name].tools
+                if len(tools) != 1:
+                    raise ValueError(f"只有单工具Agent支持direct模式: {agent_name}")
+                agents[agent_name] = self._create_direct_agent(tools[0])
+            elif mode != "tool_calling":
+                raise ValueError(f"不支持的Agent执行模式: {agent_name}={mode}，可选: {list(AGENT_MODES)}")
         
         return agents
     
+    @staticmethod
+    def _create_direct_agent(agent_tool) -> Runnable:
+        """
+        直接执行模式：跳过LLM工具调用循环，把用户问题连同最近的对话历史和子任务直接交给工具，
+        输出格式与AgentExecutor一致
+        """
+        def run(agent_input: dict) -> dict:
+            return {"output": agent_tool.invoke(MultiAgentWorkflow._direct_query(agent_input))}
+        return RunnableLambda(run, name=f"direct_{agent_tool.name}")
+
+    @staticmethod
+    def _direct_query(agent_input: dict) -> str:
+        """拼出direct模式的工具输入：tool_calling模式下这一步由Agent的LLM结合上下文改写问题完成"""
+        parts = []
+        history = agent_input.get("chat_history") or []
+        if history and DIRECT_HISTORY_MESSAGES > 0:
+            lines = [f"{'用户' if message.type == 'human' else '助手'}：{message.content}"
+                     for message in history[-DIRECT_HISTORY_MESSAGES:]]
+            parts.append("历史对话：\n" + "\n".join(lines))
+        if agent_input.get("task"):
+            parts.append(f"子任务：{agent_input['task']}")
+        if not parts:
+            return agent_input["question"]
+        parts.append(f"当前问题：{agent_input['question']}")
+        return "\n\n".join(parts)
+    
     def _create_workflow(self) -> StateGraph:
         """创建真正的多代理协作工作流"""
         
         # 创建状态图
         workflow = StateGraph(MultiAgentState)
         
-        # 添加节点
-        workflow.add_node("analyze_question", self._analyze_question_node)
-        workflow.add_node("execute_agents", self._execute_agents_node)
-        workflow.add_node("collaborate", self._collaborate_node)
-        workflow.add_node("finalize", self._finalize_node)
+        # 添加节点（每个节点完成后保存检查点）
+        workflow.add_node("analyze_question", self._checkpointed("analyze_question", self._analyze_question_node))
+        workflow.add_node("execute_agents", self._checkpointed("execute_agents", self._execute_agents_node))
+        workflow.add_node("collaborate", self._checkpointed("collaborate", self._collaborate_node))
+        workflow.add_node("finalize", self._checkpointed("finalize", self._finalize_node))
         
-        # 设置入口点
-        workflow.set_entry_point("analyze_question")
+        # 设置入口点：新请求从analyze_question开始，从检查点恢复时从最后完成节点的下一个节点继续
+        workflow.set_conditional_entry_point(self._resume_point)
         
         # 添加边
         workflow.add_edge("analyze_question", "execute_agents")
@@ -208,97 +251,79 @@ class TrueMultiAgentSystem:
         
         return workflow.compile()
     
+    @staticmethod
+    def _checkpointed(node: str, node_fn):
+        """
+        节点完成后把精简状态写入检查点存储，写入失败只记日志，不影响本次请求
+        节点本身超时降级（用了兜底结果）时不保存，重试时重新执行该节点；
+        execute_agents的出错/超时Agent记在failed_agents/missing_agents里，恢复时只重跑这些Agent
+        """
+        def run(state: MultiAgentState) -> MultiAgentState:
+            degraded_before = len(state.get("degraded", []))
+            state = node_fn(state)
+            state["_completed_node"] = node
+            if node in state.get("degraded", [])[degraded_before:]:
+                return state
+            store = get_checkpoint_store()
+            if state.get("checkpoint_key") and store is not None:
+                try:
+                    store.save(state["checkpoint_key"], node, state)
+                except Exception as e:
+                    logger.warning("保存检查点失败（%s）: %r", node, e)
+            return state
+        return run
+    
+    @staticmethod
+    def _resume_point(state: MultiAgentState) -> str:
+        completed = state.get("_completed_node")
+        if completed == "analyze_question":
+            return "execute_agents"
+        if completed == "execute_agents":
+            if state.get("failed_agents") or state.get("missing_agents"):
+                return "execute_agents"
+            return END if state.get("_skip_collaborate") else "collaborate"
+        if completed == "collaborate":
+            return "finalize"
+        if completed == "finalize":
+            return END
+        return "analyze_question"
+    
     def _analyze_question_node(self, state: MultiAgentState) -> MultiAgentState:
         """分析问题，确定需要哪些Agent协作"""
         user_input = state["user_input"]
-        
-        # 用LLM智能判断问题类型
-        classify_prompt = f"""
-请判断下面用户问题属于哪一类（只输出标签，不要解释）：
-- general：一般性/闲聊/无意义问题
-- math：数学计算/推理
-- search：需要实时信息/搜索
-- knowledge：知识库/历史对话
-- fileqa：文件相关
-
-用户问题：{user_input}
-标签：
-"""
-        label = self.llm.invoke([HumanMessage(content=classify_prompt)]).content.strip().lower()
+        deadline = node_deadline(state.get("deadline"), "analyze_question")
+        
+        # 用LLM智能判断问题类型（批量问答时已预先分好类）
+        label = state.get("route_label")
+        if label not in AGENT_LABELS:
+            try:
+                label = call_with_timeout(
+                    self._invoke_stage, remaining(deadline),
+                    "classify",
+                    classify_messages(user_input),
+                    accept=self._is_valid_label
+                ).strip().lower()
+            except DeadlineExceeded:
+                return self._degrade_analysis(state, "问题分类超时")
         if label == "general":
             next_agents = ["general"]
             state["next_agents"] = next_agents
             state["collaboration_plan"] = "LLM判断为一般性/闲聊问题，仅调用general agent。"
-            print(f"问题分析完成，选择的Agent: {next_agents}")
+            logger.info("问题分析完成，选择的Agent: %s", next_agents)
             return state
         
-        # 分析提示
-        analysis_prompt = f"""
-分析以下用户问题，确定需要哪些Agent来协作处理（可以多个Agent协作！）
-
-【特别说明】
-- 如果用户问题涉及“价格”“数量”“多少钱”“市场行情”“最新数据”等，需要查找实时或最新信息时，必须分配search agent协作，search agent负责查找最新数据，knowledge agent负责结合历史知识和实时数据给出综合分析。
-
-用户问题：{user_input}
-
-可用的Agent：
-1. math - 数学计算和推理
-2. search - 实时信息搜索
-3. knowledge - 知识库和历史对话
-4. fileqa - 文档分析
-
-请分析问题并确定：
-1. 哪些Agent需要参与（可以是多个）
-2. 每个Agent的具体任务
-3. Agent之间的协作方式
-
-【示例1】
-用户问题：请查一下今天北京的最高气温，并计算比昨天高了多少度，如果昨天是28度。
-返回：
-{{
-    "agents": ["search", "math"],
-    "tasks": {{
-        "search": "查找今天北京的最高气温",
-        "math": "根据search agent查到的气温，计算比昨天高了多少度"
-    }},
-    "collaboration": "search agent先查气温，math agent再计算温度差"
-}}
-【示例2】
-用户问题：2的100次方是多少？
-返回：
-{{
-    "agents": ["math"],
-    "tasks": {{"math": "计算2的100次方"}},
-    "collaboration": "math agent独立完成"
-}}
-【示例3】
-用户问题：100元能在云南的花季时买几束玫瑰花。
-返回：
-{{
-    "agents": ["search", "knowledge"],
-    "tasks": {{
-        "search": "查找云南花季时玫瑰花的最新市场价格",
-        "knowledge": "结合历史知识和search agent查到的价格，分析100元能买几束玫瑰花"
-    }},
-    "collaboration": "search agent查价格，knowledge agent综合分析"
-}}
-
-请以JSON格式返回：
-{{
-    "agents": ["agent1", "agent2", ...],
-    "tasks": {{
-        "agent1": "具体任务描述",
-        "agent2": "具体任务描述"
-    }},
-    "collaboration": "协作方式描述"
-}}
-"""
-        
         # 获取分析结果
-        analysis_result = self.llm.invoke([HumanMessage(content=analysis_prompt)]).content
+        try:
+            analysis_result = call_with_timeout(
+                self._invoke_stage, remaining(deadline),
+                "plan",
+                plan_messages(user_input),
+                accept=self._is_valid_plan
+            )
+        except DeadlineExceeded:
+            return self._degrade_analysis(state, "协作计划生成超时")
         
         # 解析结果（简化处理）
-        import json
         try:
             analysis = json.loads(analysis_result)
             next_agents = analysis.get("agents", ["knowledge"])
@@ -312,9 +337,52 @@ class TrueMultiAgentSystem:
         state["collaboration_plan"] = analysis_result
         state["agent_tasks"] = agent_tasks
         
-        print(f"问题分析完成，选择的Agent: {next_agents}")
+        logger.info("问题分析完成，选择的Agent: %s", next_agents)
         return state
     
+    def classify(self, question: str, timeout: float = None) -> Optional[str]:
+        """
+        在工作流之外单独给问题分类（批量问答中相同的问题共用一次分类结果），timeout默认为分类节点的预算
+        无法识别、超时或调用失败时返回None，由分类节点在工作流里重新分类
+        """
+        timeout = NODE_BUDGETS_S["analyze_question"] if timeout is None else timeout
+        try:
+            label = call_with_timeout(self._invoke_stage, timeout, "classify", classify_messages(question),
+                                      accept=self._is_valid_label)
+        except Exception as e:
+            logger.warning("问题分类失败，交给工作流重新分类: %r", e)
+            return None
+        label = label.strip().lower()
+        return label if label in AGENT_LABELS else None
+
+    def _degrade_analysis(self, state: MultiAgentState, reason: str) -> MultiAgentState:
+        """问题分析超时：退回关键词规则选择Agent"""
+        next_agents = self._default_agent_selection(state["user_input"])
+        state["next_agents"] = next_agents
+        state["collaboration_plan"] = f"{reason}，按关键词选择Agent：{'、'.join(next_agents)}"
+        state["agent_tasks"] = {}
+        self._mark_degraded(state, "analyze_question")
+        logger.warning("%s，按关键词选择的Agent: %s", reason, next_agents)
+        return state
+
+    @staticmethod
+    def _mark_degraded(state: MultiAgentState, step: str):
+        state["degraded"] = state.get("degraded", []) + [step]
+        METRICS.inc("multi_agent_degraded_total", step=step)
+
+    @staticmethod
+    def _is_valid_label(content: str) -> bool:
+        return content.strip().lower() in AGENT_LABELS
+
+    @staticmethod
+    def _is_valid_plan(content: str) -> bool:
+        """协作计划能解析为JSON且只包含已知Agent时才认为可信"""
+        try:
+            agents = json.loads(content).get("agents")
+        except Exception:
+            return False
+        return bool(agents) and all(agent in AGENT_LABELS for agent in agents)
+
     def _default_agent_selection(self, user_input: str) -> List[str]:
         """默认的Agent选择逻辑"""
         agents = []
@@ -339,69 +407,108 @@ class TrueMultiAgentSystem:
         return agents
     
     def _execute_agents_node(self, state: MultiAgentState) -> MultiAgentState:
-        """并行执行多个Agent"""
+        """
+        并行执行多个Agent，超过时间预算仍未返回的Agent记为缺失，用已返回的结果继续
+        从检查点恢复时只重跑上次出错或超时的Agent，已成功的结果直接沿用
+        """
         user_input = state["user_input"]
         next_agents = state["next_agents"]
         chat_history = state["chat_history"]
         
-        agent_results = {}
-        agent_analysis = {}
+        retry_agents = set(state.get("failed_agents") or []) | set(state.get("missing_agents") or [])
+        agent_results = {name: result for name, result in (state.get("agent_results") or {}).items()
+                         if name not in retry_agents}
+        agent_analysis = {name: analysis for name, analysis in (state.get("agent_analysis") or {}).items()
+                          if name not in retry_agents}
+        state["degraded"] = [step for step in state.get("degraded", [])
+                             if step not in {f"{AGENT_RUN_PREFIX}{name}" for name in retry_agents}]
+        state["_skip_collaborate"] = False
         agent_tasks = state.get("agent_tasks", {})
         
-        print(f"开始并行执行 {len(next_agents)} 个Agent: {next_agents}")
+        logger.debug("开始并行执行 %d 个Agent: %s", len(next_agents), next_agents)
         
-        # 为每个Agent准备输入
+        # 所有Agent同时开始，每个Agent的预算相同，因此整体等待到节点截止时间和Agent预算中较早的一个
+        deadline = min(node_deadline(state.get("deadline"), "execute_agents"), time.monotonic() + AGENT_BUDGET_S)
+        futures = {}
         for agent_name in next_agents:
+            if agent_name in agent_results:
+                continue
             if agent_name in self.agents:
-                try:
-                    # 为每个Agent添加特定的上下文
-                    agent_context = self._get_agent_context(agent_name, user_input)
-                    
-                    agent_input = {
-                        "input": f"{agent_context}\n\n用户问题：{user_input}",
-                        "chat_history": chat_history
-                    }
-                    
-                    # 执行Agent
-                    result = self.agents[agent_name].invoke(agent_input)
-                    output = result["output"]
-                    # 如果是dict，取result字段，否则直接用
-                    if isinstance(output, dict) and "result" in output:
-                        output_str = output["result"]
-                    else:
-                        output_str = output
-                    agent_results[agent_name] = output_str
-                    # 优先用agent_tasks里的内容
-                    if agent_name in agent_tasks:
-                        agent_analysis[agent_name] = agent_tasks[agent_name]
-                    else:
-                        agent_analysis[agent_name] = f"{agent_name} Agent完成分析"
-                    
-                    print(f"✅ {agent_name} Agent执行完成")
-                    
-                except Exception as e:
-                    error_msg = f"{agent_name} Agent执行出错: {str(e)}"
-                    agent_results[agent_name] = error_msg
-                    agent_analysis[agent_name] = error_msg
-                    print(f"❌ {agent_name} Agent执行失败: {repr(e)}")
+                futures[agent_name] = submit(self._run_agent, agent_name, user_input, chat_history,
+                                             agent_tasks.get(agent_name))
             else:
                 error_msg = f"未知的Agent: {agent_name}"
                 agent_results[agent_name] = error_msg
                 agent_analysis[agent_name] = error_msg
-                print(f"❌ {error_msg}")
+                logger.warning(error_msg)
+        wait(futures.values(), timeout=remaining(deadline))
+        
+        missing_agents = []
+        failed_agents = []
+        for agent_name, future in futures.items():
+            if not future.done():
+                # 线程无法强制终止，在后台跑完（底层I/O超时为止）后丢弃结果
+                abandon(future)
+                missing_agents.append(agent_name)
+                self._mark_degraded(state, f"{AGENT_RUN_PREFIX}{agent_name}")
+                logger.warning("%s Agent超过时间预算未返回，跳过", agent_name)
+                continue
+            try:
+                agent_results[agent_name] = future.result()
+                # 优先用agent_tasks里的内容
+                if agent_name in agent_tasks:
+                    agent_analysis[agent_name] = agent_tasks[agent_name]
+                else:
+                    agent_analysis[agent_name] = f"{agent_name} Agent完成分析"
+                logger.debug("%s Agent执行完成", agent_name)
+            except Exception as e:
+                error_msg = f"{agent_name} Agent执行出错: {str(e)}"
+                agent_results[agent_name] = error_msg
+                agent_analysis[agent_name] = error_msg
+                failed_agents.append(agent_name)
+                logger.warning("%s Agent执行失败: %r", agent_name, e)
         
         state["agent_results"] = agent_results
         state["agent_analysis"] = agent_analysis
+        state["missing_agents"] = missing_agents
+        state["failed_agents"] = failed_agents
         
-        print(f"所有Agent执行完成，结果数量: {len(agent_results)}")
+        logger.debug("所有Agent执行完成，结果数量: %d", len(agent_results))
         
         # 如果只分配到一个agent，直接返回final_answer并跳过后续节点
         if len(state["next_agents"]) == 1:
             only_agent = state["next_agents"][0]
-            state["final_answer"] = agent_results[only_agent]
+            state["final_answer"] = agent_results.get(only_agent, self._timeout_answer(missing_agents))
+            state["_skip_collaborate"] = True
+        elif not agent_results:
+            state["final_answer"] = self._timeout_answer(missing_agents)
             state["_skip_collaborate"] = True
         return state
     
+    def _run_agent(self, agent_name: str, user_input: str, chat_history: List[BaseMessage],
+                   task: Optional[str] = None) -> str:
+        """执行单个Agent，返回结果文本（task为协作计划分给该Agent的子任务，direct模式下交给工具）"""
+        # 为每个Agent添加特定的上下文
+        agent_context = self._get_agent_context(agent_name, user_input)
+        agent_input = {
+            "input": f"{agent_context}\n\n用户问题：{user_input}",
+            "question": user_input,
+            "task": task,
+            "chat_history": chat_history
+        }
+        result = self.agents[agent_name].invoke(
+            agent_input, config={"run_name": f"{AGENT_RUN_PREFIX}{agent_name}"}
+        )
+        output = result["output"]
+        # 如果是dict，取result字段，否则直接用
+        if isinstance(output, dict) and "result" in output:
+            return output["result"]
+        return output
+    
+    @staticmethod
+    def _timeout_answer(missing_agents: List[str]) -> str:
+        return f"抱歉，{'、'.join(missing_agents)} Agent未能在规定时间内给出结果，请稍后重试。"
+    
     def _get_agent_context(self, agent_name: str, user_input: str) -> str:
         """为每个Agent提供特定的上下文"""
         contexts = {
@@ -417,82 +524,85 @@ class TrueMultiAgentSystem:
         user_input = state["user_input"]
         agent_results = state["agent_results"]
         collaboration_plan = state["collaboration_plan"]
+        deadline = node_deadline(state.get("deadline"), "collaborate")
         
-        # 构建协作提示
-        collaboration_prompt = f"""
-你是一个多Agent协作系统的协调器。请整合多个Agent的结果，为用户提供最佳答案。
-
-用户问题：{user_input}
-
-协作计划：{collaboration_plan}
-
-各个Agent的结果：
-"""
-        
-        for agent_name, result in agent_results.items():
-            collaboration_prompt += f"\n{agent_name} Agent结果：\n{result}\n"
-        
-        collaboration_prompt += """
-
-请基于所有Agent的结果，为用户提供一个完整、准确、结构化的答案。
-要求：
-1. 整合所有相关Agent的信息
-2. 消除重复和矛盾的信息
-3. 保持逻辑清晰和结构完整
-4. 突出最重要的信息
-5. 如果Agent结果有冲突，请说明并给出最合理的解释
-
-最终答案："""
-
-        # 生成协作结果
-        collaboration_result = self.llm.invoke(collaboration_prompt).content
+        # 生成协作结果，超时则直接拼接各Agent的原始结果
+        messages = collaborate_messages(user_input, collaboration_plan, agent_results, state.get("missing_agents"))
+        try:
+            collaboration_result = call_with_timeout(
+                lambda: self._stage_llm("collaborate").invoke(messages).content, remaining(deadline)
+            )
+        except DeadlineExceeded:
+            self._mark_degraded(state, "collaborate")
+            logger.warning("结果整合超时，直接返回各Agent的结果")
+            collaboration_result = "\n\n".join(
+                f"【{agent_name}】\n{result}" for agent_name, result in agent_results.items()
+            )
+            state["_skip_finalize"] = True
         state["final_answer"] = collaboration_result
         
-        print(f"协作完成，生成了整合结果")
+        logger.debug("协作完成，生成了整合结果")
         return state
     
     def _finalize_node(self, state: MultiAgentState) -> MultiAgentState:
         """最终化节点：优化最终答案"""
         final_answer = state["final_answer"]
         user_input = state["user_input"]
+        deadline = node_deadline(state.get("deadline"), "finalize")
+        if state.get("_skip_finalize") or remaining(deadline) < MIN_STEP_S:
+            return state
         
-        # 最终优化提示
-        finalize_prompt = f"""
-请对以下答案进行最终优化，确保：
-1. 语言简洁明了
-2. 结构清晰
-3. 重点突出
-4. 易于理解
+        # 优化最终答案，超时则保留协作结果
+        messages = finalize_messages(user_input, final_answer)
+        try:
+            state["final_answer"] = call_with_timeout(
+                lambda: self._stage_llm("finalize").invoke(messages).content, remaining(deadline)
+            )
+        except DeadlineExceeded:
+            self._mark_degraded(state, "finalize")
+            logger.warning("最终答案优化超时，保留协作结果")
+        
+        logger.debug("最终答案优化完成")
+        return state
 
-用户问题：{user_input}
-当前答案：{final_answer}
 
-优化后的最终答案："""
+_workflow_lock = threading.Lock()
+_workflow_registry = {}
 
-        # 优化最终答案
-        optimized_answer = self.llm.invoke(finalize_prompt).content
-        state["final_answer"] = optimized_answer
-        
-        print(f"最终答案优化完成")
-        return state
+
+def get_workflow(provider: str = "openai", model: str = "gpt-4-turbo",
+                 agent_modes: Optional[Dict[str, str]] = None) -> MultiAgentWorkflow:
+    """从进程内注册表获取工作流，首次使用时构建"""
+    key = (provider.lower(), model, tuple(sorted((agent_modes or {}).items())))
+    with _workflow_lock:
+        if key not in _workflow_registry:
+            _workflow_registry[key] = MultiAgentWorkflow(provider, model, agent_modes)
+        return _workflow_registry[key]
+
+
+class TrueMultiAgentSystem:
+    """真正的多代理协作系统"""
     
-    def ask(self, user_input: str) -> str:
-        """处理用户问题"""
-        # 获取历史对话
-        chat_history = self.memory.get_history()
-        messages = []
-        for msg in chat_history:
-            if hasattr(msg, 'type'):
-                if msg.type == "human":
-                    messages.append(HumanMessage(content=msg.content))
-                elif msg.type == "ai":
-                    messages.append(AIMessage(content=msg.content))
-            else:
-                if hasattr(msg, 'role'):
-                    if msg.role == "user":
-                        messages.append(HumanMessage(content=msg.content))
-                    else:
-                        messages.append(AIMessage(content=msg.content))
+    def __init__(self, session_id: str, provider: str = "openai", model: str = "gpt-4-turbo",
+                 agent_modes: Optional[Dict[str, str]] = None):
+        self.session_id = session_id
+        self.memory = RedisConversationMemory(session_id)
+        self.last_run_report = {}
+        # 工作流与会话无关，从注册表复用，避免每个请求重新创建工具、Agent和编译LangGraph
+        self.engine = get_workflow(provider, model, agent_modes)
+        self.llm = self.engine.llm
+        self.agents = self.engine.agents
+        self.workflow = self.engine.workflow
+    
+    def ask(self, user_input: str, deadline_s: Optional[float] = None, route_label: Optional[str] = None,
+            turn_id: Optional[str] = None) -> str:
+        """
+        处理用户问题；deadline_s为本次请求的总时间预算（秒），默认REQUEST_DEADLINE_S，超时的环节降级处理
+        route_label为预先分好的问题类别（见MultiAgentWorkflow.classify），有效时跳过分类调用
+        turn_id为本轮的检查点ID，默认由历史条数和问题生成；同一轮重试时从上次最后完成的节点继续
+        """
+        # 获取历史对话（进程内增量缓存，只从Redis读取上次之后新增的消息）
+        messages = self.memory.get_chat_messages()
         initial_state = {
             "user_input": user_input,
             "chat_history": messages,
@@ -501,52 +611,109 @@ class TrueMultiAgentSystem:
             "collaboration_plan": "",
             "final_answer": "",
             "next_agents": [],
-            "agent_tasks": {} # 初始化agent_tasks
+            "agent_tasks": {}, # 初始化agent_tasks
+            "deadline": new_deadline(deadline_s),
+            "route_label": route_label,
+            "checkpoint_key": f"{self.session_id}:{turn_id or make_turn_id(len(messages), user_input)}",
+            "missing_agents": [],
+            "failed_agents": [],
+            "degraded": [],
         }
-        result = self.workflow.invoke(initial_state)
+        resumed_from = self._restore_checkpoint(initial_state)
+        # 统计各节点/Agent/工具的耗时以及各环节模型调用的token和费用
+        instrumentation = RunInstrumentation()
+        start = time.perf_counter()
+        try:
+            result = self.workflow.invoke(initial_state, config={"callbacks": [instrumentation]})
+        except Exception:
+            METRICS.inc("multi_agent_requests_total", status="error")
+            raise
+        finally:
+            METRICS.observe("multi_agent_request_duration_seconds", time.perf_counter() - start)
+        METRICS.inc("multi_agent_requests_total", status="ok")
+        self.last_run_report = instrumentation.report()
+        self.last_run_report["total_s"] = round(time.perf_counter() - start, 3)
+        self.last_run_report["degraded"] = result.get("degraded", [])
+        self.last_run_report["missing_agents"] = result.get("missing_agents", [])
+        self.last_run_report["resumed_from"] = resumed_from
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("本轮各环节调用统计：\n%s", instrumentation.format_report())
         # 保存对话历史
         self.memory.add_user_message(user_input)
         self.memory.add_ai_message(result["final_answer"])
+        self._drop_checkpoint(initial_state["checkpoint_key"])
         # 记录时间戳（调用core_api的redis逻辑）
         try:
-            import redis, os, time
+            import redis
             r = redis.Redis.from_url(os.environ.get("REDIS_URL"))
             time_key = f"chat_message_time:{self.session_id}"
             history_len = r.hlen(time_key)
             now = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             r.hset(time_key, history_len, now)
         except Exception as e:
-            print(f"[warn] 保存时间戳失败: {repr(e)}")
+            logger.warning("保存时间戳失败: %r", e)
         # 拼接agent协作信息（仅多个agent时）
         agents = result.get("next_agents", [])
         final_answer = result["final_answer"]
         if len(agents) > 1:
             agent_names = "、".join(agents)
             final_answer = f"本次回答由[{agent_names}]agent协作完成：\n\n{final_answer}"
+        missing_agents = result.get("missing_agents", [])
+        if missing_agents and len(agents) > 1 and len(missing_agents) < len(agents):
+            final_answer += f"\n\n（{'、'.join(missing_agents)} Agent未能在规定时间内返回结果，以上回答可能不完整）"
         return final_answer
     
+    @staticmethod
+    def _restore_checkpoint(initial_state: dict) -> Optional[str]:
+        """有检查点时把保存的节点产出合并进初始状态，返回最后完成的节点"""
+        store = get_checkpoint_store()
+        if store is None:
+            return None
+        try:
+            checkpoint = store.load(initial_state["checkpoint_key"])
+        except Exception as e:
+            logger.warning("读取检查点失败: %r", e)
+            return None
+        if not checkpoint:
+            return None
+        initial_state.update(checkpoint["state"])
+        initial_state["_completed_node"] = checkpoint["node"]
+        logger.info("从检查点恢复，跳过已完成的节点: %s", checkpoint["node"])
+        return checkpoint["node"]
+    
+    @staticmethod
+    def _drop_checkpoint(key: str):
+        store = get_checkpoint_store()
+        if store is None:
+            return
+        try:
+            store.delete(key)
+        except Exception as e:
+            logger.warning("删除检查点失败: %r", e)
+    
     def upload_file(self, file_path: str) -> str:
         """上传文件到知识库"""
         try:
-            from agents.agent_fileqa import FileQASystem
-            print(f"开始上传文件: {file_path}")
+            from agents.agent_fileqa import get_file_qa_system
+            logger.info("开始上传文件: %s", file_path)
             
             # 检查文件是否存在
             if not os.path.exists(file_path):
                 return f"❌ 文件不存在: {file_path}"
             
-            # 加载文件到缓存
-            self.file_qa_cache[(file_path,)] = FileQASystem(file_path)
-            print(f"文件加载成功: {file_path}")
+            # 建立（或复用其他worker已建好的）共享索引，并放进fileqa工具使用的进程内缓存
+            get_file_qa_system(file_path, self.llm)
+            logger.info("文件加载成功: %s", file_path)
             
             return f"✅ 知识库已更新: {file_path}"
         except Exception as e:
             error_msg = f"❌ 知识库上传失败: {str(e)}"
-            print(f"❌ {repr(error_msg)}")
+            logger.exception(error_msg)
             return error_msg
 
 def main():
     """测试多代理协作系统"""
+    sys.stdout.reconfigure(encoding='utf-8')
     session_id = input("请输入会话ID: ") or "true_multi_agent_test"
     provider = input("请输入大模型类型(openai/qwen，默认openai): ") or "openai"
     model = input("请输入模型名(如gpt-4-turbo/qwen-turbo，默认gpt-4-turbo): ") or "gpt-4-turbo"
@@ -586,4 +753,4 @@ def main():
             print(f"处理失败: {repr(e)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,39 +1,164 @@
 import os
+import json
+import threading
+import httpx
 from langchain_openai import ChatOpenAI
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from circuit_breaker import BreakerGuard, get_breaker
+from deadlines import REQUEST_DEADLINE_S
+from logging_config import get_logger
 # from langchain_community.llms import Qwen, Qianfan
 
-def get_llm(provider: str, model: str):
-    provider = provider.lower()
-    if provider == "openai":
-        return ChatOpenAI(
-            model=model,
-            base_url=os.environ["OPENAI_BASE_URL"],
-            api_key=os.environ["OPENAI_API_KEY"],
-            temperature=0
-        )
-    elif provider == "qwen":
-        # 千问Qwen兼容OpenAI协议，直接用ChatOpenAI即可
-        return ChatOpenAI(
-            model=model,
-            base_url=os.environ["QWEN_BASE_URL"],
-            api_key=os.environ["QWEN_API_KEY"],
-            temperature=0
-        )
-    elif provider == "deepseek":
-        return ChatOpenAI(
-            model=model,
-            base_url=os.environ["DEEPSEEK_BASE_URL"],
-            api_key=os.environ["DEEPSEEK_API_KEY"],
-            temperature=0
-        )
-    elif provider == "qianfan":
-        return ChatOpenAI(
-            model=model,
-            base_url=os.environ["QIANFAN_BASE_URL"],
-            api_key=os.environ["QIANFAN_API_KEY"],
-            temperature=0
+logger = get_logger(__name__)
+
+
+def _json_env(name: str) -> dict:
+    """读取JSON对象格式的环境变量，格式不对时记录告警并忽略，不影响服务启动"""
+    raw = os.environ.get(name)
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.warning("环境变量%s不是合法的JSON，已忽略: %s", name, e)
+        return {}
+    if not isinstance(value, dict):
+        logger.warning("环境变量%s应为JSON对象，已忽略", name)
+        return {}
+    return value
+
+
+# 各provider的接入配置：环境变量、令牌桶限流参数、重试/超时策略
+# requests_per_second / max_bucket_size 对应令牌桶的补充速率和桶容量
+# max_retries 交给openai SDK做指数退避重试（429/5xx/连接错误），timeout为单次请求超时（秒），
+# 不超过请求的总时间预算REQUEST_DEADLINE_S，超时被放弃的调用也会在这之后结束、释放线程
+PROVIDER_CONFIGS = {
+    "openai": {
+        "base_url_env": "OPENAI_BASE_URL",
+        "api_key_env": "OPENAI_API_KEY",
+        "requests_per_second": 5,
+        "max_bucket_size": 10,
+        "max_retries": 3,
+        "timeout": 60,
+    },
+    # 千问Qwen兼容OpenAI协议，直接用ChatOpenAI即可
+    "qwen": {
+        "base_url_env": "QWEN_BASE_URL",
+        "api_key_env": "QWEN_API_KEY",
+        "requests_per_second": 5,
+        "max_bucket_size": 10,
+        "max_retries": 3,
+        "timeout": 60,
+    },
+    "deepseek": {
+        "base_url_env": "DEEPSEEK_BASE_URL",
+        "api_key_env": "DEEPSEEK_API_KEY",
+        "requests_per_second": 3,
+        "max_bucket_size": 6,
+        "max_retries": 4,
+        "timeout": 90,
+    },
+    "qianfan": {
+        "base_url_env": "QIANFAN_BASE_URL",
+        "api_key_env": "QIANFAN_API_KEY",
+        "requests_per_second": 2,
+        "max_bucket_size": 4,
+        "max_retries": 3,
+        "timeout": 60,
+    },
+    # SparkDesk走自己的websocket连接，不经过ChatOpenAI的限流、重试和HTTP连接池，这里只能配置熔断参数
+    "spark": {},
+}
+
+# 共享HTTP连接池的上限，所有provider的同步客户端复用同一个keep-alive池
+# 异步客户端不共享：httpx.AsyncClient的连接绑定创建它的事件循环，交给openai SDK按客户端各自创建
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+# 模型分级：各环节用便宜的小模型（cheap）还是用户选择的模型（strong），也可直接写模型名
+# 可通过环境变量LLM_STAGE_MODELS（JSON）覆盖，如 {"classify": "gpt-4o-mini", "finalize": "strong"}
+STAGE_MODELS = {
+    "classify": "cheap",        # 问题分类（只输出一个标签）
+    "plan": "cheap",            # 生成协作计划JSON
+    "search_summary": "cheap",  # search工具内部对搜索结果的总结
+    "math_tool": "strong",      # math工具内部的分步解答
+    "knowledge_tool": "strong", # knowledge工具内部的知识问答
+    "agent": "strong",          # 各Agent的工具调用与回复
+    "collaborate": "strong",    # 整合多个Agent的结果
+    "finalize": "strong",       # 最终答案优化
+}
+STAGE_MODELS.update(_json_env("LLM_STAGE_MODELS"))
+
+# 各provider的小模型，provider未配置时cheap环节沿用用户选择的模型
+CHEAP_MODELS = {
+    "openai": "gpt-3.5-turbo",
+    "qwen": "qwen-turbo",
+    "deepseek": "deepseek-chat",
+}
+
+# 故障切换：provider熔断或调用失败时改用另一个provider上的等价模型（"provider:模型"）
+# 可通过环境变量LLM_FAILOVER_MODELS（JSON）覆盖；备用provider未配置接入信息时不启用
+FAILOVER_MODELS = {
+    "openai:gpt-4-turbo": "deepseek:deepseek-chat",
+    "openai:gpt-3.5-turbo": "qwen:qwen-turbo",
+    "qwen:qwen-turbo": "openai:gpt-3.5-turbo",
+    "qwen:qwen-plus": "deepseek:deepseek-chat",
+    "deepseek:deepseek-chat": "qwen:qwen-plus",
+}
+FAILOVER_MODELS.update(_json_env("LLM_FAILOVER_MODELS"))
+
+# 小模型输出不合法（分类标签不在候选范围内、计划JSON解析失败）时是否升级到用户选择的模型重试
+# 只按输出是否合法判断，不看模型的置信度（logprobs等各provider支持不一，这里不依赖）
+STAGE_ESCALATION = os.environ.get("LLM_STAGE_ESCALATION", "1") == "1"
+
+# 估算费用用的单价（美元/1K tokens：输入, 输出），按模型名前缀匹配
+MODEL_PRICES = {
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "qwen-turbo": (0.0003, 0.0006),
+    "qwen-plus": (0.0011, 0.0028),
+    "deepseek-chat": (0.00027, 0.0011),
+}
+
+_lock = threading.Lock()
+_llm_cache = {}
+_rate_limiters = {}
+_embeddings_cache = {}
+_http_client = None
+_resilient_cache = {}
+
+
+def _get_http_client() -> httpx.Client:
+    """获取进程内共享的同步HTTP客户端（首次使用时创建，httpx.Client可被多个线程共用）"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=HTTP_POOL_LIMITS)
+    return _http_client
+
+
+def _get_rate_limiter(provider: str) -> InMemoryRateLimiter:
+    """每个provider一个令牌桶限流器，同一provider下的所有模型共享"""
+    if provider not in _rate_limiters:
+        config = PROVIDER_CONFIGS[provider]
+        _rate_limiters[provider] = InMemoryRateLimiter(
+            requests_per_second=config["requests_per_second"],
+            check_every_n_seconds=0.05,
+            max_bucket_size=config["max_bucket_size"],
         )
-    elif provider == "spark":
+    return _rate_limiters[provider]
+
+
+def register_provider(name: str, builder, **config):
+    """注册自定义provider（如压测用的假模型），builder(model, **params)返回LLM实例"""
+    PROVIDER_CONFIGS[name.lower()] = {"builder": builder, **config}
+
+
+def _build_llm(provider: str, model: str, params: dict):
+    config = PROVIDER_CONFIGS[provider]
+    if "builder" in config:
+        return config["builder"](model, **params)
+    if provider == "spark":
         # from langchain_community.llms.sparkdesk import SparkDesk
         from my_llms.sparkdesk import SparkDesk
         return SparkDesk(
@@ -43,5 +168,116 @@ def get_llm(provider: str, model: str):
             # domain="generalv3",
             spark_url="wss://spark-api.xf-yun.com/v3.1/chat"
         )
+    kwargs = {
+        "temperature": 0,
+        "max_retries": config["max_retries"],
+        "timeout": min(config["timeout"], REQUEST_DEADLINE_S),
+    }
+    kwargs.update(params)
+    return ChatOpenAI(
+        model=model,
+        base_url=os.environ[config["base_url_env"]],
+        api_key=os.environ[config["api_key_env"]],
+        http_client=_get_http_client(),
+        rate_limiter=_get_rate_limiter(provider),
+        **kwargs
+    )
+
+
+def get_llm(provider: str, model: str, **params):
+    """
+    获取共享的LLM客户端，按(provider, model, params)缓存复用
+    params为额外的模型参数（如temperature、max_tokens），会覆盖provider的默认值
+    """
+    provider = provider.lower()
+    if provider not in PROVIDER_CONFIGS:
+        raise ValueError(f"不支持的provider: {provider}")
+    cache_key = (provider, model, tuple(sorted(params.items())))
+    with _lock:
+        if cache_key not in _llm_cache:
+            _llm_cache[cache_key] = _build_llm(provider, model, params)
+        return _llm_cache[cache_key]
+
+
+def provider_available(provider: str) -> bool:
+    """provider是否已注册且配置了接入信息"""
+    config = PROVIDER_CONFIGS.get(provider)
+    if config is None:
+        return False
+    if "builder" in config:
+        return True
+    if provider == "spark":
+        return "SPARK_APP_ID" in os.environ
+    return bool(os.environ.get(config["base_url_env"]) and os.environ.get(config["api_key_env"]))
+
+
+def _guarded(provider: str, model: str, failover_from: str = None):
+    # 熔断检查放在包装层而不是with_config(callbacks=...)：后者会替换掉调用方继承下来的回调，
+    # 节点里直接调用的模型（分类、计划、整合、优化、工具内部）就不再计入按环节的统计
+    llm = get_llm(provider, model)
+    breaker = get_breaker(provider, PROVIDER_CONFIGS[provider])
+    return BreakerGuard(llm, breaker, failover_from)
+
+
+def get_resilient_llm(provider: str, model: str):
+    """
+    带熔断和故障切换的LLM：调用前检查provider熔断器，失败/熔断时按FAILOVER_MODELS切到备用provider
+    返回的Runnable同样支持bind(tools=...)，可直接交给create_openai_tools_agent
+    """
+    provider = provider.lower()
+    cache_key = (provider, model)
+    with _lock:
+        cached = _resilient_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    primary = _guarded(provider, model)
+    fallback = FAILOVER_MODELS.get(f"{provider}:{model}")
+    fallback_provider, _, fallback_model = (fallback or "").partition(":")
+    if fallback and fallback_provider != provider and provider_available(fallback_provider):
+        resilient = primary.with_fallbacks([_guarded(fallback_provider, fallback_model, failover_from=provider)])
     else:
-        raise ValueError(f"不支持的provider: {provider}")
\ No newline at end of file
+        resilient = primary
+    with _lock:
+        return _resilient_cache.setdefault(cache_key, resilient)
+
+
+def get_embeddings(model: str = "text-embedding-ada-002"):
+    """获取共享的向量化客户端（目前只有openai提供embedding服务）"""
+    from langchain_openai import OpenAIEmbeddings
+    with _lock:
+        if model not in _embeddings_cache:
+            config = PROVIDER_CONFIGS["openai"]
+            _embeddings_cache[model] = OpenAIEmbeddings(
+                model=model,
+                base_url=os.environ[config["base_url_env"]],
+                api_key=os.environ[config["api_key_env"]],
+                http_client=_get_http_client(),
+                max_retries=config["max_retries"],
+                timeout=config["timeout"],
+            )
+        return _embeddings_cache[model]
+
+
+def resolve_stage_model(provider: str, model: str, stage: str, escalate: bool = False) -> str:
+    """根据环节配置确定实际使用的模型，escalate=True时强制使用用户选择的模型"""
+    tier = STAGE_MODELS.get(stage, "strong")
+    if escalate or tier == "strong":
+        return model
+    if tier == "cheap":
+        return CHEAP_MODELS.get(provider.lower(), model)
+    return tier
+
+
+def get_stage_llm(provider: str, model: str, stage: str, escalate: bool = False):
+    """获取某个环节使用的LLM（带熔断和故障切换），调用时metadata带上llm_stage，供统计按环节汇总"""
+    stage_model = resolve_stage_model(provider, model, stage, escalate)
+    return get_resilient_llm(provider, stage_model).with_config(metadata={"llm_stage": stage})
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按MODEL_PRICES估算一次调用的费用（美元），未知模型记为0"""
+    matched = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matched:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[max(matched, key=len)]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1000
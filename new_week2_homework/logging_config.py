@@ -0,0 +1,115 @@
+# 结构化日志：带请求/会话关联ID、按请求采样、通过队列异步写出，避免请求线程做同步的控制台I/O
+# 配置项（环境变量）：
+#   LOG_LEVEL        日志级别，默认INFO
+#   LOG_FORMAT       json / text，默认text
+#   LOG_SAMPLE_RATE  INFO及以下日志的请求采样率（0~1），默认1；WARNING及以上总是输出
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import uuid
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+_session_id = contextvars.ContextVar("session_id", default="-")
+_sampled = contextvars.ContextVar("log_sampled", default=True)
+
+_setup_lock = threading.Lock()
+_listener = None
+_listener_stopped = False
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程里把关联ID写进日志记录，并按请求采样丢弃低级别日志"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        record.session_id = _session_id.get()
+        return record.levelno >= logging.WARNING or _sampled.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "session_id": getattr(record, "session_id", "-"),
+            "message": record.getMessage(),
+        }
+        extra = getattr(record, "fields", None)
+        if extra:
+            payload.update(extra)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s %(session_id)s] %(name)s: %(message)s"
+
+
+def setup_logging():
+    """初始化根日志：请求线程只把记录放进队列，由后台线程统一格式化并写出（可重复调用）"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        level = os.environ.get("LOG_LEVEL", "INFO").upper()
+        output = logging.StreamHandler()
+        if os.environ.get("LOG_FORMAT", "text") == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列里剩余的日志并停止后台线程，之后的日志在调用线程里直接写出（可重复调用）"""
+    global _listener_stopped
+    with _setup_lock:
+        if _listener is None or _listener_stopped:
+            return
+        _listener.stop()
+        _listener_stopped = True
+        root = logging.getLogger()
+        root.handlers = list(_listener.handlers)
+        for handler in root.handlers:
+            handler.addFilter(ContextFilter())
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
+
+
+@contextlib.contextmanager
+def request_context(session_id: str = "-", request_id: str = None):
+    """在with块内为日志绑定会话ID和请求ID，并决定本次请求的低级别日志是否采样输出"""
+    sample_rate = float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+    tokens = [
+        _request_id.set(request_id or uuid.uuid4().hex[:12]),
+        _session_id.set(session_id),
+        _sampled.set(random.random() < sample_rate),
+    ]
+    try:
+        yield
+    finally:
+        _sampled.reset(tokens[2])
+        _session_id.reset(tokens[1])
+        _request_id.reset(tokens[0])
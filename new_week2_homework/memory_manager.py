@@ -1,10 +1,45 @@
+import json
 import os
+import threading
+from collections import OrderedDict
 from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import RedisChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, messages_from_dict
 from dotenv import load_dotenv
 load_dotenv()
 
 REDIS_URL = os.environ.get("REDIS_URL")
+# 进程内最多缓存多少个会话的消息列表（LRU淘汰）
+HISTORY_CACHE_SESSIONS = int(os.environ.get("HISTORY_CACHE_SESSIONS", "1000"))
+
+
+class _CachedHistory:
+    __slots__ = ("count", "head", "messages")
+
+    def __init__(self, count, head, messages):
+        self.count = count  # 已缓存的Redis列表长度
+        self.head = head  # 缓存时最新一条消息的原始JSON，用于校验列表没有被删改
+        self.messages = messages
+
+
+_history_cache = OrderedDict()
+_history_cache_lock = threading.Lock()
+
+
+def _to_chat_messages(raw_items):
+    """Redis里按时间倒序（lpush）保存的原始JSON -> 按时间正序的Human/AI消息"""
+    messages = []
+    for msg in messages_from_dict([json.loads(raw) for raw in reversed(raw_items)]):
+        if msg.type == "human":
+            messages.append(HumanMessage(content=msg.content))
+        elif msg.type == "ai":
+            messages.append(AIMessage(content=msg.content))
+    return messages
+
+
+def invalidate_history_cache(session_id: str):
+    with _history_cache_lock:
+        _history_cache.pop(session_id, None)
 
 class RedisConversationMemory:
     def __init__(self, session_id: str):
@@ -21,10 +56,43 @@ class RedisConversationMemory:
 
     def clear(self):
         self.history.clear()
+        invalidate_history_cache(self.session_id)
 
     def get_history(self):
         return self.history.messages
 
+    def get_chat_messages(self):
+        """
+        返回对话历史的Human/AI消息列表（按时间正序）
+        进程内按会话缓存已转换好的消息，每轮只从Redis读取新增的部分：
+        先取LLEN，再从表头取“新增条数+1”条，多出的那条必须等于缓存时的最新消息，否则说明列表被删改过，整体重建
+        """
+        client = self.history.redis_client
+        key = self.history.key
+        length = client.llen(key)
+        with _history_cache_lock:
+            cached = _history_cache.get(self.session_id)
+        if cached is not None and 0 < cached.count <= length:
+            raw_items = client.lrange(key, 0, length - cached.count)
+            if raw_items and raw_items[-1] == cached.head:
+                messages = cached.messages + _to_chat_messages(raw_items[:-1])
+                self._store(length, raw_items[0], messages)
+                return list(messages)
+        elif cached is not None and cached.count == length == 0:
+            return []
+
+        raw_items = client.lrange(key, 0, -1)
+        messages = _to_chat_messages(raw_items)
+        self._store(len(raw_items), raw_items[0] if raw_items else None, messages)
+        return list(messages)
+
+    def _store(self, count, head, messages):
+        with _history_cache_lock:
+            _history_cache[self.session_id] = _CachedHistory(count, head, messages)
+            _history_cache.move_to_end(self.session_id)
+            while len(_history_cache) > HISTORY_CACHE_SESSIONS:
+                _history_cache.popitem(last=False)
+
     def add_user_message(self, content):
         self.history.add_user_message(content)
 
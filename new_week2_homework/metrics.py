@@ -0,0 +1,94 @@
+# 进程内的指标注册表，按Prometheus文本格式导出（/metrics接口使用）
+# 不依赖langchain等重量级模块，fastapi_conn可以直接导入
+import threading
+
+# 耗时直方图的分桶上限（秒）
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """线程安全的计数器和直方图集合"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name: str, help_text: str, metric_type: str):
+        """登记指标的说明和类型（counter / histogram / gauge）"""
+        self._help[name] = (help_text, metric_type)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+            hist["count"] += 1
+            hist["sum"] += seconds
+
+    def render_prometheus(self) -> str:
+        """按Prometheus文本格式（0.0.4）输出所有指标"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(hist, buckets=list(hist["buckets"])) for key, hist in self._histograms.items()}
+        lines = []
+        described = set()
+
+        def header(name):
+            if name in described or name not in self._help:
+                return
+            described.add(name)
+            help_text, metric_type = self._help[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name)
+            lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+        for (name, labels), hist in sorted(histograms.items()):
+            header(name)
+            labels = dict(labels)
+            for bound, count in zip(DURATION_BUCKETS, hist["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {hist['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("multi_agent_requests_total", "问答请求数（按结果状态）", "counter")
+METRICS.describe("multi_agent_request_duration_seconds", "一次问答的总耗时", "histogram")
+METRICS.describe("multi_agent_node_duration_seconds", "LangGraph各节点的耗时", "histogram")
+METRICS.describe("multi_agent_agent_duration_seconds", "各Agent的执行耗时", "histogram")
+METRICS.describe("multi_agent_tool_duration_seconds", "各工具的执行耗时", "histogram")
+METRICS.describe("multi_agent_llm_duration_seconds", "LLM调用耗时（按环节和模型）", "histogram")
+METRICS.describe("multi_agent_llm_calls_total", "LLM调用次数（按环节、模型和结果）", "counter")
+METRICS.describe("multi_agent_llm_tokens_total", "LLM token用量（prompt/completion/cached）", "counter")
+METRICS.describe("multi_agent_degraded_total", "因超出时间预算而降级的环节次数（按环节）", "counter")
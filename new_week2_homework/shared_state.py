@@ -0,0 +1,228 @@
+# 多worker/多节点共享状态：
+#   - 小数据（文件内容哈希等缓存条目）放在StateBackend里，默认Redis，单进程开发时可用内存实现
+#   - FAISS索引放在共享文件系统目录（SHARED_INDEX_DIR），所有worker按内容哈希复用同一份索引
+#   - 跨进程文件锁保证同一文档只有一个worker在做解析和向量化
+import abc
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+from pathlib import Path
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+SHARED_INDEX_DIR = Path(os.environ.get("SHARED_INDEX_DIR", "./shared_index"))
+STATE_KEY_PREFIX = "shared_state:"
+DIGEST_CACHE_SIZE = 1024  # 进程内缓存的文件哈希条数
+
+
+class StateBackend(abc.ABC):
+    """小数据共享存储接口，值为可JSON序列化的对象"""
+
+    @abc.abstractmethod
+    def get(self, key: str):
+        """返回key对应的值，不存在或已过期时返回None"""
+
+    @abc.abstractmethod
+    def set(self, key: str, value, ttl: int = None):
+        """写入值，ttl为过期秒数（None为不过期）"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """删除key，不存在时忽略"""
+
+
+class RedisStateBackend(StateBackend):
+    def __init__(self, url: str = None):
+        import redis
+        self.client = redis.Redis.from_url(url or os.environ.get("REDIS_URL"))
+
+    def get(self, key: str):
+        raw = self.client.get(STATE_KEY_PREFIX + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value, ttl: int = None):
+        self.client.set(STATE_KEY_PREFIX + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    def delete(self, key: str):
+        self.client.delete(STATE_KEY_PREFIX + key)
+
+
+class LocalStateBackend(StateBackend):
+    """进程内实现，只适合单worker开发调试"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key: str):
+        with self._lock:
+            value, expires_at = self._data.get(key, (None, None))
+            if expires_at is not None and expires_at < time.time():
+                self._data.pop(key, None)
+                return None
+            return value
+
+    def set(self, key: str, value, ttl: int = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_state_backend() -> StateBackend:
+    """按环境变量STATE_BACKEND（redis/local，默认redis）创建进程内唯一的共享存储"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if os.environ.get("STATE_BACKEND", "redis") == "local":
+                _backend = LocalStateBackend()
+            else:
+                _backend = RedisStateBackend()
+        return _backend
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: Path):
+    """跨进程互斥锁（POSIX用flock，Windows用msvcrt），进程退出时由操作系统自动释放"""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    # 锁被其他进程持有，稍后重试
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+_digest_lock = threading.Lock()
+_digest_cache = {}
+
+
+def _hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(file_path: str) -> str:
+    """
+    文件内容的sha256，用作索引的内容地址
+    按(路径, 修改时间, 大小)缓存：先查进程内缓存，再查共享存储（其他worker算过的），都没有才读整个文件
+    """
+    path = os.path.realpath(file_path)
+    info = os.stat(path)
+    signature = [info.st_mtime_ns, info.st_size]
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    backend_key = f"file_digest:{path}"
+    digest = None
+    try:
+        shared = get_state_backend().get(backend_key)
+        if shared and shared.get("signature") == signature:
+            digest = shared["digest"]
+    except Exception as e:
+        logger.warning("读取共享文件哈希失败: %r", e)
+    if digest is None:
+        digest = _hash_file(path)
+        try:
+            get_state_backend().set(backend_key, {"signature": signature, "digest": digest})
+        except Exception as e:
+            logger.warning("写入共享文件哈希失败: %r", e)
+
+    with _digest_lock:
+        if len(_digest_cache) >= DIGEST_CACHE_SIZE:
+            _digest_cache.pop(next(iter(_digest_cache)))
+        _digest_cache[path] = (signature, digest)
+    return digest
+
+
+class IndexStore:
+    """共享文件系统上的FAISS索引仓库，按key（内容哈希+向量化参数）存取"""
+
+    def __init__(self, root: Path = SHARED_INDEX_DIR):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def exists(self, key: str) -> bool:
+        return (self._path(key) / "index.faiss").exists()
+
+    def load(self, key: str, embeddings):
+        # 信任边界：FAISS的docstore用pickle保存，加载时会执行其中的任意代码，
+        # 因此索引目录只能由本服务写入（不能放用户可写的位置），其他用户可写的目录直接拒绝加载
+        from langchain_community.vectorstores import FAISS
+        if os.name != "nt" and self.root.stat().st_mode & stat.S_IWOTH:
+            raise PermissionError(f"索引目录{self.root}对其他用户可写，拒绝加载pickle数据")
+        return FAISS.load_local(str(self._path(key)), embeddings, allow_dangerous_deserialization=True)
+
+    def save(self, key: str, vector_store):
+        """先写到临时目录再原子改名，其他worker不会读到写了一半的索引"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f".{key}.{uuid.uuid4().hex}.tmp"
+        vector_store.save_local(str(tmp_path))
+        target = self._path(key)
+        if target.exists():
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, target)
+
+    def get_or_build(self, key: str, build, embeddings):
+        """
+        返回(向量库, 是否本进程新建)；持有跨进程锁检查并构建，
+        多个worker同时请求同一文档时只有拿到锁的第一个会真正解析和向量化
+        """
+        if self.exists(key):
+            return self.load(key, embeddings), False
+        with file_lock(self.root / f"{key}.lock"):
+            if self.exists(key):
+                return self.load(key, embeddings), False
+            vector_store = build()
+            self.save(key, vector_store)
+            return vector_store, True
+
+
+_index_store = None
+
+
+def get_index_store() -> IndexStore:
+    """进程内唯一的共享索引仓库"""
+    global _index_store
+    with _backend_lock:
+        if _index_store is None:
+            _index_store = IndexStore(SHARED_INDEX_DIR)
+    return _index_store
@@ -0,0 +1,31 @@
+# 测试按环节的LLM用量统计：用假模型、假搜索和fakeredis跑一轮完整的多代理问答（不访问外部服务）
+# 节点里直接调用的模型（分类、计划、整合、优化）和工具内部的模型调用都应计入last_run_report
+# 用法（在new_week2_homework目录下）：python test_stage_usage.py 或 pytest test_stage_usage.py
+import argparse
+
+from benchmarks.loadtest import install_fakes
+
+EXPECTED_STAGES = ("classify", "plan", "agent", "search_summary", "knowledge_tool", "collaborate", "finalize")
+
+
+def test_stage_usage_recorded():
+    install_fakes(argparse.Namespace(llm_latency=0, token_rate=0, route="knowledge", search_latency=0,
+                                     redis_url=None))
+    from langgraph_multi_agent import TrueMultiAgentSystem
+    from circuit_breaker import provider_health
+
+    system = TrueMultiAgentSystem("test_stage_usage", "fake", "fake-model")
+    system.ask("今天北京的最高气温是多少")
+    report = system.last_run_report
+
+    for stage in EXPECTED_STAGES:
+        stats = report["stages"].get(stage)
+        assert stats and stats["calls"] >= 1, f"环节{stage}没有记录到LLM调用: {sorted(report['stages'])}"
+        assert stats["prompt_tokens"] > 0 and stats["completion_tokens"] > 0, f"环节{stage}没有记录到token用量"
+    # 熔断器在包装层照常记录调用结果
+    assert provider_health()["fake"]["calls"] > 0
+
+
+if __name__ == "__main__":
+    test_stage_usage_recorded()
+    print("按环节用量统计正常")
@@ -0,0 +1,160 @@
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from llm_factory import estimate_cost
+
+
+def extract_token_usage(response) -> dict:
+    """
+    从LLMResult中取出token用量，兼容usage_metadata和openai的token_usage两种格式
+    cached_tokens为命中provider前缀缓存的输入token数（OpenAI为prompt_tokens_details.cached_tokens，
+    DeepSeek为prompt_cache_hit_tokens）
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    llm_output = response.llm_output or {}
+    token_usage = llm_output.get("token_usage") or {}
+    if token_usage:
+        usage["prompt_tokens"] = token_usage.get("prompt_tokens", 0) or 0
+        usage["completion_tokens"] = token_usage.get("completion_tokens", 0) or 0
+        prompt_details = token_usage.get("prompt_tokens_details") or {}
+        usage["cached_tokens"] = (prompt_details.get("cached_tokens")
+                                  or token_usage.get("prompt_cache_hit_tokens") or 0)
+        return usage
+    for generations in response.generations:
+        for gen in generations:
+            usage_metadata = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+            usage["prompt_tokens"] += usage_metadata.get("input_tokens", 0)
+            usage["completion_tokens"] += usage_metadata.get("output_tokens", 0)
+            input_details = usage_metadata.get("input_token_details") or {}
+            usage["cached_tokens"] += input_details.get("cache_read", 0) or 0
+    return usage
+
+
+class StageUsageTracker(BaseCallbackHandler):
+    """
+    按环节统计LLM调用的次数、耗时、token用量和估算费用，并按LangGraph节点统计前缀缓存命中率
+    环节名取自调用时metadata中的llm_stage（由llm_factory.get_stage_llm写入），
+    节点名取自LangGraph写入的langgraph_node
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs = {}
+        self.stages = {}
+        self.nodes = {}
+
+    def _start(self, run_id, metadata, invocation_params):
+        metadata = metadata or {}
+        stage = metadata.get("llm_stage", "unknown")
+        node = metadata.get("langgraph_node", "unknown")
+        params = invocation_params or {}
+        model = params.get("model") or params.get("model_name") or ""
+        with self._lock:
+            self._runs[run_id] = (stage, node, model, time.perf_counter())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata, kwargs.get("invocation_params"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata, kwargs.get("invocation_params"))
+
+    def _stage_stats(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {
+                "calls": 0,
+                "errors": 0,
+                "latency_s": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cached_tokens": 0,
+                "cost_usd": 0.0,
+                "models": [],
+            }
+        return self.stages[stage]
+
+    def _node_stats(self, node):
+        if node not in self.nodes:
+            self.nodes[node] = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        return self.nodes[node]
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        end = time.perf_counter()
+        usage = extract_token_usage(response)
+        with self._lock:
+            stage, node, model, start = self._runs.pop(run_id, ("unknown", "unknown", "", end))
+            model = (response.llm_output or {}).get("model_name") or model
+            self._record_llm(stage, node, model, end - start, usage)
+
+    def _record_llm(self, stage, node, model, latency, usage):
+        """累计一次成功的LLM调用（调用方持有锁）"""
+        stats = self._stage_stats(stage)
+        stats["calls"] += 1
+        stats["latency_s"] += latency
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["completion_tokens"] += usage["completion_tokens"]
+        stats["cached_tokens"] += usage["cached_tokens"]
+        stats["cost_usd"] += estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"])
+        if model and model not in stats["models"]:
+            stats["models"].append(model)
+        node_stats = self._node_stats(node)
+        node_stats["calls"] += 1
+        node_stats["prompt_tokens"] += usage["prompt_tokens"]
+        node_stats["cached_tokens"] += usage["cached_tokens"]
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        end = time.perf_counter()
+        with self._lock:
+            stage, node, model, start = self._runs.pop(run_id, ("unknown", "unknown", "", end))
+            self._record_llm_error(stage, node, model, end - start)
+
+    def _record_llm_error(self, stage, node, model, latency):
+        """累计一次失败的LLM调用（调用方持有锁）"""
+        stats = self._stage_stats(stage)
+        stats["errors"] += 1
+        stats["latency_s"] += latency
+
+    def report(self) -> dict:
+        """返回各环节、各节点的统计结果以及总计"""
+        with self._lock:
+            stages = {name: dict(stats, latency_s=round(stats["latency_s"], 3), cost_usd=round(stats["cost_usd"], 6))
+                      for name, stats in self.stages.items()}
+            nodes = {name: dict(stats, cache_hit_rate=_hit_rate(stats)) for name, stats in self.nodes.items()}
+        total = {
+            "calls": sum(s["calls"] for s in stages.values()),
+            "latency_s": round(sum(s["latency_s"] for s in stages.values()), 3),
+            "prompt_tokens": sum(s["prompt_tokens"] for s in stages.values()),
+            "completion_tokens": sum(s["completion_tokens"] for s in stages.values()),
+            "cached_tokens": sum(s["cached_tokens"] for s in stages.values()),
+            "cost_usd": round(sum(s["cost_usd"] for s in stages.values()), 6),
+        }
+        total["cache_hit_rate"] = _hit_rate(total)
+        return {"stages": stages, "nodes": nodes, "total": total}
+
+    def format_report(self) -> str:
+        """生成便于打印的分环节统计表和分节点缓存命中率表"""
+        report = self.report()
+        lines = [f"{'环节':<16}{'调用':>6}{'耗时(s)':>10}{'输入tok':>10}{'输出tok':>10}{'费用($)':>12}  模型"]
+        for name, stats in report["stages"].items():
+            lines.append(
+                f"{name:<16}{stats['calls']:>6}{stats['latency_s']:>10.2f}{stats['prompt_tokens']:>10}"
+                f"{stats['completion_tokens']:>10}{stats['cost_usd']:>12.5f}  {','.join(stats['models'])}"
+            )
+        total = report["total"]
+        lines.append(
+            f"{'total':<16}{total['calls']:>6}{total['latency_s']:>10.2f}{total['prompt_tokens']:>10}"
+            f"{total['completion_tokens']:>10}{total['cost_usd']:>12.5f}"
+        )
+        lines.append(f"{'节点':<20}{'调用':>6}{'输入tok':>10}{'缓存tok':>10}{'缓存命中率':>10}")
+        for name, stats in report["nodes"].items():
+            lines.append(
+                f"{name:<20}{stats['calls']:>6}{stats['prompt_tokens']:>10}{stats['cached_tokens']:>10}"
+                f"{stats['cache_hit_rate']:>10.1%}"
+            )
+        return "\n".join(lines)
+
+
+def _hit_rate(stats: dict) -> float:
+    """前缀缓存命中率 = 命中缓存的输入token / 全部输入token"""
+    if not stats["prompt_tokens"]:
+        return 0.0
+    return round(stats["cached_tokens"] / stats["prompt_tokens"], 4)